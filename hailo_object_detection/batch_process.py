@@ -0,0 +1,255 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from detection import get_detection_parser
+from parallel_replay import default_workers, recording_start_ns, replay_segment, write_detections
+
+# -----------------------------------------------------------------------------------------------
+# Resumable batch processing of archived clips
+# -----------------------------------------------------------------------------------------------
+# Re-scans directories of recordings with the detection pipeline of parallel_replay, one clip per
+# worker process (fakesink, no clock sync). Thousands of short clips keep every worker busy
+# without splitting clips; use parallel_replay for single long recordings.
+#
+#   <output>/journal.jsonl       one line per finished clip, appended and synced as it completes
+#   <output>/<clip>.npz          detections of the clip, the columns of the detection store
+#   <output>/summary.json        every clip of the journal with its frames/s, rewritten per run
+#
+# A clip is done when its journal line exists. The detection file is written to a temporary
+# name and renamed before the line is appended, so an interrupted run leaves at most
+# unjournaled work behind, which the next run repeats. The journal records the size and
+# modification time of every clip; a clip that changed since is processed again. Failed clips
+# are journaled with their error and retried by the next run unless --skip-failed is given.
+#
+# The number of concurrent pipelines is bounded by the cores (each decodes with two threads and
+# converts with three) and, with the hailo backend, by --npu-pipelines: the HailoRT scheduler
+# time-slices the networks of all pipelines on the device, so beyond a few pipelines more of
+# them only add context switches.
+
+JOURNAL_FILE = "journal.jsonl"
+SUMMARY_FILE = "summary.json"
+
+
+def find_clips(inputs, pattern="*.mp4"):
+    """
+    Expands directories (recursively, matching pattern), globs and files into a sorted list of
+    clip paths.
+    """
+    clips = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            clips.update(glob.glob(os.path.join(item, "**", pattern), recursive=True))
+        elif glob.has_magic(item):
+            clips.update(path for path in glob.glob(item, recursive=True) if os.path.isfile(path))
+        elif os.path.isfile(item):
+            clips.add(item)
+        else:
+            raise FileNotFoundError(f"No such clip or directory: {item}")
+    return sorted(os.path.abspath(path) for path in clips)
+
+
+def clip_signature(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+class WorkJournal:
+    """
+    Append-only record of processed clips, one JSON object per line. The last line of a clip
+    wins; a torn last line from an interrupted write is ignored.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        line = ""
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.entries[entry['clip']] = entry
+        self._file = open(path, "a")
+        if self._file.tell() and not line.endswith("\n"):
+            # Start after the torn line instead of continuing it
+            self._file.write("\n")
+
+    def is_done(self, clip, retry_failed=True):
+        entry = self.entries.get(clip)
+        if entry is None or (entry['status'] == "failed" and retry_failed):
+            return False
+        signature = clip_signature(clip)
+        return entry['size'] == signature['size'] and entry['mtime'] == signature['mtime']
+
+    def record(self, entry):
+        self.entries[entry['clip']] = entry
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def output_path(output_dir, root, clip):
+    # Mirrors the layout of the clips under the output directory
+    relative = os.path.relpath(clip, root) if root else os.path.basename(clip)
+    return os.path.join(output_dir, os.path.splitext(relative)[0] + ".npz")
+
+
+def process_clip(task):
+    """
+    Runs the detection pipeline over a whole clip and writes its detection file. Module-level so
+    a spawned worker can unpickle it.
+    """
+    result = replay_segment({
+        'path': task['clip'],
+        'index': 0,
+        'start_ns': 0,
+        'stop_ns': None,
+        'time_base_ns': recording_start_ns(task['clip']),
+        'app_args': task['app_args'],
+        'multi_process': task['multi_process'],
+    })
+    if not result['error']:
+        os.makedirs(os.path.dirname(task['output']), exist_ok=True)
+        # np.savez appends .npz to names without it
+        temporary = task['output'][:-len(".npz")] + ".partial.npz"
+        write_detections(result['block'], temporary)
+        os.replace(temporary, task['output'])
+    return {
+        'frames': result['frames'],
+        'detections': len(result['block']['time_ns']),
+        'elapsed': result['elapsed'],
+        'error': result['error'],
+    }
+
+
+def write_summary(journal, path):
+    clips = sorted(journal.entries.values(), key=lambda entry: entry['clip'])
+    done = [entry for entry in clips if entry['status'] == "done"]
+    elapsed = sum(entry['elapsed'] for entry in done)
+    summary = {
+        'clips': len(clips),
+        'done': len(done),
+        'failed': len(clips) - len(done),
+        'frames': sum(entry['frames'] for entry in done),
+        'detections': sum(entry['detections'] for entry in done),
+        # Sum of per-clip pipeline time; with concurrent workers the wall time is shorter
+        'pipeline_seconds': elapsed,
+        'per_clip': clips,
+    }
+    temporary = path + ".tmp"
+    with open(temporary, "w") as f:
+        json.dump(summary, f, indent=2)
+    os.replace(temporary, path)
+    return summary
+
+
+def run_batch(clips, output_dir, app_args, workers=None, npu_pipelines=4, retry_failed=True):
+    """
+    Processes every clip not yet in the journal of output_dir.
+
+    Returns:
+        list: Journal entries of the clips processed by this run.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    backend = get_detection_parser().parse_args(app_args).backend
+    workers = workers or default_workers(backend)
+    if backend == "hailo":
+        workers = min(workers, npu_pipelines)
+    root = os.path.commonpath([os.path.dirname(clip) for clip in clips]) if clips else None
+    journal = WorkJournal(os.path.join(output_dir, JOURNAL_FILE))
+    pending = [clip for clip in clips if not journal.is_done(clip, retry_failed)]
+    print(f"{len(clips)} clips, {len(clips) - len(pending)} already done, {len(pending)} to process on {workers} workers")
+
+    entries = []
+    # spawn and a fresh process per clip, as in parallel_replay
+    context = multiprocessing.get_context("spawn")
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=context, max_tasks_per_child=1)
+    try:
+        futures = {}
+        for clip in pending:
+            task = {
+                'clip': clip,
+                'output': output_path(output_dir, root, clip),
+                'app_args': list(app_args),
+                'multi_process': backend == "hailo" and workers > 1,
+            }
+            # The signature is taken before processing, a clip still being written is redone
+            futures[pool.submit(process_clip, task)] = (task, clip_signature(clip))
+        for future in as_completed(futures):
+            task, signature = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'frames': 0, 'detections': 0, 'elapsed': 0.0, 'error': repr(e)}
+            entry = {
+                'clip': task['clip'],
+                'status': "failed" if result['error'] else "done",
+                'output': None if result['error'] else task['output'],
+                'frames': result['frames'],
+                'detections': result['detections'],
+                'elapsed': result['elapsed'],
+                'fps': result['frames'] / result['elapsed'] if result['elapsed'] else 0.0,
+                'error': result['error'],
+                'finished': time.time(),
+                **signature,
+            }
+            journal.record(entry)
+            entries.append(entry)
+            print(
+                f"[{len(entries)}/{len(pending)}] {os.path.relpath(task['clip'], root or '.')}: "
+                + (f"failed: {entry['error']}" if entry['error'] else
+                   f"{entry['frames']} frames at {entry['fps']:.1f} fps, {entry['detections']} detections")
+            )
+    except KeyboardInterrupt:
+        # The workers get the interrupt too and report their clip as stopped early
+        print("Interrupted, the journal keeps the finished clips for the next run")
+        raise
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        write_summary(journal, os.path.join(output_dir, SUMMARY_FILE))
+        journal.close()
+    return entries
+
+
+def print_summary(entries, elapsed):
+    done = [entry for entry in entries if entry['status'] == "done"]
+    frames = sum(entry['frames'] for entry in done)
+    print(f"{'clip':<48}{'frames':>8}{'fps':>9}{'detections':>12}")
+    for entry in sorted(entries, key=lambda entry: entry['clip']):
+        name = os.path.basename(entry['clip'])
+        if entry['status'] == "done":
+            print(f"{name:<48}{entry['frames']:>8}{entry['fps']:>9.1f}{entry['detections']:>12}")
+        else:
+            print(f"{name:<48}{'failed':>8}")
+    print(
+        f"{len(done)} clips done, {len(entries) - len(done)} failed, {frames} frames in {elapsed:.1f}s "
+        f"({frames / elapsed if elapsed else 0.0:.1f} fps overall)"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the detection pipeline headless over directories or globs of clips, resuming "
+                    "interrupted runs. Arguments not listed here are passed to the detection app."
+    )
+    parser.add_argument("inputs", nargs="+", help="Clip files, directories or glob patterns")
+    parser.add_argument("--output", required=True, help="Directory of the detection files, journal and summary")
+    parser.add_argument("--pattern", default="*.mp4", help="Clips to pick up from directories")
+    parser.add_argument("--workers", type=int, default=None, help="Concurrent pipelines, sized to the cores by default")
+    parser.add_argument("--npu-pipelines", type=int, default=4, help="Most concurrent pipelines on the Hailo device")
+    parser.add_argument("--skip-failed", action="store_true", help="Do not retry clips that failed in an earlier run")
+    args, app_args = parser.parse_known_args()
+
+    clips = find_clips(args.inputs, args.pattern)
+    start = time.perf_counter()
+    entries = run_batch(clips, args.output, app_args, args.workers, args.npu_pipelines, not args.skip_failed)
+    print_summary(entries, time.perf_counter() - start)
@@ -0,0 +1,105 @@
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstVideo', '1.0')
+from gi.repository import Gst, GstVideo
+import argparse
+import time
+import numpy as np
+from hailo_rpi_common import get_numpy_from_buffer, get_numpy_view_from_buffer
+
+# -----------------------------------------------------------------------------------------------
+# Micro-benchmark: bytes copied per frame by the buffer access paths
+# -----------------------------------------------------------------------------------------------
+# Builds padded GstBuffers with a GstVideoMeta (like libcamerasrc at 1536x864) and compares:
+# - legacy: map + np.ndarray(...).copy() on the packed layout (ignores strides)
+# - copy:   get_numpy_from_buffer (stride-aware, owns its data)
+# - view:   get_numpy_view_from_buffer (stride-aware, zero-copy)
+
+GST_FORMATS = {
+    'RGB': GstVideo.VideoFormat.RGB,
+    'NV12': GstVideo.VideoFormat.NV12,
+    'YUYV': GstVideo.VideoFormat.YUY2,
+}
+
+def make_padded_buffer(format, width, height, row_padding):
+    if format == 'NV12':
+        stride = width + row_padding
+        offsets = [0, stride * height]
+        strides = [stride, stride]
+        size = stride * height + stride * (height // 2)
+    else:
+        bytes_per_pixel = 3 if format == 'RGB' else 2
+        stride = width * bytes_per_pixel + row_padding
+        offsets = [0]
+        strides = [stride]
+        size = stride * height
+    data = np.random.randint(0, 256, size, dtype=np.uint8).tobytes()
+    buffer = Gst.Buffer.new_wrapped(data)
+    GstVideo.buffer_add_video_meta_full(
+        buffer, GstVideo.VideoFrameFlags.NONE, GST_FORMATS[format],
+        width, height, len(offsets), offsets, strides
+    )
+    return buffer
+
+def legacy_copy(buffer, format, width, height):
+    success, map_info = buffer.map(Gst.MapFlags.READ)
+    try:
+        if format == 'RGB':
+            return np.ndarray(shape=(height, width, 3), dtype=np.uint8, buffer=map_info.data).copy()
+        if format == 'NV12':
+            y_plane_size = width * height
+            y_plane = np.ndarray(shape=(height, width), dtype=np.uint8, buffer=map_info.data[:y_plane_size]).copy()
+            uv_plane = np.ndarray(shape=(height//2, width//2, 2), dtype=np.uint8, buffer=map_info.data[y_plane_size:]).copy()
+            return y_plane, uv_plane
+        return np.ndarray(shape=(height, width, 2), dtype=np.uint8, buffer=map_info.data).copy()
+    finally:
+        buffer.unmap(map_info)
+
+def owned_bytes(planes):
+    # Bytes that were allocated and copied for this frame
+    planes = planes if isinstance(planes, tuple) else (planes,)
+    return sum(plane.nbytes for plane in planes if plane.flags.owndata)
+
+def run_view(buffer, format, width, height):
+    with get_numpy_view_from_buffer(buffer, format, width, height) as planes:
+        copied = owned_bytes(planes)
+        # Touch the data so the view path is not measured as a no-op
+        first = planes[0] if isinstance(planes, tuple) else planes
+        first[::64, ::64].sum()
+    return copied
+
+def run_owned(fn):
+    def run(buffer, format, width, height):
+        planes = fn(buffer, format, width, height)
+        first = planes[0] if isinstance(planes, tuple) else planes
+        first[::64, ::64].sum()
+        return owned_bytes(planes)
+    return run
+
+def benchmark(name, fn, buffer, format, width, height, iterations):
+    try:
+        copied = fn(buffer, format, width, height)
+    except (TypeError, ValueError) as e:
+        print(f"{name:>7}: failed on padded buffer ({e})")
+        return
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(buffer, format, width, height)
+    elapsed = (time.perf_counter() - start) / iterations
+    print(f"{name:>7}: {copied:>10} bytes copied/frame, {elapsed * 1e6:8.1f} us/frame")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark GstBuffer to numpy access paths")
+    parser.add_argument("--width", type=int, default=1536)
+    parser.add_argument("--height", type=int, default=864)
+    parser.add_argument("--row-padding", type=int, default=64, help="Extra bytes at the end of each row")
+    parser.add_argument("--iterations", type=int, default=500)
+    args = parser.parse_args()
+
+    Gst.init(None)
+    for format in GST_FORMATS:
+        print(f"{format} {args.width}x{args.height}, row padding {args.row_padding} bytes")
+        buffer = make_padded_buffer(format, args.width, args.height, args.row_padding)
+        benchmark("legacy", run_owned(legacy_copy), buffer, format, args.width, args.height, args.iterations)
+        benchmark("copy", run_owned(get_numpy_from_buffer), buffer, format, args.width, args.height, args.iterations)
+        benchmark("view", run_view, buffer, format, args.width, args.height, args.iterations)
@@ -0,0 +1,196 @@
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+# The real hailo module reads metadata that only hailofilter attaches; swap in the synthetic
+# stand-in before the detection app imports it
+import synthetic_hailo
+sys.modules['hailo'] = synthetic_hailo
+# GStreamerApp insists on a TAPPAS installation, which the stand-in pipeline does not use
+os.environ.setdefault('TAPPAS_POST_PROC_DIR', '/nonexistent')
+
+from detection import GStreamerDetectionApp, get_detection_parser, user_app_callback_class
+
+# -----------------------------------------------------------------------------------------------
+# Headless pipeline benchmark
+# -----------------------------------------------------------------------------------------------
+# Runs the real GStreamerDetectionApp pipeline construction, app_callback, frame access and
+# display handoff without a camera or Hailo hardware:
+# - videotestsrc (or a file) is the source
+# - hailonet/hailofilter are identity stand-ins with a configurable inference delay, and
+#   SyntheticDetector attaches detections for the callback
+# - hailomuxer is replaced by funnel with the bypass side dropped, so the inference-side buffer
+#   passes unchanged like the muxer's passthrough, and hailooverlay by identity
+# - everything ends in fakesink, and the user frames are drained by a headless consumer
+# For every resolution/format combination it reports throughput, end-to-end and per-stage
+# latency percentiles and the CPU time of every streaming thread.
+
+RESOLUTIONS = ("640x480", "1280x720", "1920x1080")
+FORMATS = ("I420", "NV12", "YUY2", "RGB")
+
+
+def drain_user_frames(user_data):
+    # Headless replacement for display_user_data_frame
+    while user_data.running:
+        user_data.get_frame(timeout=0.1)
+
+
+def thread_cpu_times():
+    """
+    Returns {thread name: CPU seconds} for every thread of this process. GStreamer names its
+    streaming threads after the element and pad they run (e.g. "queue_scale:src").
+    """
+    ticks = os.sysconf('SC_CLK_TCK')
+    times = {}
+    for tid in os.listdir('/proc/self/task'):
+        try:
+            with open(f'/proc/self/task/{tid}/comm') as f:
+                name = f.read().strip()
+            with open(f'/proc/self/task/{tid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        # utime and stime are fields 14 and 15 of the stat line, 11 and 12 after the comm
+        times[name] = times.get(name, 0.0) + (int(fields[11]) + int(fields[12])) / ticks
+    return times
+
+
+class BenchmarkDetectionApp(GStreamerDetectionApp):
+    muxer_element = "funnel"
+    overlay_element = "identity"
+
+    def __init__(self, args, user_data, source_format, width, height, num_buffers, inference_delay_us, objects):
+        self.source_format = source_format
+        self.source_width = width
+        self.source_height = height
+        self.num_buffers = num_buffers
+        self.inference_delay_us = inference_delay_us
+        self.detector = synthetic_hailo.SyntheticDetector(objects=objects)
+        super().__init__(args, user_data)
+        self.user_frame_consumer = drain_user_frames
+
+        self.frame_times = {}
+        self.latencies = []
+        # The synthetic detections are looked up by pts, so the inference side alone carries
+        # everything the callback needs; the bypass frames end at the funnel
+        self.pipeline.get_by_name("hmux").get_static_pad("sink_0").add_probe(
+            Gst.PadProbeType.BUFFER, lambda pad, info: Gst.PadProbeReturn.DROP
+        )
+        self.pipeline.get_by_name("src_0").get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self._on_source)
+        self.pipeline.get_by_name("identity_callback").get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self._on_output)
+
+    def create_pipeline(self):
+        self.video_sink = "fakesink"
+        super().create_pipeline()
+
+    def get_source_element(self, index, full_resolution=False):
+        if self.video_sources[index] != "videotestsrc":
+            return super().get_source_element(index, full_resolution)
+        source_element = (
+            f"videotestsrc name=src_{index} pattern=ball is-live=false num-buffers={self.num_buffers} ! "
+            f"video/x-raw, format={self.source_format}, width={self.source_width}, height={self.source_height}, framerate=30/1 ! "
+        )
+        return source_element + self.get_scale_convert_element(self.stream_suffix(index))
+
+    def get_inference_element(self):
+        # identity sleep-time stands in for the NPU round trip
+        return (
+            self.queue("queue_hailonet")
+            + "videoconvert n-threads=3 ! "
+            f"identity name=hailonet sleep-time={self.inference_delay_us} ! "
+            + self.queue("queue_hailofilter")
+            + "identity name=hailofilter ! "
+        )
+
+    def attach_inference(self):
+        super().attach_inference()
+        self.detector.attach(self.pipeline.get_by_name("hailofilter"))
+
+    def _on_source(self, pad, info):
+        buffer = info.get_buffer()
+        if buffer is not None:
+            self.frame_times[buffer.pts] = time.perf_counter()
+        return Gst.PadProbeReturn.OK
+
+    def _on_output(self, pad, info):
+        buffer = info.get_buffer()
+        if buffer is not None:
+            start = self.frame_times.pop(buffer.pts, None)
+            if start is not None:
+                self.latencies.append(time.perf_counter() - start)
+        return Gst.PadProbeReturn.OK
+
+
+def run_case(args, source_format, resolution):
+    width, height = (int(v) for v in resolution.split("x")) if resolution != "native" else (None, None)
+    app_args = get_detection_parser().parse_args(
+        ["--input", args.input, "--disable-sync", "--instrument", "--instrument-interval", "0"]
+        + (["--use-frame"] if args.use_frame else [])
+    )
+    user_data = user_app_callback_class()
+    # Keep the benchmark output readable
+    user_data.logger.interval = float("inf")
+    app = BenchmarkDetectionApp(app_args, user_data, source_format, width, height, args.frames, args.inference_delay_us, args.objects)
+
+    cpu_before = thread_cpu_times()
+    start = time.perf_counter()
+    app.run()
+    elapsed = time.perf_counter() - start
+    cpu_after = thread_cpu_times()
+
+    cpu = {name: cpu_after[name] - cpu_before.get(name, 0.0) for name in cpu_after}
+    latencies = np.array(app.latencies) * 1e3
+    return {
+        'format': source_format,
+        'resolution': resolution,
+        'frames': user_data.get_count(),
+        'fps': user_data.get_count() / elapsed,
+        'latency_ms': {p: float(np.percentile(latencies, p)) if len(latencies) else 0.0 for p in (50, 95, 99)},
+        'cpu_s': {name: seconds for name, seconds in cpu.items() if seconds > 0},
+        'stages': app.instrumentation.snapshot(),
+        'queue_drops': app.queue_drops.get_stats(),
+        'user_frames': user_data.get_frame_stats() if args.use_frame else None,
+    }
+
+
+def print_result(result, verbose):
+    latency = result['latency_ms']
+    print(
+        f"{result['format']:<6}{result['resolution']:>11}{result['frames']:>8}{result['fps']:>9.1f}"
+        f"{latency[50]:>9.2f}{latency[95]:>9.2f}{latency[99]:>9.2f}"
+    )
+    if not verbose:
+        return
+    for name, seconds in sorted(result['cpu_s'].items(), key=lambda item: -item[1]):
+        print(f"    cpu {name:<24}{seconds * 1e3 / max(result['frames'], 1):>8.3f} ms/frame")
+    for name, stats in result['stages'].items():
+        print(f"    stage {name:<22}p50 {stats['p50_ms']:>7.2f} ms  p95 {stats['p95_ms']:>7.2f} ms")
+    for name, counts in result['queue_drops'].items():
+        if counts['dropped'] or counts['expired'] or counts['blocked']:
+            print(f"    queue {name:<22}dropped {counts['dropped']} expired {counts['expired']} blocked {counts['blocked']}")
+    if result['user_frames'] is not None:
+        print(f"    user frames {result['user_frames']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless benchmark of the detection pipeline")
+    parser.add_argument("--input", default="videotestsrc", help="videotestsrc or a video file")
+    parser.add_argument("--frames", type=int, default=300, help="Frames per case (videotestsrc only)")
+    parser.add_argument("--resolutions", nargs="+", default=RESOLUTIONS)
+    parser.add_argument("--formats", nargs="+", default=FORMATS)
+    parser.add_argument("--objects", type=int, default=10, help="Synthetic objects per frame")
+    parser.add_argument("--inference-delay-us", type=int, default=0, help="Simulated NPU time per frame")
+    parser.add_argument("--use-frame", action="store_true", help="Benchmark the user frame handoff too")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Show CPU and latency per stage")
+    args = parser.parse_args()
+
+    Gst.init(None)
+    cases = [(f, r) for f in args.formats for r in args.resolutions] if args.input == "videotestsrc" else [("file", "native")]
+    print(f"{'format':<6}{'resolution':>11}{'frames':>8}{'fps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for source_format, resolution in cases:
+        print_result(run_case(args, source_format, resolution), args.verbose)
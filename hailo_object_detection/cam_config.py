@@ -0,0 +1,88 @@
+from uvccamconfig import UVCCamera, CameraSettings
+
+
+class CameraConfigurator:
+    """
+    Sets the capture format and controls of a UVC camera in-process through UVCCamera, instead of
+    one v4l2-ctl process per control.
+
+    Args:
+        camera (UVCCamera, optional): Camera to configure, opened on video_device by default.
+    """
+    def __init__(self, video_device, width=640, height=480, pixel_format='YUYV', camera=None):
+        self.video_device = video_device
+        self.width = width
+        self.height = height
+        self.pixel_format = pixel_format
+        self.camera = camera or UVCCamera(video_device)
+
+    def _get_camera_info(self):
+        try:
+            controls = self.camera.get_all_controls()
+        except OSError as e:
+            print(f"Failed to retrieve camera info: {e}")
+            return {}
+        print("=== Camera Info ===")
+        for info in controls.values():
+            print(f"{info['key']:<32}{info['current_value']!s:>8}  [{info['minimum']}, {info['maximum']}]")
+        print("===================")
+        return controls
+
+    def adjust_camera_settings_for_opencv(self):
+        print("Adjusting camera settings for OpenCV compatibility...")
+
+        # Adjust pixel format and resolution based on external settings
+        print(f"Setting format: {self.width}x{self.height} {self.pixel_format}")
+        try:
+            width, height, pixel_format = self.camera.set_format(self.width, self.height, self.pixel_format)
+        except OSError as e:
+            print(f"Failed to set format: {e}")
+            return
+
+        # The driver settles on the closest format it supports
+        if (width, height) != (self.width, self.height):
+            print(f"Warning: Resolution {self.width}x{self.height} was not applied. The camera might not support this resolution.")
+        if pixel_format != self.pixel_format:
+            print(f"Warning: Pixel format {self.pixel_format} was not applied, the camera uses {pixel_format}.")
+
+        print("Camera settings adjusted.")
+
+    def apply_camera_settings(self, camera_settings):
+        """
+        Writes the settings that differ from the camera's current state in a single ioctl.
+
+        Args:
+            camera_settings (CameraSettings or dict): Desired values by control key.
+
+        Returns:
+            ApplyResult
+        """
+        print("Applying modifiable controls to the camera...")
+        result = self.camera.apply_settings(camera_settings)
+        for control, (old, new) in result.changed.items():
+            print(f"Set {control}: {old} -> {new}")
+        for control, reason in result.skipped.items():
+            print(f"Skipped {control}: {reason}")
+        for control, reason in result.failed.items():
+            print(f"Error setting {control}: {reason}")
+        print(f"Applied {len(result.changed)} control(s) in {result.elapsed * 1e3:.1f} ms")
+        return result
+
+    def close(self):
+        self.camera.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Apply the default camera settings to a UVC camera")
+    parser.add_argument("--device", default="/dev/video0")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--pixel-format", default="YUYV")
+    args = parser.parse_args()
+
+    configurator = CameraConfigurator(args.device, args.width, args.height, args.pixel_format)
+    configurator.adjust_camera_settings_for_opencv()
+    configurator.apply_camera_settings(CameraSettings())
+    configurator.close()
@@ -0,0 +1,237 @@
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+# -----------------------------------------------------------------------------------------------
+# Event-triggered clip recording
+# -----------------------------------------------------------------------------------------------
+# The live pipeline encodes the annotated video once (see ENCODER_BRANCH) and hands the H.264
+# access units to an appsink. ClipRecorder keeps the last pre_roll seconds of them in memory,
+# grouped by GOP so the ring always starts on a keyframe. When trigger() is called the pre-roll
+# and everything up to post_roll seconds after the last trigger is written to an MP4 by a
+# separate appsrc ! h264parse ! mp4mux ! filesink pipeline running on its own thread.
+# Nothing is re-encoded and the appsink callback never waits on disk I/O.
+
+def ENCODER_BRANCH(tee_name, bitrate=2048, key_int_max=30, clip_sink=True):
+    """
+    Pipeline fragment that encodes the branch of tee_name once and exposes the result on a tee
+    named encoded_t, with an appsink named clip_sink hanging off it unless clip_sink is False.
+    Other consumers of the encoded stream (see STREAM_BRANCH) branch off encoded_t as well.
+    """
+    pipeline_string = (
+        f"{tee_name}. ! "
+        "queue name=queue_encoder leaky=downstream max-size-buffers=5 max-size-bytes=0 max-size-time=0 ! "
+        "videoconvert n-threads=2 qos=false ! video/x-raw, format=I420 ! "
+        f"x264enc name=encoder tune=zerolatency speed-preset=ultrafast bitrate={bitrate} key-int-max={key_int_max} ! "
+        "h264parse config-interval=-1 ! video/x-h264, stream-format=byte-stream, alignment=au ! "
+        "tee name=encoded_t "
+    )
+    if clip_sink:
+        pipeline_string += (
+            "encoded_t. ! queue name=queue_clip_sink max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! "
+            "appsink name=clip_sink emit-signals=true sync=false async=false "
+        )
+    return pipeline_string
+
+
+class EncodedPacket:
+    __slots__ = ('data', 'pts', 'dts', 'duration', 'keyframe')
+
+    def __init__(self, data, pts, dts, duration, keyframe):
+        self.data = data
+        self.pts = pts
+        self.dts = dts
+        self.duration = duration
+        self.keyframe = keyframe
+
+
+# Packets a clip writer may fall behind by after its pre-roll, a minute of 30 fps video
+MAX_PENDING_PACKETS = 1800
+
+
+class ClipWriter(threading.Thread):
+    """
+    Muxes queued EncodedPackets into an MP4 file. Packets are pushed with put() and the file is
+    finalized after finish() once the queue is drained.
+
+    Args:
+        max_packets (int): Packets queued before new ones are dropped.
+    """
+    def __init__(self, path, caps, max_packets=MAX_PENDING_PACKETS):
+        super().__init__(name=f"clip_writer {os.path.basename(path)}", daemon=True)
+        self.path = path
+        self.caps = caps
+        self.packets = queue.Queue(maxsize=max_packets)
+        self.base_pts = None
+        self.dropped = 0
+        self._finishing = threading.Event()
+        self._skip_to_keyframe = False
+
+    def put(self, packet):
+        """
+        Queues a packet without blocking the streaming thread. When the writer is behind, packets
+        are dropped up to the next keyframe so the clip stays decodable.
+        """
+        if self._skip_to_keyframe and not packet.keyframe:
+            self.dropped += 1
+            return False
+        try:
+            self.packets.put_nowait(packet)
+        except queue.Full:
+            self.dropped += 1
+            self._skip_to_keyframe = True
+            return False
+        self._skip_to_keyframe = False
+        return True
+
+    def finish(self):
+        self._finishing.set()
+
+    def _rebase(self, timestamp):
+        if timestamp == Gst.CLOCK_TIME_NONE:
+            return timestamp
+        return max(timestamp - self.base_pts, 0)
+
+    def run(self):
+        pipeline = Gst.parse_launch(
+            "appsrc name=clip_src format=time ! h264parse ! mp4mux ! "
+            f"filesink location={self.path}"
+        )
+        appsrc = pipeline.get_by_name("clip_src")
+        appsrc.set_property("caps", self.caps)
+        pipeline.set_state(Gst.State.PLAYING)
+
+        while True:
+            try:
+                packet = self.packets.get(timeout=0.1)
+            except queue.Empty:
+                # Nothing is put after finish(), an empty queue then holds the whole clip
+                if self._finishing.is_set():
+                    break
+                continue
+            if self.base_pts is None:
+                self.base_pts = packet.pts
+            buffer = Gst.Buffer.new_wrapped(packet.data)
+            buffer.pts = self._rebase(packet.pts)
+            buffer.dts = self._rebase(packet.dts)
+            buffer.duration = packet.duration
+            if not packet.keyframe:
+                buffer.set_flags(Gst.BufferFlags.DELTA_UNIT)
+            appsrc.emit("push-buffer", buffer)
+
+        # mp4mux writes the moov atom on EOS, wait for it before closing the file
+        appsrc.emit("end-of-stream")
+        bus = pipeline.get_bus()
+        message = bus.timed_pop_filtered(10 * Gst.SECOND, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+        if message is not None and message.type == Gst.MessageType.ERROR:
+            err, debug = message.parse_error()
+            print(f"Error writing clip {self.path}: {err}, {debug}")
+        pipeline.set_state(Gst.State.NULL)
+        print(f"Clip saved: {self.path}" + (f", {self.dropped} packets dropped" if self.dropped else ""))
+
+
+class ClipRecorder:
+    """
+    Keyframe-aligned in-memory pre-roll of encoded video, flushed to disk on trigger.
+
+    Args:
+        output_dir (str): Directory the MP4 clips are written to.
+        pre_roll (float): Seconds of video kept before a trigger.
+        post_roll (float): Seconds of video recorded after the last trigger.
+    """
+    def __init__(self, output_dir, pre_roll=10.0, post_roll=5.0):
+        self.output_dir = output_dir
+        self.pre_roll = int(pre_roll * Gst.SECOND)
+        self.post_roll = int(post_roll * Gst.SECOND)
+        os.makedirs(output_dir, exist_ok=True)
+        # Each entry is one GOP: a list of packets starting with a keyframe
+        self.gops = deque()
+        self.caps = None
+        self.writer = None
+        # Every writer that may still be muxing; close() waits for all of them
+        self.writers = []
+        self.record_until = 0
+        self.last_pts = 0
+        self.clips = 0
+        self.lock = threading.Lock()
+
+    def attach(self, appsink):
+        appsink.connect("new-sample", self.on_new_sample)
+
+    def on_new_sample(self, appsink):
+        sample = appsink.emit("pull-sample")
+        if sample is None:
+            return Gst.FlowReturn.OK
+        if self.caps is None:
+            self.caps = sample.get_caps()
+        buffer = sample.get_buffer()
+        packet = EncodedPacket(
+            buffer.extract_dup(0, buffer.get_size()),
+            buffer.pts, buffer.dts, buffer.duration,
+            not buffer.has_flags(Gst.BufferFlags.DELTA_UNIT),
+        )
+        with self.lock:
+            self._append(packet)
+        return Gst.FlowReturn.OK
+
+    def _append(self, packet):
+        self.last_pts = packet.pts
+        if packet.keyframe or not self.gops:
+            self.gops.append([packet])
+        else:
+            self.gops[-1].append(packet)
+        # Drop whole GOPs as long as the remaining ones still cover the pre-roll
+        while len(self.gops) > 1 and packet.pts - self.gops[1][0].pts >= self.pre_roll:
+            self.gops.popleft()
+
+        if self.writer is not None:
+            self.writer.put(packet)
+            if packet.pts >= self.record_until:
+                self.writer.finish()
+                self.writer = None
+
+    def trigger(self, reason=""):
+        """
+        Starts a clip with the current pre-roll, or extends the clip being recorded.
+        Safe to call from any thread, every frame.
+        """
+        with self.lock:
+            self.record_until = self.last_pts + self.post_roll
+            if self.writer is not None or self.caps is None or not self.gops:
+                return
+            self.clips += 1
+            name = time.strftime("clip_%Y%m%d_%H%M%S") + f"_{self.clips:04d}.mp4"
+            pre_roll_packets = sum(len(gop) for gop in self.gops)
+            self.writer = ClipWriter(
+                os.path.join(self.output_dir, name), self.caps, max_packets=pre_roll_packets + MAX_PENDING_PACKETS
+            )
+            self.writers = [writer for writer in self.writers if writer.is_alive()]
+            self.writers.append(self.writer)
+            for gop in self.gops:
+                for packet in gop:
+                    self.writer.put(packet)
+            self.writer.start()
+        print(f"Recording {name} {reason}")
+
+    def close(self, timeout=15):
+        with self.lock:
+            if self.writer is not None:
+                self.writer.finish()
+                self.writer = None
+            writers, self.writers = self.writers, []
+        # Writers are daemon threads; a clip still muxing at exit would miss its moov atom
+        deadline = time.monotonic() + timeout
+        for writer in writers:
+            writer.join(timeout=max(deadline - time.monotonic(), 0.1))
+
+
+def add_clip_recorder_arguments(parser):
+    parser.add_argument("--record-clips", default=None, metavar="DIR", help="Save event clips to this directory")
+    parser.add_argument("--pre-roll", type=float, default=10.0, help="Seconds of video kept before an event")
+    parser.add_argument("--post-roll", type=float, default=5.0, help="Seconds of video recorded after an event")
+    return parser
@@ -4,19 +4,43 @@ from gi.repository import Gst, GLib
 import os
 import argparse
 import multiprocessing
+import signal
+import threading
 import numpy as np
 import setproctitle
 import cv2
 import time
-import hailo
+# Only the in-pipeline "hailo" backend needs the hailo module
+try:
+    import hailo
+except ImportError:
+    hailo = None
 from hailo_rpi_common import (
     get_default_parser,
-    QUEUE,
     get_caps_from_pad,
-    get_numpy_from_buffer,
+    get_source_index,
+    get_numpy_view_from_buffer,
     GStreamerApp,
     app_callback_class,
 )
+from detection_batch import LabelTable, RateLimitedLogger, extract_detections
+from motion_gate import MotionGate, add_motion_gate_arguments
+from tracker import Tracker
+from clip_recorder import ClipRecorder, ENCODER_BRANCH, add_clip_recorder_arguments
+from tiling import TileScheduler, TILE_CROPPER, add_tiling_arguments, compute_tile_grid
+from inference_backend import BACKEND_BRIDGE, BackendBridge, add_backend_arguments, create_backend
+from sky_exposure import SkyExposureController, add_sky_exposure_arguments
+from stream_output import STREAM_BRANCH, AdaptiveEncoder, add_stream_arguments
+from detection_store import DetectionStore, DetectionWriter, add_detection_store_arguments
+from inference_swap import InferenceSwapper, add_inference_swap_arguments, load_inference_config
+from sky_geometry import (
+    SkyGeometry,
+    SKY_CROP,
+    add_sky_geometry_arguments,
+    camera_geometry_from_args,
+    find_sky_crop,
+    load_obstruction_mask,
+)
 
 # -----------------------------------------------------------------------------------------------
 # User-defined class to be used in the callback function
@@ -26,10 +50,34 @@ class user_app_callback_class(app_callback_class):
     def __init__(self):
         super().__init__()
         self.new_variable = 42  # New variable example
+        self.label_table = LabelTable()
+        self.target_labels = ("person",)
+        self.min_confidence = 0.0
+        # Printing every frame from the streaming thread is expensive, log at most once a second
+        self.logger = RateLimitedLogger(interval=1.0)
+        # Persistent tracks across frames per source, fed with every detection above min_confidence
+        self.trackers = {}
+        # Set by the app when --record-clips is used
+        self.clip_recorder = None
+        # Set by the app when an out-of-pipeline --backend delivers the detections
+        self.backend_bridge = None
+        # Set by the app when --sky-geometry is used
+        self.sky_geometry = None
+        # Set by the app when --sky-crop is used, the detections are mapped back to the full frame
+        self.sky_crop = None
+        # Set by the app when --store is used
+        self.detection_writer = None
+        # Set when replaying a recording: frames are timed from its start instead of the wall clock
+        self.time_base_ns = None
     
     def new_function(self):  # New function example
         return "The meaning of life is: "
 
+    def get_tracker(self, source_index):
+        if source_index not in self.trackers:
+            self.trackers[source_index] = Tracker()
+        return self.trackers[source_index]
+
 # -----------------------------------------------------------------------------------------------
 # User-defined callback function
 # -----------------------------------------------------------------------------------------------
@@ -44,42 +92,61 @@ def app_callback(pad, info, user_data):
         
     # Using the user_data to count the number of frames
     user_data.increment()
-    string_to_print = f"Frame count: {user_data.get_count()}\n"
     
     # Get the caps from the pad
     format, width, height = get_caps_from_pad(pad)
 
+    # Get the detections from the buffer as numpy arrays
+    if user_data.backend_bridge is not None:
+        batch = user_data.backend_bridge.pop_detections(buffer.pts)
+    else:
+        roi = hailo.get_roi_from_buffer(buffer)
+        batch = extract_detections(roi, buffer.pts, hailo.HAILO_DETECTION, user_data.label_table)
+    if user_data.sky_crop is not None:
+        # Boxes are relative to the cropped frame; tracking and geometry work on the full frame
+        batch.boxes = user_data.sky_crop.to_full_frame(batch.boxes)
+    targets = batch.filter(labels=user_data.target_labels, min_confidence=user_data.min_confidence)
+    detection_count = len(targets)
+    source_index = get_source_index(pad)
+    tracker = user_data.get_tracker(source_index)
+    tracked = batch.filter(min_confidence=user_data.min_confidence)
+    tracks = tracker.update(tracked)
+    if user_data.detection_writer is not None:
+        frame_time = time.time_ns() if user_data.time_base_ns is None else user_data.time_base_ns + buffer.pts
+        user_data.detection_writer.append(frame_time, buffer.pts, source_index, tracked, tracker.detection_track_ids)
+    if user_data.clip_recorder is not None and len(tracks):
+        user_data.clip_recorder.trigger(f"({len(tracks)} tracks)")
+    if user_data.sky_geometry is not None and detection_count:
+        # Direction and range bounds of the whole batch at once
+        geometry = user_data.sky_geometry.describe(targets.boxes)
+        nearest = int(np.argmin(geometry.range_max))
+        user_data.logger.log(
+            "Frame count: {}\nSource {}: Detections: {} Tracks: {}\n"
+            "Nearest: bearing {:.1f} deg, elevation {:.1f} deg, {:.2f} deg across, {:.0f}-{:.0f} m",
+            user_data.get_count(), source_index, detection_count, len(tracks),
+            geometry.bearing[nearest], geometry.elevation[nearest], geometry.angular_size[nearest],
+            geometry.range_min[nearest], geometry.range_max[nearest]
+        )
+    elif detection_count or len(tracks):
+        user_data.logger.log(
+            "Frame count: {}\nSource {}: Detections: {} Tracks: {}",
+            user_data.get_count(), source_index, detection_count, len(tracks)
+        )
+
     # If the user_data.use_frame is set to True, we can get the video frame from the buffer
-    frame = None
     if user_data.use_frame and format is not None and width is not None and height is not None:
-        # Get video frame
-        frame = get_numpy_from_buffer(buffer, format, width, height)
-
-    # Get the detections from the buffer
-    roi = hailo.get_roi_from_buffer(buffer)
-    detections = roi.get_objects_typed(hailo.HAILO_DETECTION)
-    
-    # Parse the detections
-    detection_count = 0
-    for detection in detections:
-        label = detection.get_label()
-        bbox = detection.get_bbox()
-        confidence = detection.get_confidence()
-        if label == "person":
-            string_to_print += f"Detection: {label} {confidence:.2f}\n"
-            detection_count += 1
-    if user_data.use_frame:
+        # The view is read-only and only valid inside the with block.
+        # The BGR conversion below is the single copy we make of the frame.
+        with get_numpy_view_from_buffer(buffer, format, width, height) as frame:
+            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
         # Note: using imshow will not work here, as the callback function is not running in the main thread
         # Let's print the detection count to the frame
         cv2.putText(frame, f"Detections: {detection_count}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
         # Example of how to use the new_variable and new_function from the user_data
         # Let's print the new_variable and the result of the new_function to the frame
         cv2.putText(frame, f"{user_data.new_function()} {user_data.new_variable}", (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-        # Convert the frame to BGR
-        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
         user_data.set_frame(frame)
 
-    print(string_to_print)
     return Gst.PadProbeReturn.OK
     
 
@@ -89,17 +156,22 @@ def app_callback(pad, info, user_data):
 
 # This class inherits from the hailo_rpi_common.GStreamerApp class
 class GStreamerDetectionApp(GStreamerApp):
+    # Element factories used around hailonet; the benchmark swaps them for stand-ins
+    muxer_element = "hailomuxer"
+    overlay_element = "hailooverlay"
+
     def __init__(self, args, user_data):
         # Call the parent class constructor
         super().__init__(args, user_data)
         # Additional initialization code can be added here
         # Set Hailo parameters these parameters should be set based on the model used
-        self.batch_size = 2
+        # With several sources, one batch holds one frame of every camera
+        self.batch_size = max(2, self.num_sources)
         self.network_width = 640
         self.network_height = 640
         self.network_format = "RGB"
-        nms_score_threshold = 0.3 
-        nms_iou_threshold = 0.45
+        self.nms_score_threshold = 0.3
+        self.nms_iou_threshold = 0.45
         
         # Temporary code: new postprocess will be merged to TAPPAS.
         # Check if new postprocess so file exists
@@ -133,75 +205,450 @@ class GStreamerDetectionApp(GStreamerApp):
 
         self.app_callback = app_callback
     
-        self.thresholds_str = (
-            f"nms-score-threshold={nms_score_threshold} "
-            f"nms-iou-threshold={nms_iou_threshold} "
-            f"output-format-type=HAILO_FORMAT_TYPE_FLOAT32"
-        )
+        self.thresholds_str = self.get_thresholds_string()
 
         # Set the process title
         setproctitle.setproctitle("Hailo Detection App")
 
+        self.backend = args.backend
+        if self.backend == "hailo" and hailo is None:
+            print("The hailo module is missing. Use --backend hailort or --backend cpu without TAPPAS.")
+            exit(1)
+        if self.backend != "hailo" and (self.num_sources > 1 or args.motion_gate or args.tiles):
+            print(f"The {self.backend} backend supports a single source without motion gate or tiling.")
+            exit(1)
+
+        self.record_clips = args.record_clips
+        self.stream_clients = args.stream
+        self.tiling = args.tiles
+        if self.num_sources > 1 and (self.record_clips or self.stream_clients or args.motion_gate or self.tiling):
+            print("Clip recording, streaming, the motion gate and tiling support a single source only, disabling them.")
+            self.record_clips = None
+            self.stream_clients = None
+            args.motion_gate = False
+            self.tiling = False
+        if self.tiling:
+            self.tile_scheduler = TileScheduler(
+                tile_size=self.network_width, min_overlap=args.tile_overlap, interval=args.tile_interval
+            )
+
+        # Camera geometry for --sky-geometry and --sky-crop, the tables are cached across runs
+        self.sky_geometry = None
+        self.sky_crop = None
+        if args.sky_geometry or args.sky_crop:
+            if self.num_sources > 1:
+                print("Sky geometry and cropping support a single source only, disabling them.")
+            else:
+                width, height = self.get_source_resolution(0)
+                self.sky_geometry = SkyGeometry(camera_geometry_from_args(args, width, height))
+        if args.sky_crop and self.sky_geometry is not None:
+            if self.source_type == "file":
+                # The crop is in capture pixels, unknown for a file before it is decoded
+                print("Sky cropping needs a camera source, disabling it.")
+            else:
+                width, height = self.get_source_resolution(0)
+                obstruction = load_obstruction_mask(args.obstruction_mask, width, height) if args.obstruction_mask else None
+                self.sky_crop = find_sky_crop(self.sky_geometry, args.horizon_elevation, obstruction)
+                if self.sky_crop is None:
+                    print("No sky in the camera view, not cropping.")
+                else:
+                    print(f"Cropping to the sky: {self.sky_crop.width}x{self.sky_crop.height} at "
+                          f"{self.sky_crop.left},{self.sky_crop.top} ({self.sky_crop.fraction:.0%} of the frame)")
+        user_data.sky_geometry = self.sky_geometry if args.sky_geometry else None
+        user_data.sky_crop = self.sky_crop
+
+        if self.tiling:
+            # The batch size is fixed when the HEF is loaded. By default one batch holds the tiles
+            # of one camera frame, after the sky crop; the frame size of a file is unknown before
+            # it is decoded, so its tiles run in the default batches unless --tile-batch-size is given.
+            # With --tile-interval the frames in between are a single tile, which would wait in a
+            # larger batch for the tiles of later frames, so every tile is its own batch
+            if args.tile_interval > 1 and (args.tile_batch_size or 1) > 1:
+                print("--tile-interval above 1 needs a tile batch size of 1.")
+                exit(1)
+            if args.tile_batch_size is not None:
+                self.batch_size = args.tile_batch_size
+            elif args.tile_interval > 1:
+                self.batch_size = 1
+            elif self.source_type != "file":
+                if self.sky_crop is not None:
+                    width, height = self.sky_crop.width, self.sky_crop.height
+                else:
+                    width, height = self.get_source_resolution(0)
+                tiles_x, tiles_y, _, _ = compute_tile_grid(width, height, self.network_width, args.tile_overlap)
+                self.batch_size = tiles_x * tiles_y
+
         self.create_pipeline()
 
-    def get_pipeline_string(self):
-        if self.source_type == "rpi":
+        # Out-of-pipeline backend between backend_sink and backend_src
+        self.backend_bridge = None
+        if self.backend != "hailo":
+            self.backend_bridge = BackendBridge(
+                create_backend(args, hef_path=self.hef_path),
+                self.pipeline.get_by_name("backend_sink"),
+                self.pipeline.get_by_name("backend_src"),
+            )
+            user_data.backend_bridge = self.backend_bridge
+            self.backend_bridge.start()
+
+        # Optional motion gate in front of hailonet
+        self.motion_gate = None
+        if args.motion_gate:
+            self.motion_gate = MotionGate(
+                pixel_threshold=args.gate_threshold,
+                keep_alive_interval=args.gate_keep_alive,
+                batch_size=self.batch_size,
+            )
+            GLib.timeout_add_seconds(args.gate_report_interval, self.motion_gate.report)
+        self.attach_inference()
+
+        # Runtime swap of the inference elements, reloaded from --inference-config on SIGHUP
+        self.inference_swapper = None
+        self.inference_config = args.inference_config
+        if self.backend == "hailo":
+            self.inference_swapper = InferenceSwapper(self.pipeline)
+            if self.inference_config:
+                GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGHUP, self._on_reload_inference)
+
+        if self.tiling:
+            self.tile_scheduler.attach(self.pipeline.get_by_name("cropper"), self.pipeline.get_by_name("identity_callback"))
+            GLib.timeout_add_seconds(args.tile_report_interval, self.tile_scheduler.report)
+
+        # Optional sky exposure control of a USB camera, metered on the converted source frames
+        self.sky_exposure = None
+        if args.sky_exposure:
+            if self.num_sources > 1 or self.source_type != "usb":
+                print("Sky exposure control needs a single USB camera source, disabling it.")
+            else:
+                from uvccamconfig import UVCCamera
+                self.sky_exposure = SkyExposureController(
+                    UVCCamera(self.video_sources[0]),
+                    roi=args.sky_roi,
+                    target=args.sky_target,
+                    sample_interval=args.sky_sample_interval,
+                    max_exposure=args.sky_max_exposure,
+                )
+                self.sky_exposure.start()
+                self.sky_exposure.attach(self.pipeline.get_by_name("src_convert"))
+                GLib.timeout_add_seconds(args.sky_report_interval, self.sky_exposure.report)
+
+        # Optional network stream; the encoder adapts to the queue in front of it and the CPU headroom.
+        # The encoder is shared with the clip recorder, so with clips its bitrate and keyframe
+        # interval stay fixed for the evidence clips and only whole frames are dropped under load.
+        self.adaptive_encoder = None
+        if self.stream_clients:
+            self.adaptive_encoder = AdaptiveEncoder(
+                self.pipeline.get_by_name("encoder"),
+                self.pipeline.get_by_name("queue_encoder"),
+                self.pipeline.get_by_name("queue_stream"),
+                adapt_encoding=not self.record_clips,
+                min_bitrate=args.stream_min_bitrate,
+                max_bitrate=args.stream_max_bitrate,
+                min_cpu_idle=args.stream_min_cpu_idle,
+            )
+            self.adaptive_encoder.attach()
+            GLib.timeout_add_seconds(args.stream_report_interval, self.adaptive_encoder.report)
+
+        # Optional persistence of every detection, written from a background thread
+        self.detection_writer = None
+        if args.store:
+            self.detection_writer = DetectionWriter(DetectionStore(args.store, segment_seconds=args.store_segment_hours * 3600))
+            user_data.detection_writer = self.detection_writer
+            GLib.timeout_add_seconds(args.store_report_interval, self.detection_writer.report)
+
+        # Optional event clip recording, triggered from the callback
+        self.clip_recorder = None
+        if self.record_clips:
+            self.clip_recorder = ClipRecorder(args.record_clips, pre_roll=args.pre_roll, post_roll=args.post_roll)
+            self.clip_recorder.attach(self.pipeline.get_by_name("clip_sink"))
+            user_data.clip_recorder = self.clip_recorder
+
+    def run(self):
+        super().run()
+        if self.clip_recorder is not None:
+            self.clip_recorder.close()
+        if self.backend_bridge is not None:
+            self.backend_bridge.close()
+        if self.detection_writer is not None:
+            self.detection_writer.close()
+            self.detection_writer.report()
+        if self.sky_exposure is not None:
+            self.sky_exposure.stop()
+            self.sky_exposure.camera.close()
+
+    def get_thresholds_string(self):
+        return (
+            f"nms-score-threshold={self.nms_score_threshold} "
+            f"nms-iou-threshold={self.nms_iou_threshold} "
+            f"output-format-type=HAILO_FORMAT_TYPE_FLOAT32"
+        )
+
+    def attach_inference(self):
+        # Probes on the inference elements; called again after every swap
+        if self.motion_gate is not None:
+            self.motion_gate.batch_size = self.batch_size
+            self.motion_gate.attach(self.pipeline.get_by_name("hailonet"))
+
+    def swap_inference(self, hef_path=None, nms_score_threshold=None, nms_iou_threshold=None,
+                       batch_size=None, labels_json=None, preload=True):
+        """
+        Replaces hailonet and hailofilter with ones built from the given parameters while the
+        sources and the display keep running. Parameters left as None keep their current value.
+
+        Returns:
+            SwapReport
+        """
+        if self.inference_swapper is None:
+            raise RuntimeError(f"The {self.backend} backend has no inference elements to swap")
+        values = {
+            'hef_path': hef_path,
+            'nms_score_threshold': nms_score_threshold,
+            'nms_iou_threshold': nms_iou_threshold,
+            'batch_size': batch_size,
+            'labels_config': f' config-path={labels_json} ' if labels_json is not None else None,
+        }
+        values = {name: value for name, value in values.items() if value is not None}
+        # The description is built from the new values, the app keeps describing the running
+        # model until the swap succeeded
+        current = {name: getattr(self, name) for name in values}
+        self._set_inference_values(values)
+        try:
+            description = self.get_inference_element()
+        finally:
+            self._set_inference_values(current)
+        report = self.inference_swapper.swap(description, preload=preload)
+        self._set_inference_values(values)
+        self.attach_inference()
+        return report
+
+    def _set_inference_values(self, values):
+        for name, value in values.items():
+            setattr(self, name, value)
+        self.thresholds_str = self.get_thresholds_string()
+
+    def _on_reload_inference(self):
+        # The swap waits for the pipeline, so it runs off the main loop
+        def reload():
+            try:
+                print(self.swap_inference(**load_inference_config(self.inference_config)))
+            except (OSError, ValueError, RuntimeError) as e:
+                print(f"Inference swap failed: {e}")
+        threading.Thread(target=reload, daemon=True).start()
+        # Returning True keeps the signal handler installed
+        return True
+
+    def get_source_element(self, index, full_resolution=False):
+        video_source = self.video_sources[index]
+        source_type = self.source_types[index]
+        suffix = self.stream_suffix(index)
+        if full_resolution:
+            # Keep the native resolution, only convert to the network format (used for tiling)
+            if source_type == "rpi":
+                source_element = (
+                    f"libcamerasrc name=src_{index} auto-focus-mode=2 ! "
+                    f"video/x-raw, format={self.network_format}, width=1536, height=864, framerate=30/1 ! "
+                    + SKY_CROP(self.sky_crop)
+                )
+            elif source_type == "usb":
+                source_element = (
+                    f"v4l2src device={video_source} name=src_{index} ! "
+                    "video/x-raw, width=640, height=480, framerate=30/1 ! "
+                    + SKY_CROP(self.sky_crop)
+                )
+            else:
+                source_element = (
+                    f"filesrc location={video_source} name=src_{index} ! "
+                    + self.queue(f"queue_dec264{suffix}")
+                    + " qtdemux ! h264parse ! avdec_h264 max-threads=2 ! "
+                    " video/x-raw, format=I420 ! "
+                )
+            source_element += self.queue(f"queue_src_convert{suffix}")
+            source_element += f"videoconvert n-threads=3 name=src_convert{suffix} qos=false ! "
+            source_element += f"video/x-raw, format={self.network_format}, pixel-aspect-ratio=1/1 ! "
+            return source_element
+
+        if source_type == "rpi":
             source_element = (
-                "libcamerasrc name=src_0 auto-focus-mode=2 ! "
+                f"libcamerasrc name=src_{index} auto-focus-mode=2 ! "
                 f"video/x-raw, format={self.network_format}, width=1536, height=864 ! "
-                + QUEUE("queue_src_scale")
+                + SKY_CROP(self.sky_crop)
+                + self.queue(f"queue_src_scale{suffix}")
                 + "videoscale ! "
                 f"video/x-raw, format={self.network_format}, width={self.network_width}, height={self.network_height}, framerate=30/1 ! "
             )
-        elif self.source_type == "usb":
+        elif source_type == "usb":
             source_element = (
-                f"v4l2src device={self.video_source} name=src_0 ! "
+                f"v4l2src device={video_source} name=src_{index} ! "
                 "video/x-raw, width=640, height=480, framerate=30/1 ! "
+                + SKY_CROP(self.sky_crop)
             )
         else:
             source_element = (
-                f"filesrc location={self.video_source} name=src_0 ! "
-                + QUEUE("queue_dec264")
+                f"filesrc location={video_source} name=src_{index} ! "
+                + self.queue(f"queue_dec264{suffix}")
                 + " qtdemux ! h264parse ! avdec_h264 max-threads=2 ! "
                 " video/x-raw, format=I420 ! "
             )
-        source_element += QUEUE("queue_scale")
-        source_element += "videoscale n-threads=2 ! "
-        source_element += QUEUE("queue_src_convert")
-        source_element += "videoconvert n-threads=3 name=src_convert qos=false ! "
-        source_element += f"video/x-raw, format={self.network_format}, width={self.network_width}, height={self.network_height}, pixel-aspect-ratio=1/1 ! "
+        return source_element + self.get_scale_convert_element(suffix)
+
+    def get_source_resolution(self, index):
+        # Capture size of a source; file sources are described at the network input size
+        source_type = self.source_types[index]
+        if source_type == "rpi":
+            return 1536, 864
+        if source_type == "usb":
+            return 640, 480
+        return self.network_width, self.network_height
+
+    def get_scale_convert_element(self, suffix=""):
+        # Scales and converts any raw source to the network input size and format
+        return (
+            self.queue(f"queue_scale{suffix}")
+            + "videoscale n-threads=2 ! "
+            + self.queue(f"queue_src_convert{suffix}")
+            + f"videoconvert n-threads=3 name=src_convert{suffix} qos=false ! "
+            f"video/x-raw, format={self.network_format}, width={self.network_width}, height={self.network_height}, pixel-aspect-ratio=1/1 ! "
+        )
+
+    def get_inference_element(self):
+        return (
+            self.queue("queue_hailonet")
+            + "videoconvert n-threads=3 ! "
+            f"hailonet name=hailonet hef-path={self.hef_path} batch-size={self.batch_size} {self.thresholds_str} force-writable=true ! "
+            + self.queue("queue_hailofilter")
+            + f"hailofilter name=hailofilter so-path={self.default_postprocess_so} {self.labels_config} qos=false ! "
+        )
+
+    def get_multi_source_pipeline_string(self):
+        # hailoroundrobin interleaves the sources into one hailonet so batches fill across cameras,
+        # hailostreamrouter sends each result back to the branch of the source it came from.
+        # Each source enters through a leaky queue so a stalled camera cannot block the others.
+        router_pads = " ".join(
+            f'src_{index}::input-streams="<sink_{index}>"' for index in range(self.num_sources)
+        )
+        pipeline_string = (
+            "hailoroundrobin mode=0 name=fun ! "
+            + self.get_inference_element()
+            + self.queue("queue_hailo_router")
+            + f"hailostreamrouter name=sid {router_pads} "
+        )
+        for index in range(self.num_sources):
+            pipeline_string += (
+                self.get_source_element(index)
+                + f"queue name=queue_src_leak_{index} leaky=downstream max-size-buffers=3 max-size-bytes=0 max-size-time=0 ! "
+                f"fun.sink_{index} "
+            )
+        for index in range(self.num_sources):
+            pipeline_string += (
+                f"sid.src_{index} ! "
+                + self.queue(f"queue_user_callback_{index}")
+                + f"identity name=identity_callback_{index} ! "
+                + self.queue(f"queue_hailooverlay_{index}")
+                + f"{self.overlay_element} ! "
+                + self.queue(f"queue_videoconvert_{index}")
+                + "videoconvert n-threads=2 qos=false ! "
+                + self.queue(f"queue_hailo_display_{index}")
+                + f"fpsdisplaysink video-sink={self.video_sink} name=hailo_display_{index} sync={self.sync} text-overlay={self.options_menu.show_fps} signal-fps-measurements=true "
+            )
+        print(pipeline_string)
+        return pipeline_string
+
+    def get_tiled_pipeline_string(self):
+        # The full-resolution frame is cut into network-sized tiles that are inferred as one batch,
+        # the aggregator maps detections back to the full frame and merges them across tiles
+        pipeline_string = (
+            self.get_source_element(0, full_resolution=True)
+            + self.queue("queue_tile_cropper")
+            + TILE_CROPPER()
+            + "cropper. ! "
+            + self.queue("bypass_queue", max_size_buffers=20)
+            + "agg. "
+            + "cropper. ! "
+            + self.get_inference_element()
+            + self.queue("queue_tile_aggregator")
+            + "agg. "
+            + "agg. ! "
+            + self.queue("queue_user_callback")
+            + "identity name=identity_callback ! "
+            + self.queue("queue_hailooverlay")
+            + f"{self.overlay_element} name=hailooverlay ! "
+            + ("tee name=overlay_t ! " if self.record_clips or self.stream_clients else "")
+            + self.queue("queue_videoconvert")
+            + "videoconvert n-threads=3 qos=false ! "
+            + self.queue("queue_hailo_display")
+            + f"fpsdisplaysink video-sink={self.video_sink} name=hailo_display sync={self.sync} text-overlay={self.options_menu.show_fps} signal-fps-measurements=true "
+        )
+        pipeline_string += self.get_encoder_branch()
+        print(pipeline_string)
+        return pipeline_string
 
+    def get_backend_pipeline_string(self):
+        # Frames leave the pipeline after scaling, go through the backend and come back in order
+        # at backend_src; the detections travel separately through the bridge. hailooverlay
+        # cannot draw them, so an identity keeps the stage name for the instrumentation.
         pipeline_string = (
-            "hailomuxer name=hmux "
-            + source_element
+            self.get_source_element(0)
+            + self.queue("queue_backend")
+            + BACKEND_BRIDGE()
+            + self.queue("queue_user_callback")
+            + "identity name=identity_callback ! "
+            + self.queue("queue_hailooverlay")
+            + "identity name=hailooverlay ! "
+            + ("tee name=overlay_t ! " if self.record_clips or self.stream_clients else "")
+            + self.queue("queue_videoconvert")
+            + "videoconvert n-threads=3 qos=false ! "
+            + self.queue("queue_hailo_display")
+            + f"fpsdisplaysink video-sink={self.video_sink} name=hailo_display sync={self.sync} text-overlay={self.options_menu.show_fps} signal-fps-measurements=true "
+        )
+        pipeline_string += self.get_encoder_branch()
+        print(pipeline_string)
+        return pipeline_string
+
+    def get_encoder_branch(self):
+        # Encode the annotated stream once for the clip recorder's pre-roll ring and the network
+        # stream, whichever are enabled
+        if not (self.record_clips or self.stream_clients):
+            return ""
+        pipeline_string = ENCODER_BRANCH("overlay_t", clip_sink=bool(self.record_clips))
+        if self.stream_clients:
+            pipeline_string += STREAM_BRANCH(self.stream_clients)
+        return pipeline_string
+
+    def get_pipeline_string(self):
+        if self.backend != "hailo":
+            return self.get_backend_pipeline_string()
+        if self.num_sources > 1:
+            return self.get_multi_source_pipeline_string()
+        if self.tiling:
+            return self.get_tiled_pipeline_string()
+
+        pipeline_string = (
+            f"{self.muxer_element} name=hmux "
+            + self.get_source_element(0)
             + "tee name=t ! "
-            + QUEUE("bypass_queue", max_size_buffers=20)
+            + self.queue("bypass_queue", max_size_buffers=20)
             + "hmux.sink_0 "
             + "t. ! "
-            + QUEUE("queue_hailonet")
-            + "videoconvert n-threads=3 ! "
-            f"hailonet hef-path={self.hef_path} batch-size={self.batch_size} {self.thresholds_str} force-writable=true ! "
-            + QUEUE("queue_hailofilter")
-            + f"hailofilter so-path={self.default_postprocess_so} {self.labels_config} qos=false ! "
-            + QUEUE("queue_hmuc")
+            + self.get_inference_element()
+            + self.queue("queue_hmuc")
             + "hmux.sink_1 "
             + "hmux. ! "
-            + QUEUE("queue_hailo_python")
-            + QUEUE("queue_user_callback")
+            + self.queue("queue_hailo_python")
+            + self.queue("queue_user_callback")
             + "identity name=identity_callback ! "
-            + QUEUE("queue_hailooverlay")
-            + "hailooverlay ! "
-            + QUEUE("queue_videoconvert")
+            + self.queue("queue_hailooverlay")
+            + f"{self.overlay_element} name=hailooverlay ! "
+            + ("tee name=overlay_t ! " if self.record_clips or self.stream_clients else "")
+            + self.queue("queue_videoconvert")
             + "videoconvert n-threads=3 qos=false ! "
-            + QUEUE("queue_hailo_display")
+            + self.queue("queue_hailo_display")
             + f"fpsdisplaysink video-sink={self.video_sink} name=hailo_display sync={self.sync} text-overlay={self.options_menu.show_fps} signal-fps-measurements=true "
         )
+        pipeline_string += self.get_encoder_branch()
         print(pipeline_string)
         return pipeline_string
 
-if __name__ == "__main__":
-    # Create an instance of the user app callback class
-    user_data = user_app_callback_class()
+def get_detection_parser():
     parser = get_default_parser()
     # Add additional arguments here
     parser.add_argument(
@@ -220,6 +667,21 @@ if __name__ == "__main__":
         default=None,
         help="Path to costume labels JSON file",
     )
+    add_motion_gate_arguments(parser)
+    add_clip_recorder_arguments(parser)
+    add_tiling_arguments(parser)
+    add_backend_arguments(parser)
+    add_sky_exposure_arguments(parser)
+    add_stream_arguments(parser)
+    add_inference_swap_arguments(parser)
+    add_sky_geometry_arguments(parser)
+    add_detection_store_arguments(parser)
+    return parser
+
+if __name__ == "__main__":
+    # Create an instance of the user app callback class
+    user_data = user_app_callback_class()
+    parser = get_detection_parser()
     args = parser.parse_args()
     app = GStreamerDetectionApp(args, user_data)
     app.run()
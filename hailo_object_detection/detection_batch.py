@@ -0,0 +1,159 @@
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+import numpy as np
+
+# -----------------------------------------------------------------------------------------------
+# Columnar detection batches
+# -----------------------------------------------------------------------------------------------
+# The hailo ROI API hands out one Python object per detection. We walk it once per frame and
+# store the result as a struct-of-arrays batch so that everything downstream (filtering,
+# tracking, storage) works on whole numpy arrays instead of per-object Python calls.
+
+
+class LabelTable:
+    """
+    Maps class ids to label strings. Filled lazily from the detections we see, so label
+    strings are only read from the hailo objects the first time a class shows up.
+    """
+    def __init__(self, labels=None):
+        self.labels = dict(labels or {})
+
+    def ids_for(self, labels):
+        labels = set(labels)
+        return np.array([class_id for class_id, label in self.labels.items() if label in labels], dtype=np.int32)
+
+    def get(self, class_id):
+        return self.labels.get(int(class_id), str(class_id))
+
+
+@dataclass
+class DetectionBatch:
+    """
+    All detections of one frame.
+
+    Attributes:
+        pts (int): Presentation timestamp of the frame in nanoseconds.
+        class_ids (np.ndarray): (N,) int32 class ids.
+        confidences (np.ndarray): (N,) float32 confidences.
+        boxes (np.ndarray): (N, 4) float32 boxes as normalized xmin, ymin, xmax, ymax.
+        label_table (LabelTable): Shared class id to label mapping.
+    """
+    pts: int
+    class_ids: np.ndarray
+    confidences: np.ndarray
+    boxes: np.ndarray
+    label_table: LabelTable = field(default_factory=LabelTable, repr=False)
+
+    @classmethod
+    def empty(cls, pts=0, label_table=None):
+        return cls(pts, np.empty(0, np.int32), np.empty(0, np.float32), np.empty((0, 4), np.float32),
+                   label_table if label_table is not None else LabelTable())
+
+    def __len__(self):
+        return len(self.class_ids)
+
+    def select(self, mask):
+        return DetectionBatch(self.pts, self.class_ids[mask], self.confidences[mask], self.boxes[mask], self.label_table)
+
+    def filter(self, class_ids=None, labels=None, min_confidence=0.0):
+        """
+        Returns the detections matching any of the given classes and at least min_confidence.
+        """
+        mask = self.confidences >= min_confidence
+        if labels is not None:
+            ids = self.label_table.ids_for(labels)
+            class_ids = ids if class_ids is None else np.union1d(class_ids, ids)
+        if class_ids is not None:
+            mask &= np.isin(self.class_ids, class_ids)
+        return self.select(mask)
+
+    def labels(self):
+        return [self.label_table.get(class_id) for class_id in self.class_ids]
+
+
+def extract_detections(roi, pts, detection_type, label_table):
+    """
+    Converts the detections attached to a hailo ROI into a DetectionBatch.
+
+    Args:
+        roi (hailo.HailoROI): ROI returned by hailo.get_roi_from_buffer.
+        pts (int): Presentation timestamp of the buffer.
+        detection_type: Object type to extract, normally hailo.HAILO_DETECTION.
+        label_table (LabelTable): Table to record newly seen labels in.
+
+    Returns:
+        DetectionBatch: The detections of the frame.
+    """
+    detections = roi.get_objects_typed(detection_type)
+    count = len(detections)
+    if count == 0:
+        return DetectionBatch.empty(pts, label_table)
+
+    class_ids = np.empty(count, dtype=np.int32)
+    confidences = np.empty(count, dtype=np.float32)
+    boxes = np.empty((count, 4), dtype=np.float32)
+    labels = label_table.labels
+    for i, detection in enumerate(detections):
+        class_id = detection.get_class_id()
+        if class_id not in labels:
+            labels[class_id] = detection.get_label()
+        bbox = detection.get_bbox()
+        class_ids[i] = class_id
+        confidences[i] = detection.get_confidence()
+        boxes[i] = (bbox.xmin(), bbox.ymin(), bbox.xmax(), bbox.ymax())
+    return DetectionBatch(pts, class_ids, confidences, boxes, label_table)
+
+
+# -----------------------------------------------------------------------------------------------
+# Rate-limited asynchronous logging
+# -----------------------------------------------------------------------------------------------
+class RateLimitedLogger:
+    """
+    Prints from a background thread, at most once per interval.
+
+    log() only does a clock check and a non-blocking queue put on the caller's thread; message
+    formatting and the stdout write happen on the logger thread. Messages arriving faster than
+    the interval, or while the queue is full, are counted and reported with the next line.
+
+    Args:
+        interval (float): Minimum number of seconds between two printed messages.
+        max_pending (int): Maximum number of messages waiting to be printed.
+    """
+    def __init__(self, interval=1.0, max_pending=16):
+        self.interval = interval
+        self.suppressed = 0
+        self._next_time = 0.0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="rate_limited_logger", daemon=True)
+        self._thread.start()
+
+    def log(self, fmt, *args):
+        now = time.monotonic()
+        if now < self._next_time:
+            self.suppressed += 1
+            return False
+        try:
+            self._queue.put_nowait((fmt, args, self.suppressed))
+        except queue.Full:
+            self.suppressed += 1
+            return False
+        self._next_time = now + self.interval
+        self.suppressed = 0
+        return True
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            fmt, args, suppressed = item
+            message = fmt.format(*args) if args else fmt
+            if suppressed:
+                message += f"\n({suppressed} messages suppressed)"
+            print(message)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=1.0)
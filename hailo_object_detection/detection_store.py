@@ -0,0 +1,748 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+import numpy as np
+
+# -----------------------------------------------------------------------------------------------
+# Append-only columnar detection store
+# -----------------------------------------------------------------------------------------------
+# Detections are kept for months per site and queried by time range and value, so they are
+# stored one file per column, the layout numpy can memory-map directly:
+#
+#   <root>/store.json                         run counter
+#   <root>/segment_<start_ns>/segment.json    sidecar index: row count and statistics
+#   <root>/segment_<start_ns>/<column>.bin    raw little-endian column values, one row per detection
+#
+# A segment covers one period of wall-clock time (an hour by default) and is sealed when the next
+# period starts. Rows are written in time order, so a time range is a binary search on the time
+# column of each overlapping segment. Per-segment statistics (time range, highest confidence,
+# classes and sources present) let a query skip whole segments, and the predicate is evaluated in
+# chunks of rows on the memory-mapped columns it needs, so memory use is bounded by the chunk size
+# and untouched columns are never read.
+#
+# DetectionWriter feeds the store from the streaming thread: append() only puts the frame's
+# arrays on a bounded queue and never blocks; a background thread batches frames into blocks and
+# appends them to the column files. If the queue is full the frame is counted as dropped.
+#
+# Track ids restart with every run of the tracker, so every run gets a run number and a track is
+# identified by (run, source, track_id).
+
+COLUMNS = {
+    'time_ns': np.dtype('<i8'),
+    'pts': np.dtype('<i8'),
+    'run': np.dtype('<i4'),
+    'source': np.dtype('<i2'),
+    'class_id': np.dtype('<i4'),
+    'confidence': np.dtype('<f4'),
+    'xmin': np.dtype('<f4'),
+    'ymin': np.dtype('<f4'),
+    'xmax': np.dtype('<f4'),
+    'ymax': np.dtype('<f4'),
+    'track_id': np.dtype('<i8'),
+}
+STORE_FILE = "store.json"
+SEGMENT_FILE = "segment.json"
+SEGMENT_PREFIX = "segment_"
+
+
+class Segment:
+    """
+    One directory of column files and its statistics.
+    """
+    def __init__(self, path, start_ns, rows=0, min_time=None, max_time=None, max_confidence=None,
+                 class_ids=(), sources=(), ordered=True, sealed=False):
+        self.path = path
+        self.start_ns = start_ns
+        self.rows = rows
+        self.min_time = min_time
+        self.max_time = max_time
+        self.max_confidence = max_confidence
+        self.class_ids = set(class_ids)
+        self.sources = set(sources)
+        self.ordered = ordered
+        self.sealed = sealed
+
+    def to_dict(self):
+        return {
+            'name': os.path.basename(self.path), 'start_ns': self.start_ns, 'rows': self.rows,
+            'min_time': self.min_time, 'max_time': self.max_time, 'max_confidence': self.max_confidence,
+            'class_ids': sorted(self.class_ids), 'sources': sorted(self.sources),
+            'ordered': self.ordered, 'sealed': self.sealed,
+        }
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads the sidecar index of a segment directory, None if there is none.
+        """
+        try:
+            with open(os.path.join(path, SEGMENT_FILE), "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        entry.pop('name', None)
+        return cls(path, **entry)
+
+    def save(self):
+        _write_json(os.path.join(self.path, SEGMENT_FILE), self.to_dict())
+
+    def column(self, name, rows=None):
+        """
+        Read-only memory map of a column, or an empty array for an empty segment.
+        """
+        rows = self.rows if rows is None else rows
+        if rows == 0:
+            return np.empty(0, COLUMNS[name])
+        return np.memmap(os.path.join(self.path, f"{name}.bin"), dtype=COLUMNS[name], mode='r', shape=(rows,))
+
+    def update_stats(self, block):
+        times = block['time_ns']
+        if not len(times):
+            return
+        if self.max_time is not None and times[0] < self.max_time:
+            self.ordered = False
+        self.min_time = int(times.min()) if self.min_time is None else min(self.min_time, int(times.min()))
+        self.max_time = int(times.max()) if self.max_time is None else max(self.max_time, int(times.max()))
+        confidence = float(block['confidence'].max())
+        self.max_confidence = confidence if self.max_confidence is None else max(self.max_confidence, confidence)
+        self.class_ids.update(np.unique(block['class_id']).tolist())
+        self.sources.update(np.unique(block['source']).tolist())
+        self.rows += len(times)
+
+    def recover(self):
+        """
+        Rebuilds the statistics from the column files after an unclean shutdown, dropping a row
+        that was only partly written.
+        """
+        sizes = []
+        for name, dtype in COLUMNS.items():
+            path = os.path.join(self.path, f"{name}.bin")
+            sizes.append(os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0)
+        rows = min(sizes)
+        for name, dtype in COLUMNS.items():
+            path = os.path.join(self.path, f"{name}.bin")
+            if os.path.exists(path):
+                os.truncate(path, rows * dtype.itemsize)
+            else:
+                open(path, "wb").close()
+        self.rows = 0
+        self.min_time = self.max_time = self.max_confidence = None
+        self.class_ids, self.sources = set(), set()
+        if rows:
+            block = {name: np.asarray(self.column(name, rows)) for name in ('time_ns', 'confidence', 'class_id', 'source')}
+            self.update_stats(block)
+            self.ordered = bool(np.all(np.diff(block['time_ns']) >= 0))
+        self.sealed = True
+
+
+class DetectionStore:
+    """
+    Time-partitioned columnar store of detections.
+
+    Args:
+        root (str): Directory of the store, created if missing.
+        segment_seconds (int): Wall-clock period covered by one segment.
+        readonly (bool): Open for queries next to a writer in another process; rows become
+            visible when the writer flushes.
+    """
+    def __init__(self, root, segment_seconds=3600, readonly=False):
+        self.root = root
+        self.segment_ns = int(segment_seconds * 1e9)
+        self.readonly = readonly
+        if not readonly:
+            os.makedirs(root, exist_ok=True)
+        self.segments = []
+        self.runs = 0
+        self._active = None
+        self._files = {}
+        self._lock = threading.Lock()
+        self._load_index()
+
+    # ---------------------------------------------------------
+    # Index
+    # ---------------------------------------------------------
+
+    def _load_index(self):
+        path = os.path.join(self.root, STORE_FILE)
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.runs = json.load(f).get('runs', 0)
+        for name in sorted(os.listdir(self.root)) if os.path.isdir(self.root) else []:
+            if not name.startswith(SEGMENT_PREFIX):
+                continue
+            segment_path = os.path.join(self.root, name)
+            segment = Segment.load(segment_path)
+            if self.readonly:
+                # Unsealed segments may still be written, only their flushed rows are read
+                if segment is None:
+                    continue
+            elif segment is None or not segment.sealed:
+                # Written by a run that did not close the store
+                segment = segment or Segment(segment_path, int(name[len(SEGMENT_PREFIX):]))
+                segment.recover()
+                segment.save()
+            self.segments.append(segment)
+        self.segments.sort(key=lambda segment: segment.start_ns)
+
+    def refresh(self):
+        """
+        Rereads the segment statistics of a read-only store to see the rows flushed since it was
+        opened.
+        """
+        self.segments = []
+        self._load_index()
+
+    def _save_store(self):
+        _write_json(os.path.join(self.root, STORE_FILE), {'runs': self.runs})
+
+    def new_run(self):
+        """
+        Returns the number of a new run, track ids are unique within a run and source.
+        """
+        with self._lock:
+            run = self.runs
+            self.runs += 1
+            self._save_store()
+            return run
+
+    # ---------------------------------------------------------
+    # Writing
+    # ---------------------------------------------------------
+
+    def write(self, block):
+        """
+        Appends a block of rows, a dict of equal-length arrays with every column in COLUMNS.
+        Rows are sorted by time and rolled into the segment of their period.
+        """
+        times = np.asarray(block['time_ns'], dtype=COLUMNS['time_ns'])
+        if not len(times):
+            return
+        if np.any(times[1:] < times[:-1]):
+            order = np.argsort(times, kind='stable')
+            block = {name: np.asarray(values)[order] for name, values in block.items()}
+            times = times[order]
+        periods = times // self.segment_ns
+        with self._lock:
+            start = 0
+            while start < len(times):
+                if self._active is None or periods[start] > self._active.start_ns // self.segment_ns:
+                    self._roll(int(periods[start]) * self.segment_ns)
+                # Rows of earlier periods arriving late stay in the current segment
+                end = int(np.searchsorted(periods, self._active.start_ns // self.segment_ns, side='right'))
+                end = max(end, start + 1)
+                self._append({name: np.asarray(block[name], dtype=dtype)[start:end] for name, dtype in COLUMNS.items()})
+                start = end
+
+    def _roll(self, start_ns):
+        if self.readonly:
+            raise PermissionError(f"The detection store {self.root} is open read-only")
+        self._seal()
+        path = os.path.join(self.root, f"{SEGMENT_PREFIX}{start_ns:020d}")
+        existing = [segment for segment in self.segments if segment.path == path]
+        if existing:
+            # Reopened within the period of the last segment, continue it
+            self._active = existing[0]
+            self._active.sealed = False
+        else:
+            os.makedirs(path, exist_ok=True)
+            self._active = Segment(path, start_ns)
+            self.segments.append(self._active)
+            self.segments.sort(key=lambda segment: segment.start_ns)
+        self._files = {name: open(os.path.join(path, f"{name}.bin"), "ab") for name in COLUMNS}
+
+    def _append(self, block):
+        for name, values in block.items():
+            values.tofile(self._files[name])
+        self._active.update_stats(block)
+
+    def _seal(self):
+        if self._active is None:
+            return
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        self._active.sealed = True
+        self._active.save()
+        self._active = None
+
+    def flush(self):
+        """
+        Makes the rows written so far visible to readers, including other processes.
+        """
+        if self.readonly:
+            return
+        with self._lock:
+            for f in self._files.values():
+                f.flush()
+            if self._active is not None:
+                self._active.save()
+
+    def close(self):
+        if self.readonly:
+            return
+        with self._lock:
+            self._seal()
+
+    # ---------------------------------------------------------
+    # Queries
+    # ---------------------------------------------------------
+
+    def query(self, start_ns=None, end_ns=None, min_confidence=None, class_ids=None, sources=None,
+              columns=None, chunk_rows=1 << 20):
+        """
+        Yields the matching rows as dicts of column arrays, at most chunk_rows rows are examined
+        at a time.
+
+        Args:
+            start_ns, end_ns (int, optional): Time range [start_ns, end_ns) in wall-clock ns.
+            min_confidence (float, optional): Keep rows with at least this confidence.
+            class_ids, sources (iterable, optional): Keep rows of these classes or sources.
+            columns (list, optional): Columns to return, all by default.
+        """
+        columns = list(columns or COLUMNS)
+        class_ids = None if class_ids is None else np.asarray(sorted(set(class_ids)), dtype=COLUMNS['class_id'])
+        sources = None if sources is None else np.asarray(sorted(set(sources)), dtype=COLUMNS['source'])
+        with self._lock:
+            for f in self._files.values():
+                f.flush()
+            segments = list(self.segments)
+        for segment in segments:
+            if not self._may_match(segment, start_ns, end_ns, min_confidence, class_ids, sources):
+                continue
+            begin, end = 0, segment.rows
+            if segment.ordered:
+                times = segment.column('time_ns')
+                if start_ns is not None:
+                    begin = int(np.searchsorted(times, start_ns, side='left'))
+                if end_ns is not None:
+                    end = int(np.searchsorted(times, end_ns, side='left'))
+            for chunk_start in range(begin, end, chunk_rows):
+                chunk = slice(chunk_start, min(chunk_start + chunk_rows, end))
+                mask = None
+                if not segment.ordered and (start_ns is not None or end_ns is not None):
+                    times = np.asarray(segment.column('time_ns')[chunk])
+                    mask = _and(mask, times >= start_ns if start_ns is not None else None)
+                    mask = _and(mask, times < end_ns if end_ns is not None else None)
+                if min_confidence is not None:
+                    mask = _and(mask, segment.column('confidence')[chunk] >= min_confidence)
+                if class_ids is not None:
+                    mask = _and(mask, np.isin(segment.column('class_id')[chunk], class_ids))
+                if sources is not None:
+                    mask = _and(mask, np.isin(segment.column('source')[chunk], sources))
+                if mask is None:
+                    yield {name: np.array(segment.column(name)[chunk]) for name in columns}
+                elif mask.any():
+                    yield {name: segment.column(name)[chunk][mask] for name in columns}
+
+    @staticmethod
+    def _may_match(segment, start_ns, end_ns, min_confidence, class_ids, sources):
+        if segment.rows == 0:
+            return False
+        if start_ns is not None and segment.max_time < start_ns:
+            return False
+        if end_ns is not None and segment.min_time >= end_ns:
+            return False
+        if min_confidence is not None and segment.max_confidence < min_confidence:
+            return False
+        if class_ids is not None and not segment.class_ids.intersection(class_ids.tolist()):
+            return False
+        if sources is not None and not segment.sources.intersection(sources.tolist()):
+            return False
+        return True
+
+    def read(self, *args, **kwargs):
+        """
+        Same as query() with the chunks concatenated.
+        """
+        columns = list(kwargs.get('columns') or COLUMNS)
+        chunks = list(self.query(*args, **kwargs))
+        return {
+            name: np.concatenate([chunk[name] for chunk in chunks]) if chunks else np.empty(0, COLUMNS[name])
+            for name in columns
+        }
+
+    def tracks(self, start_ns=None, end_ns=None, min_confidence=None, class_ids=None, sources=None,
+               chunk_rows=1 << 20):
+        """
+        Summarizes the tracks with at least one matching detection, one row per track.
+
+        Returns:
+            dict: Arrays run, source, track_id, class_id (of the last detection), first_time,
+            last_time, detections and max_confidence, ordered by first_time.
+        """
+        names = ['run', 'source', 'track_id', 'class_id', 'time_ns', 'confidence']
+        summary = None
+        # Matching rows are summarized a chunk at a time, memory is bounded by the chunk and the
+        # number of tracks
+        pending = [{name: np.empty(0, COLUMNS[name]) for name in names}]
+        pending_rows = 0
+        for chunk in self.query(start_ns, end_ns, min_confidence, class_ids, sources, columns=names,
+                                chunk_rows=chunk_rows):
+            tracked = chunk['track_id'] >= 0
+            pending.append({name: values[tracked] for name, values in chunk.items()})
+            pending_rows += int(tracked.sum())
+            if pending_rows >= chunk_rows:
+                summary = _add_tracks(summary, pending)
+                pending, pending_rows = [], 0
+        summary = _add_tracks(summary, pending)
+        order = np.argsort(summary['first_time'], kind='stable')
+        return {name: values[order] for name, values in summary.items() if name != 'key'}
+
+    def get_stats(self):
+        return {
+            'segments': len(self.segments),
+            'rows': sum(segment.rows for segment in self.segments),
+            'bytes': sum(segment.rows for segment in self.segments) * sum(dtype.itemsize for dtype in COLUMNS.values()),
+            'runs': self.runs,
+        }
+
+
+def _write_json(path, data):
+    # Replaced atomically so a concurrent reader never sees a partial file
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(data, f)
+    os.replace(temporary, path)
+
+
+def _and(mask, condition):
+    if condition is None:
+        return mask
+    return condition if mask is None else mask & condition
+
+
+def _track_keys(run, source, track_id):
+    # One sortable key per (run, source, track_id)
+    return (run.astype(np.int64) << 48) | (source.astype(np.int64) << 40) | track_id.astype(np.int64)
+
+
+def _summarize_tracks(rows):
+    keys = _track_keys(rows['run'], rows['source'], rows['track_id'])
+    unique, first_index, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    count = len(unique)
+    first_time = np.full(count, np.iinfo(np.int64).max)
+    last_time = np.full(count, np.iinfo(np.int64).min)
+    max_confidence = np.full(count, -np.inf, dtype=np.float32)
+    np.minimum.at(first_time, inverse, rows['time_ns'])
+    np.maximum.at(last_time, inverse, rows['time_ns'])
+    np.maximum.at(max_confidence, inverse, rows['confidence'])
+    # Class of the latest detection of every track
+    last = _last_of_groups(inverse, rows['time_ns'])
+    return {
+        'key': unique,
+        'run': rows['run'][first_index],
+        'source': rows['source'][first_index],
+        'track_id': rows['track_id'][first_index],
+        'class_id': rows['class_id'][last],
+        'first_time': first_time,
+        'last_time': last_time,
+        'detections': np.bincount(inverse, minlength=count),
+        'max_confidence': max_confidence,
+    }
+
+
+def _last_of_groups(groups, times):
+    # Index of the latest row of every group 0..n-1
+    order = np.lexsort((times, groups))
+    sorted_groups = groups[order]
+    return order[np.r_[sorted_groups[1:] != sorted_groups[:-1], True]] if len(order) else order
+
+
+def _add_tracks(summary, parts):
+    if not parts:
+        return summary
+    part = _summarize_tracks({name: np.concatenate([rows[name] for rows in parts]) for name in parts[0]})
+    return part if summary is None else _merge_track_summaries(summary, part)
+
+
+def _merge_track_summaries(a, b):
+    merged = {name: np.concatenate([a[name], b[name]]) for name in a}
+    unique, first_index, inverse = np.unique(merged['key'], return_index=True, return_inverse=True)
+    count = len(unique)
+    first_time = np.full(count, np.iinfo(np.int64).max)
+    last_time = np.full(count, np.iinfo(np.int64).min)
+    max_confidence = np.full(count, -np.inf, dtype=np.float32)
+    np.minimum.at(first_time, inverse, merged['first_time'])
+    np.maximum.at(last_time, inverse, merged['last_time'])
+    np.maximum.at(max_confidence, inverse, merged['max_confidence'])
+    last = _last_of_groups(inverse, merged['last_time'])
+    return {
+        'key': unique,
+        'run': merged['run'][first_index],
+        'source': merged['source'][first_index],
+        'track_id': merged['track_id'][first_index],
+        'class_id': merged['class_id'][last],
+        'first_time': first_time,
+        'last_time': last_time,
+        'detections': np.bincount(inverse, weights=merged['detections'], minlength=count).astype(np.int64),
+        'max_confidence': max_confidence,
+    }
+
+
+def frames_to_block(frames, run=0):
+    """
+    Builds a block of rows for DetectionStore.write from queued frames, tuples of
+    (time_ns, pts, source, class_ids, confidences, boxes, track_ids).
+    """
+    counts = np.fromiter((len(frame[3]) for frame in frames), dtype=np.int64, count=len(frames))
+    boxes = np.concatenate([frame[5] for frame in frames]).reshape(-1, 4) if frames else np.zeros((0, 4), np.float32)
+    track_ids = [frame[6] if frame[6] is not None else np.full(len(frame[3]), -1, np.int64) for frame in frames]
+
+    def concatenate(arrays, name):
+        return np.concatenate(arrays).astype(COLUMNS[name], copy=False) if arrays else np.zeros(0, COLUMNS[name])
+
+    return {
+        'time_ns': np.repeat(np.fromiter((frame[0] for frame in frames), np.int64, len(frames)), counts),
+        'pts': np.repeat(np.fromiter((frame[1] for frame in frames), np.int64, len(frames)), counts),
+        'run': np.full(int(counts.sum()), run, COLUMNS['run']),
+        'source': np.repeat(np.fromiter((frame[2] for frame in frames), np.int16, len(frames)), counts),
+        'class_id': concatenate([frame[3] for frame in frames], 'class_id'),
+        'confidence': concatenate([frame[4] for frame in frames], 'confidence'),
+        'xmin': boxes[:, 0], 'ymin': boxes[:, 1], 'xmax': boxes[:, 2], 'ymax': boxes[:, 3],
+        'track_id': concatenate(track_ids, 'track_id'),
+    }
+
+
+class DetectionWriter:
+    """
+    Persists DetectionBatches to a DetectionStore from a background thread.
+
+    Args:
+        store (DetectionStore): Destination.
+        max_pending (int): Frames waiting for the writer before new ones are dropped.
+        flush_rows (int): Rows collected before a block is written.
+        flush_interval (float): Seconds after which collected rows are written anyway.
+    """
+    def __init__(self, store, max_pending=4096, flush_rows=65536, flush_interval=2.0):
+        self.store = store
+        self.run = store.new_run()
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.frames = 0
+        self.rows = 0
+        self.dropped_frames = 0
+        self.blocks = 0
+        self.write_time = 0.0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="detection_writer", daemon=True)
+        self._thread.start()
+
+    def append(self, time_ns, pts, source, batch, track_ids=None):
+        """
+        Queues the detections of one frame. Never blocks; frames are dropped when the writer is
+        behind.
+
+        Args:
+            time_ns (int): Wall-clock time of the frame.
+            pts (int): Presentation timestamp of the frame.
+            source (int): Source index.
+            batch (DetectionBatch): Detections of the frame.
+            track_ids (np.ndarray, optional): Track of every detection, -1 if untracked.
+        """
+        if not len(batch):
+            return True
+        try:
+            self._queue.put_nowait((time_ns, pts, source, batch.class_ids, batch.confidences, batch.boxes, track_ids))
+        except queue.Full:
+            self.dropped_frames += 1
+            return False
+        return True
+
+    def _run(self):
+        pending = []
+        pending_rows = 0
+        next_flush = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(next_flush - time.monotonic(), 0.01))
+            except queue.Empty:
+                item = False
+            if item is None:
+                break
+            if item:
+                pending.append(item)
+                pending_rows += len(item[3])
+            if pending_rows >= self.flush_rows or (pending and time.monotonic() >= next_flush):
+                self._write(pending)
+                pending, pending_rows = [], 0
+            if time.monotonic() >= next_flush:
+                self.store.flush()
+                next_flush = time.monotonic() + self.flush_interval
+        if pending:
+            self._write(pending)
+
+    def _write(self, frames):
+        start = time.perf_counter()
+        block = frames_to_block(frames, self.run)
+        self.store.write(block)
+        self.frames += len(frames)
+        self.rows += len(block['time_ns'])
+        self.blocks += 1
+        self.write_time += time.perf_counter() - start
+
+    def get_stats(self):
+        return {
+            'frames': self.frames,
+            'rows': self.rows,
+            'dropped_frames': self.dropped_frames,
+            'pending_frames': self._queue.qsize(),
+            'blocks': self.blocks,
+            'write_time': self.write_time,
+        }
+
+    def report(self):
+        stats = self.get_stats()
+        print(
+            f"Detection store: {stats['rows']} detections from {stats['frames']} frames written, "
+            f"{stats['pending_frames']} pending, {stats['dropped_frames']} frames dropped"
+        )
+        # Returning True keeps the GLib timeout running
+        return True
+
+    def close(self, timeout=10.0):
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self.store.close()
+
+
+class DetectionCollector:
+    """
+    Keeps DetectionBatches in memory with the append() of DetectionWriter, for runs that hand
+    their detections back as one block (replay workers) instead of persisting them as they come.
+    """
+    def __init__(self):
+        self.frames = []
+        # pts of every frame seen, with or without detections
+        self.frame_pts = []
+
+    def append(self, time_ns, pts, source, batch, track_ids=None):
+        self.frame_pts.append(pts)
+        if len(batch):
+            self.frames.append((time_ns, pts, source, batch.class_ids, batch.confidences, batch.boxes, track_ids))
+        return True
+
+    def clear(self):
+        self.frames = []
+        self.frame_pts = []
+
+    def to_block(self, run=0):
+        return frames_to_block(self.frames, run)
+
+
+def add_detection_store_arguments(parser):
+    parser.add_argument("--store", default=None, metavar="DIR", help="Persist all detections to a columnar store in DIR")
+    parser.add_argument("--store-segment-hours", type=float, default=1.0, help="Hours of detections per store segment")
+    parser.add_argument(
+        "--store-report-interval", type=int, default=60,
+        help="Seconds between detection store statistics reports"
+    )
+    return parser
+
+
+def _parse_time(text):
+    from datetime import datetime
+    return int(datetime.fromisoformat(text).timestamp() * 1e9)
+
+
+def _benchmark(args):
+    # Synthetic multi-month store written through DetectionWriter, then timed queries
+    import tempfile
+    from datetime import datetime, timedelta
+    from detection_batch import DetectionBatch
+
+    root = args.root or tempfile.mkdtemp(prefix="detection_store_")
+    store = DetectionStore(root, segment_seconds=args.segment_hours * 3600)
+    writer = DetectionWriter(store, max_pending=1 << 20)
+    rng = np.random.default_rng(0)
+    start_time = datetime(2026, 1, 1)
+    hour_ns = 3600 * 10**9
+    frames_per_hour = max(args.detections_per_hour // 3, 1)
+    append_times = []
+    track_base = 0
+    wall_start = time.perf_counter()
+    for hour in range(args.days * 24):
+        base = int(start_time.timestamp() * 1e9) + hour * hour_ns
+        times = base + np.sort(rng.integers(0, hour_ns, frames_per_hour))
+        counts = rng.integers(1, 6, frames_per_hour)
+        class_ids = rng.integers(0, 80, counts.sum()).astype(np.int32)
+        confidences = rng.uniform(0.3, 1.0, counts.sum()).astype(np.float32)
+        corners = rng.uniform(0.0, 0.9, (counts.sum(), 2)).astype(np.float32)
+        boxes = np.hstack([corners, corners + 0.05])
+        # A track lasts about 30 frames
+        track_ids = (track_base + np.arange(counts.sum()) // 30).astype(np.int64)
+        track_base += int(counts.sum())
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        for i in range(frames_per_hour):
+            rows = slice(offsets[i], offsets[i + 1])
+            batch = DetectionBatch(int(times[i]), class_ids[rows], confidences[rows], boxes[rows])
+            t0 = time.perf_counter()
+            while not writer.append(int(times[i]), int(times[i]), 0, batch, track_ids[rows]):
+                writer.dropped_frames -= 1
+                time.sleep(0.001)
+            append_times.append(time.perf_counter() - t0)
+    writer.close(timeout=600)
+    wall = time.perf_counter() - wall_start
+    stats = store.get_stats()
+    print(f"Store {root}: {stats['rows']} detections in {stats['segments']} segments, "
+          f"{stats['bytes'] / 2**20:.0f} MiB")
+    append_times = np.array(append_times) * 1e6
+    print(f"Write: {stats['rows'] / wall:,.0f} detections/s overall, writer thread busy "
+          f"{writer.write_time:.1f} s of {wall:.1f} s")
+    print(f"append() on the producer thread: mean {append_times.mean():.1f} us, "
+          f"p99 {np.percentile(append_times, 99):.1f} us, max {append_times.max():.0f} us")
+
+    reopened = DetectionStore(root, readonly=True)
+    day = start_time + timedelta(days=args.days // 2)
+    queries = [
+        ("tracks 02:00-03:00, confidence > 0.6", lambda: reopened.tracks(
+            int((day + timedelta(hours=2)).timestamp() * 1e9), int((day + timedelta(hours=3)).timestamp() * 1e9),
+            min_confidence=0.6)),
+        ("one day, class 0, confidence > 0.9", lambda: reopened.read(
+            int(day.timestamp() * 1e9), int((day + timedelta(days=1)).timestamp() * 1e9),
+            min_confidence=0.9, class_ids=[0])),
+        ("whole store, confidence > 0.99", lambda: reopened.read(min_confidence=0.99, columns=['time_ns', 'class_id'])),
+        ("whole store, tracks of class 5", lambda: reopened.tracks(class_ids=[5])),
+    ]
+    for name, run_query in queries:
+        t0 = time.perf_counter()
+        result = run_query()
+        elapsed = time.perf_counter() - t0
+        rows = len(next(iter(result.values())))
+        print(f"{name}: {rows} rows in {elapsed * 1e3:.1f} ms")
+    if not args.root:
+        import shutil
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query or benchmark a detection store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    tracks_parser = subparsers.add_parser("tracks", help="List the tracks in a time range")
+    tracks_parser.add_argument("root")
+    tracks_parser.add_argument("--start", type=_parse_time, default=None, help="ISO time, e.g. 2026-03-01T02:00")
+    tracks_parser.add_argument("--end", type=_parse_time, default=None)
+    tracks_parser.add_argument("--min-confidence", type=float, default=None)
+    tracks_parser.add_argument("--class-ids", type=int, nargs="+", default=None)
+    benchmark_parser = subparsers.add_parser("benchmark", help="Write synthetic data and time queries")
+    benchmark_parser.add_argument("--root", default=None, help="Keep the store in this directory")
+    benchmark_parser.add_argument("--days", type=int, default=30)
+    benchmark_parser.add_argument("--detections-per-hour", type=int, default=5000)
+    benchmark_parser.add_argument("--segment-hours", type=float, default=1.0)
+    args = parser.parse_args()
+
+    if args.command == "benchmark":
+        _benchmark(args)
+    else:
+        from datetime import datetime
+        store = DetectionStore(args.root, readonly=True)
+        tracks = store.tracks(args.start, args.end, args.min_confidence, args.class_ids)
+        for i in range(len(tracks['track_id'])):
+            first = datetime.fromtimestamp(tracks['first_time'][i] / 1e9).isoformat(timespec='seconds')
+            last = datetime.fromtimestamp(tracks['last_time'][i] / 1e9).isoformat(timespec='seconds')
+            print(f"run {tracks['run'][i]} source {tracks['source'][i]} track {tracks['track_id'][i]}: "
+                  f"class {tracks['class_id'][i]} {first} - {last}, {tracks['detections'][i]} detections, "
+                  f"max confidence {tracks['max_confidence'][i]:.2f}")
+        print(f"{len(tracks['track_id'])} tracks")
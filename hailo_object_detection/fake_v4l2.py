@@ -0,0 +1,268 @@
+import errno
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+import numpy as np
+import v4l2
+
+# -----------------------------------------------------------------------------------------------
+# Simulated V4L2 camera
+# -----------------------------------------------------------------------------------------------
+# Test double for UVCCamera: pass FakeV4L2Device().ioctl as its ioctl and no device is opened.
+# It models the controls of a typical UVC webcam as uvcvideo reports them, including the two
+# dependencies that matter when writing settings:
+# - exposure_time_absolute is inactive and refuses writes (EACCES) unless auto_exposure is manual
+# - white_balance_temperature is inactive and refuses writes unless white_balance_automatic is off
+# VIDIOC_S_EXT_CTRLS is atomic like the real driver: controls are applied in array order against
+# the pending state and nothing is committed if one of them fails. Every ioctl is counted and can
+# be given a latency to stand in for the USB round trip. VIDIOC_G_FMT/S_FMT snap the requested
+# capture format to the closest supported size, as uvcvideo does.
+# expose() renders frames of a scene with the current exposure, gain and gamma so exposure control
+# can be validated without a camera. New control values reach the frames a few frames late, and in
+# aperture priority mode the simulated auto exposure meters the whole frame like the real camera.
+
+
+@dataclass
+class FakeControl:
+    id: int
+    name: str
+    type: int
+    minimum: int = 0
+    maximum: int = 0
+    step: int = 1
+    default: int = 0
+    menu: dict = field(default_factory=dict)
+    flags: int = 0
+
+
+def default_controls():
+    menu = v4l2.V4L2_CTRL_TYPE_MENU
+    integer = v4l2.V4L2_CTRL_TYPE_INTEGER
+    boolean = v4l2.V4L2_CTRL_TYPE_BOOLEAN
+    control_class = v4l2.V4L2_CTRL_TYPE_CTRL_CLASS
+    class_flags = v4l2.V4L2_CTRL_FLAG_READ_ONLY | v4l2.V4L2_CTRL_FLAG_WRITE_ONLY
+    return [
+        FakeControl(v4l2.V4L2_CID_USER_CLASS, "User Controls", control_class, flags=class_flags),
+        FakeControl(v4l2.V4L2_CID_BRIGHTNESS, "Brightness", integer, -64, 64, 1, 0),
+        FakeControl(v4l2.V4L2_CID_CONTRAST, "Contrast", integer, 0, 64, 1, 32),
+        FakeControl(v4l2.V4L2_CID_SATURATION, "Saturation", integer, 0, 128, 1, 64),
+        FakeControl(v4l2.V4L2_CID_HUE, "Hue", integer, -40, 40, 1, 0),
+        FakeControl(v4l2.V4L2_CID_AUTO_WHITE_BALANCE, "White Balance, Automatic", boolean, 0, 1, 1, 1),
+        FakeControl(v4l2.V4L2_CID_GAMMA, "Gamma", integer, 72, 500, 1, 100),
+        FakeControl(v4l2.V4L2_CID_GAIN, "Gain", integer, 0, 100, 1, 0),
+        FakeControl(v4l2.V4L2_CID_POWER_LINE_FREQUENCY, "Power Line Frequency", menu, 0, 2, 1, 1,
+                    {0: "Disabled", 1: "50 Hz", 2: "60 Hz"}),
+        FakeControl(v4l2.V4L2_CID_WHITE_BALANCE_TEMPERATURE, "White Balance Temperature", integer, 2800, 6500, 1, 4600),
+        FakeControl(v4l2.V4L2_CID_SHARPNESS, "Sharpness", integer, 0, 6, 1, 3),
+        FakeControl(v4l2.V4L2_CID_BACKLIGHT_COMPENSATION, "Backlight Compensation", integer, 0, 2, 1, 1),
+        FakeControl(v4l2.V4L2_CID_CAMERA_CLASS, "Camera Controls", control_class, flags=class_flags),
+        FakeControl(v4l2.V4L2_CID_EXPOSURE_AUTO, "Auto Exposure", menu, 0, 3, 1, 3,
+                    {1: "Manual Mode", 3: "Aperture Priority Mode"}),
+        FakeControl(v4l2.V4L2_CID_EXPOSURE_ABSOLUTE, "Exposure Time, Absolute", integer, 1, 5000, 1, 157),
+        FakeControl(v4l2.V4L2_CID_EXPOSURE_AUTO_PRIORITY, "Exposure, Dynamic Framerate", boolean, 0, 1, 1, 0),
+    ]
+
+
+# Control -> (control it depends on, the values that make it active)
+DEPENDENCIES = {
+    v4l2.V4L2_CID_EXPOSURE_ABSOLUTE: (v4l2.V4L2_CID_EXPOSURE_AUTO, (v4l2.V4L2_EXPOSURE_MANUAL,)),
+    v4l2.V4L2_CID_WHITE_BALANCE_TEMPERATURE: (v4l2.V4L2_CID_AUTO_WHITE_BALANCE, (0,)),
+}
+
+# Sensor model of expose(): the full gain range adds GAIN_STOPS of brightness, the gamma control is
+# 100x the exponent's inverse (100 is linear, higher lifts the shadows) and auto exposure aims the
+# frame mean at AUTO_EXPOSURE_TARGET of full scale
+GAIN_STOPS = 4.0
+AUTO_EXPOSURE_TARGET = 0.45
+READ_NOISE = 1.5
+
+FRAME_SIZES = [(640, 480), (1280, 720), (1920, 1080)]
+PIXEL_FORMATS = [v4l2.v4l2_fourcc(*'YUYV'), v4l2.v4l2_fourcc(*'MJPG')]
+
+IOCTL_NAMES = {
+    v4l2.VIDIOC_QUERYCTRL: 'VIDIOC_QUERYCTRL',
+    v4l2.VIDIOC_QUERYMENU: 'VIDIOC_QUERYMENU',
+    v4l2.VIDIOC_G_CTRL: 'VIDIOC_G_CTRL',
+    v4l2.VIDIOC_S_CTRL: 'VIDIOC_S_CTRL',
+    v4l2.VIDIOC_G_EXT_CTRLS: 'VIDIOC_G_EXT_CTRLS',
+    v4l2.VIDIOC_S_EXT_CTRLS: 'VIDIOC_S_EXT_CTRLS',
+    v4l2.VIDIOC_TRY_EXT_CTRLS: 'VIDIOC_TRY_EXT_CTRLS',
+    v4l2.VIDIOC_G_FMT: 'VIDIOC_G_FMT',
+    v4l2.VIDIOC_S_FMT: 'VIDIOC_S_FMT',
+}
+
+
+def _error(code):
+    return OSError(code, f"{errno.errorcode[code]} (simulated)")
+
+
+class FakeV4L2Device:
+    """
+    Args:
+        controls (list, optional): FakeControls, a typical UVC webcam by default.
+        latency (float): Seconds every ioctl takes.
+        frame_delay (int): Frames before new control values show in expose().
+    """
+    def __init__(self, controls=None, latency=0.0, frame_delay=2):
+        self.controls = {control.id: control for control in (controls or default_controls())}
+        self.ids = sorted(self.controls)
+        self.values = {cid: control.default for cid, control in self.controls.items()}
+        self.latency = latency
+        self.calls = Counter()
+        self.width, self.height = FRAME_SIZES[0]
+        self.pixel_format = PIXEL_FORMATS[0]
+        self._exposed = deque(maxlen=frame_delay + 1)
+        self._rng = np.random.default_rng(0)
+
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def is_active(self, cid, values=None):
+        values = self.values if values is None else values
+        if cid not in DEPENDENCIES:
+            return True
+        master, active_values = DEPENDENCIES[cid]
+        return values[master] in active_values
+
+    def ioctl(self, fd, request, arg=0, mutate_flag=True):
+        name = IOCTL_NAMES.get(request)
+        if name is None:
+            raise _error(errno.ENOTTY)
+        self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        getattr(self, '_' + name.lower())(arg)
+        return 0
+
+    def expose(self, radiance):
+        """
+        Renders an 8-bit gray frame of a scene as the sensor would with the current controls.
+
+        Args:
+            radiance (np.ndarray): Scene brightness, in units where 1.0 reaches full scale at
+                exposure_time_absolute=1 and minimum gain.
+
+        Returns:
+            np.ndarray: uint8 frame of the same shape.
+        """
+        self._exposed.append(dict(self.values))
+        values = self._exposed[0]
+        gain = self.controls[v4l2.V4L2_CID_GAIN]
+        amplification = 2.0 ** (GAIN_STOPS * (values[gain.id] - gain.minimum) / (gain.maximum - gain.minimum))
+        exposure = self.controls[v4l2.V4L2_CID_EXPOSURE_ABSOLUTE]
+        if values[v4l2.V4L2_CID_EXPOSURE_AUTO] == v4l2.V4L2_EXPOSURE_MANUAL:
+            exposure_time = values[exposure.id]
+        else:
+            metered = max(float(radiance.mean()) * amplification, 1e-9)
+            exposure_time = int(min(max(AUTO_EXPOSURE_TARGET / metered, exposure.minimum), exposure.maximum))
+            # uvcvideo reports the exposure the camera picked while in an auto mode
+            self.values[exposure.id] = exposure_time
+        signal = np.clip(radiance * (exposure_time * amplification), 0.0, 1.0)
+        signal **= 100.0 / values[v4l2.V4L2_CID_GAMMA]
+        signal *= 255.0
+        signal += self._rng.normal(0.0, READ_NOISE * amplification, signal.shape)
+        return np.clip(signal, 0, 255).astype(np.uint8)
+
+    def _control(self, cid):
+        control = self.controls.get(cid)
+        if control is None:
+            raise _error(errno.EINVAL)
+        return control
+
+    def _vidioc_queryctrl(self, query):
+        cid = query.id
+        if cid & v4l2.V4L2_CTRL_FLAG_NEXT_CTRL:
+            base = cid & ~v4l2.V4L2_CTRL_FLAG_NEXT_CTRL
+            following = [i for i in self.ids if i > base]
+            if not following:
+                raise _error(errno.EINVAL)
+            cid = following[0]
+        control = self._control(cid)
+        query.id = control.id
+        query.type = control.type
+        query.name = control.name.encode()
+        query.minimum = control.minimum
+        query.maximum = control.maximum
+        query.step = control.step
+        query.default = control.default
+        query.flags = control.flags | (0 if self.is_active(cid) else v4l2.V4L2_CTRL_FLAG_INACTIVE)
+
+    def _vidioc_querymenu(self, query):
+        control = self._control(query.id)
+        if query.index not in control.menu:
+            raise _error(errno.EINVAL)
+        query.name = control.menu[query.index].encode()
+
+    def _vidioc_g_ctrl(self, ctrl):
+        self._control(ctrl.id)
+        ctrl.value = self.values[ctrl.id]
+
+    def _vidioc_s_ctrl(self, ctrl):
+        values = dict(self.values)
+        self._write(values, ctrl.id, ctrl.value)
+        self.values = values
+
+    def _write(self, values, cid, value):
+        control = self._control(cid)
+        if control.type == v4l2.V4L2_CTRL_TYPE_CTRL_CLASS:
+            raise _error(errno.EACCES)
+        if value < control.minimum or value > control.maximum or (control.menu and value not in control.menu):
+            raise _error(errno.ERANGE)
+        if not self.is_active(cid, values):
+            raise _error(errno.EACCES)
+        values[cid] = value
+
+    def _items(self, request):
+        for index in range(request.count):
+            yield index, request.controls[index]
+
+    def _check_class(self, request):
+        for index, item in self._items(request):
+            if request.ctrl_class and v4l2.V4L2_CTRL_ID2CLASS(item.id) != request.ctrl_class:
+                request.error_idx = request.count
+                raise _error(errno.EINVAL)
+
+    def _vidioc_g_ext_ctrls(self, request):
+        self._check_class(request)
+        for index, item in self._items(request):
+            if item.id not in self.controls:
+                request.error_idx = index
+                raise _error(errno.EINVAL)
+            item.value = self.values[item.id]
+
+    def _apply(self, request):
+        self._check_class(request)
+        values = dict(self.values)
+        for index, item in self._items(request):
+            try:
+                self._write(values, item.id, item.value)
+            except OSError:
+                request.error_idx = index
+                raise
+        return values
+
+    def _vidioc_s_ext_ctrls(self, request):
+        self.values = self._apply(request)
+
+    def _vidioc_try_ext_ctrls(self, request):
+        self._apply(request)
+
+    def _vidioc_g_fmt(self, fmt):
+        if fmt.type != v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE:
+            raise _error(errno.EINVAL)
+        fmt.fmt.pix.width = self.width
+        fmt.fmt.pix.height = self.height
+        fmt.fmt.pix.pixelformat = self.pixel_format
+        fmt.fmt.pix.bytesperline = self.width * 2
+        fmt.fmt.pix.sizeimage = self.width * self.height * 2
+
+    def _vidioc_s_fmt(self, fmt):
+        if fmt.type != v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE:
+            raise _error(errno.EINVAL)
+        pix = fmt.fmt.pix
+        self.width, self.height = min(
+            FRAME_SIZES, key=lambda size: abs(size[0] - pix.width) + abs(size[1] - pix.height)
+        )
+        if pix.pixelformat in PIXEL_FORMATS:
+            self.pixel_format = pix.pixelformat
+        self._vidioc_g_fmt(fmt)
@@ -0,0 +1,149 @@
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+
+# -----------------------------------------------------------------------------------------------
+# Shared-memory frame ring
+# -----------------------------------------------------------------------------------------------
+# Fixed-slot ring buffer used to hand frames from the GStreamer streaming thread to the display
+# process without pickling them through a pipe.
+# - The producer copies each frame once, in place, into the next slot and never blocks.
+#   When the consumer falls behind, the oldest unread frames are overwritten.
+# - The consumer blocks until a newer frame is published and always gets the most recent one.
+#   Frames it never saw are accounted for in the drop counters.
+# - Each slot carries a sequence number that is invalidated while the slot is being written,
+#   so a reader that races with the producer detects the torn frame and retries.
+#
+# The sequence numbers are only written and checked under the condition's lock, whose acquire
+# and release synchronize memory between the processes, so the seqlock holds on ARM (the Pi
+# target) as well as x86: the producer invalidates the slot before copying and publishes it
+# after, and the consumer checks the slot before and after its copy. The frame copies
+# themselves run outside the lock, so neither side waits for the other's copy.
+#
+# Shared memory layout: [ header (int64) | slot 0 | slot 1 | ... ]
+
+# Global header fields
+_WRITE_SEQ = 0
+_READ_SEQ = 1
+_DROPPED = 2
+_OVERSIZE = 3
+_GLOBAL_FIELDS = 4
+# Per-slot header fields: sequence number followed by the frame shape (height, width, channels)
+_SLOT_SEQ = 0
+_SLOT_FIELDS = 4
+_WRITING = -1
+
+
+class SharedFrameRing:
+    """
+    Shared-memory ring of uint8 frames with overwrite-oldest semantics.
+
+    Args:
+        num_slots (int): Number of frame slots in the ring.
+        max_frame_bytes (int): Size of each slot. Frames larger than this are dropped and counted.
+    """
+    def __init__(self, num_slots=3, max_frame_bytes=1920 * 1080 * 3):
+        self.num_slots = num_slots
+        self.max_frame_bytes = max_frame_bytes
+        self._header_size = (_GLOBAL_FIELDS + num_slots * _SLOT_FIELDS) * 8
+        self._shm = shared_memory.SharedMemory(create=True, size=self._header_size + num_slots * max_frame_bytes)
+        self._owner_pid = multiprocessing.current_process().pid
+        self._ready = multiprocessing.Condition()
+        self._attach()
+        self._header[:] = 0
+
+    def _attach(self):
+        header = np.ndarray((_GLOBAL_FIELDS + self.num_slots * _SLOT_FIELDS,), dtype=np.int64, buffer=self._shm.buf)
+        self._header = header
+        self._counters = header[:_GLOBAL_FIELDS]
+        self._slot_headers = header[_GLOBAL_FIELDS:].reshape(self.num_slots, _SLOT_FIELDS)
+        self._slots = np.ndarray((self.num_slots, self.max_frame_bytes), dtype=np.uint8,
+                                 buffer=self._shm.buf, offset=self._header_size)
+
+    # numpy views over the shared buffer are not picklable; re-create them in the child process
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ('_header', '_counters', '_slot_headers', '_slots'):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._attach()
+
+    def put(self, frame):
+        """
+        Publishes a frame. Never blocks; overwrites the oldest slot when the ring is full.
+
+        Returns:
+            bool: False if the frame did not fit in a slot and was dropped.
+        """
+        if frame.dtype != np.uint8:
+            raise ValueError(f"Unsupported frame dtype: {frame.dtype}")
+        if frame.nbytes > self.max_frame_bytes:
+            self._counters[_OVERSIZE] += 1
+            return False
+
+        seq = int(self._counters[_WRITE_SEQ]) + 1
+        index = seq % self.num_slots
+        slot_header = self._slot_headers[index]
+        with self._ready:
+            slot_header[_SLOT_SEQ] = _WRITING
+        # Single in-place copy; np.copyto handles non-contiguous (e.g. strided view) frames
+        np.copyto(self._slots[index, :frame.nbytes].reshape(frame.shape), frame)
+        height, width = frame.shape[:2]
+
+        with self._ready:
+            slot_header[1:] = (height, width, frame.shape[2] if frame.ndim == 3 else 0)
+            slot_header[_SLOT_SEQ] = seq
+            self._counters[_WRITE_SEQ] = seq
+            self._ready.notify_all()
+        return True
+
+    def get(self, timeout=None):
+        """
+        Blocks until a frame newer than the last one read is available and returns a copy of it.
+
+        Args:
+            timeout (float, optional): Seconds to wait. None waits forever.
+
+        Returns:
+            np.ndarray: The most recent frame, or None on timeout.
+        """
+        while True:
+            with self._ready:
+                if not self._ready.wait_for(lambda: self._counters[_WRITE_SEQ] > self._counters[_READ_SEQ], timeout):
+                    return None
+                seq = int(self._counters[_WRITE_SEQ])
+                index = seq % self.num_slots
+                slot_header = self._slot_headers[index]
+                valid = slot_header[_SLOT_SEQ] == seq
+                height, width, channels = (int(v) for v in slot_header[1:])
+
+            # Frames published since the last read were never seen by the consumer
+            self._counters[_DROPPED] += seq - self._counters[_READ_SEQ] - 1
+            self._counters[_READ_SEQ] = seq
+
+            if valid:
+                shape = (height, width, channels) if channels else (height, width)
+                frame = self._slots[index, :height * width * max(channels, 1)].reshape(shape).copy()
+                with self._ready:
+                    valid = slot_header[_SLOT_SEQ] == seq
+                if valid:
+                    return frame
+            # The producer lapped us while copying; the frame is torn, count it and retry
+            self._counters[_DROPPED] += 1
+
+    def get_stats(self):
+        return {
+            'written': int(self._counters[_WRITE_SEQ]),
+            'read': int(self._counters[_READ_SEQ]),
+            'dropped': int(self._counters[_DROPPED]),
+            'oversize': int(self._counters[_OVERSIZE]),
+        }
+
+    def close(self):
+        self._header = self._counters = self._slot_headers = self._slots = None
+        self._shm.close()
+        if multiprocessing.current_process().pid == self._owner_pid:
+            self._shm.unlink()
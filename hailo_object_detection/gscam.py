@@ -1,132 +1,297 @@
-import subprocess
-import json
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+import queue
+import threading
+import time
 from uvccamconfig import UVCCamera
 
+# -----------------------------------------------------------------------------------------------
+# In-process capture with concurrent outputs
+# -----------------------------------------------------------------------------------------------
+# The camera is captured once and a tee fans the frames out to any combination of:
+# - display: autovideosink
+# - appsink: frames handed to a callback, or to the frames() iterator, as read-only numpy views
+#   of the mapped buffer (no copy)
+# - stream: H.264 over RTP/UDP
+# Every branch starts with its own leaky queue, so a consumer that falls behind loses its oldest
+# frames instead of stalling capture and the other branches. Each queue counts the buffers it
+# passes and drops (every overrun of a leaky queue is one dropped buffer).
 
-class GStreamerCamera(UVCCamera):
-    def __init__(self, device='/dev/video0'):
-        super().__init__(device)
-        self.gstreamer_options = self.get_gstreamer_options()
-    
-    def get_gstreamer_options(self):
-        gstreamer_options = {
-            'display': {
-                'description': 'Local display using autovideosink',
-                'enabled': False
-            },
-            'appsink': {
-                'description': 'Output video frames to an application using appsink',
-                'enabled': False
-            },
-            'stream': {
-                'description': 'Stream video over network using udpsink',
-                'enabled': False,
-                'ip': '127.0.0.1',  # Default IP for streaming
-                'port': 5000  # Default port for streaming
-            }
-        }
-        return gstreamer_options
-    
-    def configure_gstreamer(self, config):
-        pipeline_elements = ['v4l2src', f'device={self.device}', '!']
-
-        # Add a video converter in the pipeline
-        pipeline_elements.append('videoconvert')
 
-        if config.get('display', {}).get('enabled'):
-            # If display mode is enabled, use autovideosink
-            pipeline_elements.extend(['!', 'autovideosink'])
+def BRANCH_QUEUE(name, max_size_buffers=3):
+    return (
+        f"queue name={name} leaky=downstream max-size-buffers={max_size_buffers} "
+        "max-size-bytes=0 max-size-time=0 ! "
+    )
 
-        elif config.get('appsink', {}).get('enabled'):
-            # If appsink mode is enabled, use appsink
-            pipeline_elements.extend(['!', 'appsink'])
 
-        elif config.get('stream', {}).get('enabled'):
-            # If streaming mode is enabled, set up udpsink with IP and port
-            stream_ip = config['stream'].get('ip', '127.0.0.1')
-            stream_port = config['stream'].get('port', 5000)
-            pipeline_elements.extend([
-                '!', 'x264enc', 'tune=zerolatency',
-                '!', 'rtph264pay', 
-                '!', f'udpsink host={stream_ip} port={stream_port}'
-            ])
+class BranchStats:
+    def __init__(self, name, queue_element):
+        self.name = name
+        self.buffers = 0
+        self.dropped = 0
+        self.max_level = 0
+        self.queue = queue_element
+        queue_element.connect("overrun", self._on_overrun)
+        queue_element.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self._on_buffer)
 
-        # Combine the elements into a properly formatted GStreamer pipeline
-        pipeline_command = 'gst-launch-1.0 ' + ' '.join(pipeline_elements)
+    def _on_buffer(self, pad, info):
+        self.buffers += 1
+        self.max_level = max(self.max_level, self.queue.get_property("current-level-buffers") + 1)
+        return Gst.PadProbeReturn.OK
 
-        print(f"Running GStreamer Pipeline: {pipeline_command}")
+    def _on_overrun(self, queue_element):
+        self.dropped += 1
 
-        # Run GStreamer pipeline
-        try:
-            subprocess.run(pipeline_command, shell=True, check=True)
-        except subprocess.CalledProcessError as e:
-            print(f"Error running pipeline: {e}")
-    
-    def get_gstreamer_pipeline_config(self):
-        return self.gstreamer_options
-import subprocess
-import json
-from uvccamconfig import UVCCamera
+    def snapshot(self):
+        return {'buffers': self.buffers, 'dropped': self.dropped, 'max_level': self.max_level}
 
 
 class GStreamerCamera(UVCCamera):
+    """
+    UVC camera with an in-process GStreamer capture pipeline.
+
+    configure_gstreamer() builds the pipeline from the options, start() and stop() run it without
+    blocking the caller and run() blocks until end of stream, an error or Ctrl-C.
+    """
     def __init__(self, device='/dev/video0'):
         super().__init__(device)
         self.gstreamer_options = self.get_gstreamer_options()
-    
+        self.pipeline = None
+        self.branches = {}
+        self.error = None
+        self.frame_callback = None
+        self.appsink_frames = 0
+        self.appsink_time = 0.0
+        self._samples = queue.Queue(maxsize=2)
+        self._bus_thread = None
+        self._running = threading.Event()
+        self._eos = threading.Event()
+
     def get_gstreamer_options(self):
         gstreamer_options = {
+            'source': {
+                'description': 'Capture format of the camera',
+                'width': 640,
+                'height': 480,
+                'framerate': 30
+            },
             'display': {
                 'description': 'Local display using autovideosink',
                 'enabled': False
             },
             'appsink': {
                 'description': 'Output video frames to an application using appsink',
-                'enabled': False
+                'enabled': False,
+                'format': 'RGB'  # Format of the frames handed to the application
             },
             'stream': {
                 'description': 'Stream video over network using udpsink',
                 'enabled': False,
                 'ip': '127.0.0.1',  # Default IP for streaming
-                'port': 5000  # Default port for streaming
+                'port': 5000,  # Default port for streaming
+                'bitrate': 2000  # kbit/s
             }
         }
         return gstreamer_options
-    
+
+    def get_pipeline_string(self, config):
+        source = {**self.gstreamer_options['source'], **config.get('source', {})}
+        pipeline_string = (
+            f"v4l2src device={self.device} name=src ! "
+            f"video/x-raw, width={source['width']}, height={source['height']}, "
+            f"framerate={source['framerate']}/1 ! "
+            "tee name=t "
+        )
+        if config.get('display', {}).get('enabled'):
+            pipeline_string += (
+                "t. ! " + BRANCH_QUEUE("queue_display")
+                + "videoconvert ! autovideosink sync=false "
+            )
+        if config.get('appsink', {}).get('enabled'):
+            frame_format = config['appsink'].get('format', 'RGB')
+            pipeline_string += (
+                "t. ! " + BRANCH_QUEUE("queue_appsink")
+                + f"videoconvert ! video/x-raw, format={frame_format} ! "
+                "appsink name=app_sink emit-signals=true max-buffers=1 drop=true sync=false "
+            )
+        if config.get('stream', {}).get('enabled'):
+            stream_ip = config['stream'].get('ip', '127.0.0.1')
+            stream_port = config['stream'].get('port', 5000)
+            bitrate = config['stream'].get('bitrate', 2000)
+            pipeline_string += (
+                "t. ! " + BRANCH_QUEUE("queue_stream")
+                + "videoconvert ! "
+                f"x264enc tune=zerolatency speed-preset=ultrafast bitrate={bitrate} key-int-max=30 ! "
+                "rtph264pay config-interval=1 pt=96 ! "
+                f"udpsink host={stream_ip} port={stream_port} sync=false async=false "
+            )
+        if not any(config.get(name, {}).get('enabled') for name in ('display', 'appsink', 'stream')):
+            # A tee without branches would not negotiate; keep capture running into a fakesink
+            pipeline_string += "t. ! " + BRANCH_QUEUE("queue_null") + "fakesink sync=false "
+        return pipeline_string
+
     def configure_gstreamer(self, config):
-        pipeline_elements = ['v4l2src', f'device={self.device}', '!']
+        """
+        Builds the pipeline for the enabled branches. Call start() or run() to capture.
+        """
+        Gst.init(None)
+        if self.pipeline is not None:
+            self.stop()
+        pipeline_string = self.get_pipeline_string(config)
+        print(f"GStreamer pipeline: {pipeline_string}")
+        self.pipeline = Gst.parse_launch(pipeline_string)
+        self.branches = {}
+        for name in ('display', 'appsink', 'stream', 'null'):
+            queue_element = self.pipeline.get_by_name(f"queue_{name}")
+            if queue_element is not None:
+                self.branches[name] = BranchStats(name, queue_element)
+        appsink = self.pipeline.get_by_name("app_sink")
+        if appsink is not None:
+            appsink.connect("new-sample", self._on_new_sample)
+        return pipeline_string
 
-        # Add a video converter in the pipeline
-        pipeline_elements.append('videoconvert')
+    def set_frame_callback(self, callback):
+        """
+        Calls callback(pts, frame) on the appsink streaming thread for every frame. The frame is a
+        read-only view of the mapped buffer, only valid during the call. Without a callback,
+        frames are available from frames().
+        """
+        self.frame_callback = callback
 
-        if config.get('display', {}).get('enabled'):
-            # If display mode is enabled, use autovideosink
-            pipeline_elements.extend(['!', 'autovideosink'])
+    def _on_new_sample(self, appsink):
+        sample = appsink.emit("pull-sample")
+        if sample is None:
+            return Gst.FlowReturn.OK
+        if self.frame_callback is None:
+            # Hand the sample to frames(), replacing the oldest one if the consumer is behind
+            try:
+                self._samples.put_nowait(sample)
+            except queue.Full:
+                try:
+                    self._samples.get_nowait()
+                    # Dropped on the application side, counted with the branch
+                    self.branches['appsink'].dropped += 1
+                except queue.Empty:
+                    pass
+                self._samples.put_nowait(sample)
+            return Gst.FlowReturn.OK
+        from hailo_rpi_common import get_numpy_view_from_buffer
+        start = time.perf_counter()
+        buffer = sample.get_buffer()
+        format, width, height = self._sample_format(sample)
+        with get_numpy_view_from_buffer(buffer, format, width, height) as frame:
+            self.frame_callback(buffer.pts, frame)
+        self.appsink_frames += 1
+        self.appsink_time += time.perf_counter() - start
+        return Gst.FlowReturn.OK
 
-        elif config.get('appsink', {}).get('enabled'):
-            # If appsink mode is enabled, use appsink
-            pipeline_elements.extend(['!', 'appsink'])
+    @staticmethod
+    def _sample_format(sample):
+        structure = sample.get_caps().get_structure(0)
+        return structure.get_value('format'), structure.get_value('width'), structure.get_value('height')
 
-        elif config.get('stream', {}).get('enabled'):
-            # If streaming mode is enabled, set up udpsink with IP and port
-            stream_ip = config['stream'].get('ip', '127.0.0.1')
-            stream_port = config['stream'].get('port', 5000)
-            pipeline_elements.extend([
-                '!', 'x264enc', 'tune=zerolatency',
-                '!', 'rtph264pay', 
-                '!', f'udpsink host={stream_ip} port={stream_port}'
-            ])
+    def frames(self, timeout=1.0):
+        """
+        Yields (pts, frame) from the appsink until the pipeline stops. Each frame is a read-only
+        view of the mapped buffer and stays valid until the next iteration; copy it to keep it.
+        Frames arriving faster than they are consumed are dropped, the newest one is kept.
+        """
+        from hailo_rpi_common import get_numpy_view_from_buffer
+        while self._running.is_set() or not self._samples.empty():
+            try:
+                sample = self._samples.get(timeout=timeout)
+            except queue.Empty:
+                continue
+            if sample is None:
+                return
+            start = time.perf_counter()
+            buffer = sample.get_buffer()
+            format, width, height = self._sample_format(sample)
+            with get_numpy_view_from_buffer(buffer, format, width, height) as frame:
+                yield buffer.pts, frame
+            self.appsink_frames += 1
+            self.appsink_time += time.perf_counter() - start
+
+    def start(self):
+        if self.pipeline is None:
+            self.configure_gstreamer(self.gstreamer_options)
+        self.error = None
+        self._eos.clear()
+        self._running.set()
+        self._bus_thread = threading.Thread(target=self._watch_bus, daemon=True)
+        self._bus_thread.start()
+        if self.pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+            self.error = "Failed to start the pipeline"
+            self.stop()
+            raise RuntimeError(self.error)
 
-        # Combine the elements into a properly formatted GStreamer pipeline
-        pipeline_command = 'gst-launch-1.0 ' + ' '.join(pipeline_elements)
+    def _watch_bus(self):
+        bus = self.pipeline.get_bus()
+        message_types = Gst.MessageType.EOS | Gst.MessageType.ERROR | Gst.MessageType.WARNING
+        while self._running.is_set():
+            message = bus.timed_pop_filtered(100 * Gst.MSECOND, message_types)
+            if message is None:
+                continue
+            if message.type == Gst.MessageType.EOS:
+                self._eos.set()
+                break
+            if message.type == Gst.MessageType.ERROR:
+                err, debug = message.parse_error()
+                self.error = f"{err}: {debug}"
+                print(f"Error: {self.error}")
+                break
+            err, debug = message.parse_warning()
+            print(f"Warning: {err}: {debug}")
+        self._running.clear()
+        # Wake up frames()
+        try:
+            self._samples.put_nowait(None)
+        except queue.Full:
+            pass
 
-        print(f"Running GStreamer Pipeline: {pipeline_command}")
+    def stop(self, timeout=2.0):
+        """
+        Sends EOS so the encoder and udpsink flush, then shuts the pipeline down.
+        """
+        if self.pipeline is None:
+            return
+        if self._running.is_set():
+            self.pipeline.send_event(Gst.Event.new_eos())
+            self._eos.wait(timeout)
+            self._running.clear()
+        if self._bus_thread is not None:
+            self._bus_thread.join()
+            self._bus_thread = None
+        self.pipeline.set_state(Gst.State.NULL)
+        while not self._samples.empty():
+            self._samples.get_nowait()
 
-        # Run GStreamer pipeline
+    def run(self):
+        """
+        Captures until end of stream, an error or Ctrl-C.
+        """
+        self.start()
         try:
-            subprocess.run(pipeline_command, shell=True, check=True)
-        except subprocess.CalledProcessError as e:
-            print(f"Error running pipeline: {e}")
-    
+            while self._running.is_set():
+                time.sleep(0.1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+        return self.error is None
+
+    def get_stats(self):
+        stats = {name: branch.snapshot() for name, branch in self.branches.items()}
+        if 'appsink' in stats:
+            stats['appsink']['consumed'] = self.appsink_frames
+            stats['appsink']['mean_consumer_ms'] = self.appsink_time / max(self.appsink_frames, 1) * 1e3
+        return stats
+
     def get_gstreamer_pipeline_config(self):
         return self.gstreamer_options
+
+    def close(self):
+        self.stop()
+        super().close()
@@ -1,6 +1,7 @@
 import gi
 gi.require_version('Gst', '1.0')
-from gi.repository import Gst, GLib, GObject
+gi.require_version('GstVideo', '1.0')
+from gi.repository import Gst, GstVideo, GLib, GObject
 import os
 import argparse
 import multiprocessing
@@ -8,12 +9,19 @@ import numpy as np
 import setproctitle
 import cv2
 import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from frame_ring import SharedFrameRing
+from pipeline_stats import PipelineInstrumentation
 
 # Try to import hailo python module
+# Only the instrumentation of multi-source pipelines uses it here; apps that use hailo import it
+# themselves, so hosts without the hailo virtual environment can still build and benchmark
+# pipelines.
 try:
     import hailo
 except ImportError:
-    exit("Failed to import hailo python module. Make sure you are in hailo virtual environment.")
+    hailo = None
 
 # -----------------------------------------------------------------------------------------------
 # User-defined class to be used in the callback function
@@ -21,16 +29,28 @@ except ImportError:
 # A sample class to be used in the callback function
 # This example allows to:
 # 1. Count the number of frames
-# 2. Setup a multiprocessing queue to pass the frame to the main thread
+# 2. Setup a shared-memory frame ring to pass the frame to the display process
 # Additional variables and functions can be added to this class as needed
 
 class app_callback_class:
     def __init__(self):
         self.frame_count = 0
-        self.use_frame = False
-        self.frame_queue = multiprocessing.Queue(maxsize=3)
+        # Created when use_frame is set, so apps without --use-frame keep ~19 MB of /dev/shm
+        self.frame_ring = None
+        self._use_frame = False
         self.running = True
 
+    @property
+    def use_frame(self):
+        return self._use_frame
+
+    @use_frame.setter
+    def use_frame(self, value):
+        # Set before the display process starts, which inherits the ring
+        self._use_frame = bool(value)
+        if self._use_frame and self.frame_ring is None:
+            self.frame_ring = SharedFrameRing(num_slots=3)
+
     def increment(self):
         self.frame_count += 1
 
@@ -38,14 +58,18 @@ class app_callback_class:
         return self.frame_count 
 
     def set_frame(self, frame):
-        if not self.frame_queue.full():
-            self.frame_queue.put(frame)
+        # Never blocks the streaming thread; the oldest unread frame is overwritten when full
+        self.frame_ring.put(frame)
         
-    def get_frame(self):
-        if not self.frame_queue.empty():
-            return self.frame_queue.get()
-        else:
-            return None
+    def get_frame(self, timeout=None):
+        # Blocks until a new frame is available, returns None on timeout
+        return self.frame_ring.get(timeout=timeout)
+
+    def get_frame_stats(self):
+        # Frames written/read, frames overwritten before display and frames too large for a slot
+        if self.frame_ring is None:
+            return {'written': 0, 'read': 0, 'dropped': 0, 'oversize': 0}
+        return self.frame_ring.get_stats()
 
 # -----------------------------------------------------------------------------------------------
 # Common functions
@@ -67,7 +91,8 @@ def get_caps_from_pad(pad: Gst.Pad):
 # This function is used to display the user data frame
 def display_user_data_frame(user_data: app_callback_class):
     while user_data.running:
-        frame = user_data.get_frame()
+        # Block on the ring instead of polling; the timeout keeps the window responsive
+        frame = user_data.get_frame(timeout=0.1)
         if frame is not None:
             cv2.imshow("User Frame", frame)
         cv2.waitKey(1)
@@ -76,9 +101,10 @@ def display_user_data_frame(user_data: app_callback_class):
 def get_default_parser():
     parser = argparse.ArgumentParser(description="Hailo App Help")
     parser.add_argument(
-        "--input", "-i", type=str, default="/dev/video0",
-        help="Input source. Can be a file, USB or RPi camera (CSI camera module). \
+        "--input", "-i", type=str, nargs="+", default=["/dev/video0"],
+        help="Input source(s). Each can be a file, USB or RPi camera (CSI camera module). \
         For RPi camera use '-i rpi' (Still in Beta). \
+        Several sources share one hailonet, e.g. '-i /dev/video0 /dev/video2'. \
         Defaults to /dev/video0"
     )
     parser.add_argument("--use-frame", "-u", action="store_true", help="Use frame from the callback function")
@@ -88,10 +114,213 @@ def get_default_parser():
         help="Disables display sink sync, will run as fast as possible. Relevant when using file source."
     )
     parser.add_argument("--dump-dot", action="store_true", help="Dump the pipeline graph to a dot file pipeline.dot")
+    parser.add_argument(
+        "--instrument", action="store_true",
+        help="Measure per-stage latency, queue levels and drops and print a periodic summary"
+    )
+    parser.add_argument("--instrument-interval", type=int, default=10, help="Seconds between instrumentation summaries")
+    parser.add_argument(
+        "--queue-policy", nargs="+", default=[], metavar="BRANCH=POLICY[:MAX_AGE_MS]",
+        help="Queue policy per branch (source, inference, display): lossless, bounded or best-effort, "
+             "e.g. 'source=bounded:150 display=best-effort'"
+    )
+    parser.add_argument("--queue-report-interval", type=int, default=10, help="Seconds between queue drop reports, 0 to disable")
     return parser
 
-def QUEUE(name, max_size_buffers=3, max_size_bytes=0, max_size_time=0):
-    return f"queue name={name} max-size-buffers={max_size_buffers} max-size-bytes={max_size_bytes} max-size-time={max_size_time} ! "
+# -----------------------------------------------------------------------------------------------
+# Queue policies
+# -----------------------------------------------------------------------------------------------
+# Every queue belongs to a branch, found from its name, and gets the policy of its branch:
+# - lossless: upstream blocks while the queue is full, nothing is dropped
+# - bounded: leaky, the oldest buffer is dropped when the queue is full or holds more than
+#   max_age_ms of video, and in live pipelines buffers older than max_age_ms leave nowhere
+# - best-effort: leaky with a single buffer, the consumer only ever sees the newest frame
+# For live sources the defaults bound the latency of the source branch, so frames reach inference
+# fresh (files stay lossless so every frame is processed), and make the display best effort, so
+# a slow display drops frames instead of blocking the callback and inference upstream of it.
+# The queues between a splitter (the inference tee, hailotilecropper) and the element that pairs
+# its branches again (hailomuxer, hailotileaggregator) always stay lossless: dropping on one side
+# only would pair detections with the wrong frames. check_paired_queues() enforces it on the
+# built pipeline.
+
+@dataclass
+class QueuePolicy:
+    max_size_buffers: int = 3
+    leaky: bool = False
+    max_age_ms: int = 0
+
+QUEUE_POLICY_PRESETS = {
+    'lossless': QueuePolicy(),
+    'bounded': QueuePolicy(max_size_buffers=3, leaky=True, max_age_ms=200),
+    'best-effort': QueuePolicy(max_size_buffers=1, leaky=True),
+}
+DEFAULT_BRANCH_POLICIES = {'source': 'bounded', 'inference': 'lossless', 'display': 'best-effort'}
+# Queue name prefix -> branch; queues matching none belong to the inference branch
+QUEUE_BRANCHES = (
+    ('queue_src_', 'source'),
+    ('queue_scale', 'source'),
+    ('queue_dec264', 'source'),
+    ('queue_tile_cropper', 'source'),
+    ('queue_hailooverlay', 'display'),
+    ('queue_videoconvert', 'display'),
+    ('queue_hailo_display', 'display'),
+)
+LOSSLESS_QUEUES = (
+    'bypass_queue', 'queue_hailonet', 'queue_hailofilter', 'queue_hmuc', 'queue_hailo_router',
+    'queue_tile_aggregator',
+)
+# Elements that split a frame into branches and the elements that pair the branches up again
+PAIRED_SPLITTERS = ('tee', 'hailotilecropper')
+PAIRED_JOINERS = ('hailomuxer', 'hailotileaggregator')
+
+def parse_queue_policies(specs, live=True):
+    """
+    Returns branch -> QueuePolicy from the defaults and 'branch=preset[:max_age_ms]' specs.
+    """
+    policies = {branch: QUEUE_POLICY_PRESETS[preset] for branch, preset in DEFAULT_BRANCH_POLICIES.items()}
+    if not live:
+        policies['source'] = QUEUE_POLICY_PRESETS['lossless']
+    for spec in specs:
+        branch, _, value = spec.partition("=")
+        preset, _, max_age = value.partition(":")
+        if branch not in DEFAULT_BRANCH_POLICIES or preset not in QUEUE_POLICY_PRESETS:
+            raise ValueError(f"Invalid queue policy '{spec}'")
+        policy = QUEUE_POLICY_PRESETS[preset]
+        if max_age:
+            policy = QueuePolicy(policy.max_size_buffers, policy.leaky, int(max_age))
+        policies[branch] = policy
+    return policies
+
+def get_queue_branch(name):
+    for prefix, branch in QUEUE_BRANCHES:
+        if name.startswith(prefix):
+            return branch
+    return 'inference'
+
+def QUEUE(name, max_size_buffers=3, max_size_bytes=0, max_size_time=0, policies=None):
+    # policies is the branch -> QueuePolicy of parse_queue_policies(); None keeps the fixed sizes
+    if policies is None or name.startswith(LOSSLESS_QUEUES):
+        return f"queue name={name} max-size-buffers={max_size_buffers} max-size-bytes={max_size_bytes} max-size-time={max_size_time} ! "
+    policy = policies[get_queue_branch(name)]
+    if not policy.leaky:
+        return f"queue name={name} max-size-buffers={max(max_size_buffers, policy.max_size_buffers)} max-size-bytes=0 max-size-time=0 ! "
+    return (
+        f"queue name={name} leaky=downstream max-size-buffers={policy.max_size_buffers} max-size-bytes=0 "
+        f"max-size-time={policy.max_age_ms * Gst.MSECOND} ! "
+    )
+
+def check_paired_queues(pipeline, joiners=PAIRED_JOINERS):
+    """
+    Raises ValueError if a leaky queue sits on a branch from a splitter to the joiner that pairs
+    its branches again.
+    """
+    it = pipeline.iterate_recurse()
+    while True:
+        result, splitter = it.next()
+        if result != Gst.IteratorResult.OK:
+            break
+        factory = splitter.get_factory()
+        if factory is None or factory.get_name() not in PAIRED_SPLITTERS:
+            continue
+        pending = [(pad.get_peer(), ()) for pad in splitter.srcpads]
+        visited = set()
+        while pending:
+            peer, leaky = pending.pop()
+            element = peer.get_parent_element() if peer is not None else None
+            if element is None or element in visited:
+                continue
+            visited.add(element)
+            name = element.get_factory().get_name() if element.get_factory() is not None else ""
+            if name in joiners:
+                if leaky:
+                    raise ValueError(
+                        f"Leaky queues {', '.join(leaky)} between {splitter.get_name()} and {element.get_name()} "
+                        "would pair frames and detections wrongly"
+                    )
+                continue
+            if name == "queue" and int(element.get_property("leaky")) != 0:
+                leaky = leaky + (element.get_name(),)
+            pending.extend((pad.get_peer(), leaky) for pad in element.srcpads)
+
+class QueueDrops:
+    """
+    Accounts for every buffer the pipeline's queues drop.
+
+    A leaky queue emits overrun for every buffer it drops; for a lossless queue an overrun means
+    upstream had to wait and is counted as blocked. In live pipelines, bounded queues also drop
+    buffers that are older than their max age when they leave the queue (expired).
+    """
+    def __init__(self, pipeline, live=False):
+        self.queues = {}
+        self._clock_element = pipeline
+        it = pipeline.iterate_recurse()
+        while True:
+            result, element = it.next()
+            if result != Gst.IteratorResult.OK:
+                break
+            if element.get_factory() is None or element.get_factory().get_name() != "queue":
+                continue
+            name = element.get_name()
+            leaky = int(element.get_property("leaky")) != 0
+            counts = {'branch': get_queue_branch(name), 'leaky': leaky, 'dropped': 0, 'expired': 0, 'blocked': 0}
+            self.queues[name] = counts
+            element.connect("overrun", self._on_overrun, counts)
+            max_age = element.get_property("max-size-time")
+            if live and leaky and max_age:
+                element.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self._expire, (counts, max_age))
+        self._reported = {name: 0 for name in self.queues}
+
+    def _on_overrun(self, queue, counts):
+        counts['dropped' if counts['leaky'] else 'blocked'] += 1
+
+    def _expire(self, pad, info, data):
+        counts, max_age = data
+        buffer = info.get_buffer()
+        clock = self._clock_element.get_clock()
+        if buffer is None or clock is None or buffer.pts == Gst.CLOCK_TIME_NONE:
+            return Gst.PadProbeReturn.OK
+        segment_event = pad.get_sticky_event(Gst.EventType.SEGMENT, 0)
+        if segment_event is None:
+            return Gst.PadProbeReturn.OK
+        running_time = segment_event.parse_segment().to_running_time(Gst.Format.TIME, buffer.pts)
+        age = clock.get_time() - self._clock_element.get_base_time() - running_time
+        if age > max_age:
+            counts['expired'] += 1
+            return Gst.PadProbeReturn.DROP
+        return Gst.PadProbeReturn.OK
+
+    def get_stats(self):
+        return {name: dict(counts) for name, counts in self.queues.items()}
+
+    def total_dropped(self):
+        return sum(counts['dropped'] + counts['expired'] for counts in self.queues.values())
+
+    def report(self):
+        lines = []
+        for name, counts in self.queues.items():
+            lost = counts['dropped'] + counts['expired']
+            if lost != self._reported[name] or counts['blocked']:
+                lines.append(
+                    f"  {name} ({counts['branch']}): dropped {counts['dropped']}, expired {counts['expired']}"
+                    + (f", blocked {counts['blocked']}" if counts['blocked'] else "")
+                )
+                self._reported[name] = lost
+        if lines:
+            print("Queue drops:\n" + "\n".join(lines))
+        return True
+
+def get_source_index(pad: Gst.Pad):
+    # Returns the source index encoded in the name of the pad's element (e.g. identity_callback_1),
+    # 0 for single-source pipelines
+    element = pad.get_parent_element()
+    name = element.get_name() if element is not None else ""
+    index = name.rsplit("_", 1)[-1]
+    return int(index) if index.isdigit() else 0
+
+def get_stream_id(buffer: Gst.Buffer):
+    # hailoroundrobin tags every buffer with the sink pad it came in on (e.g. sink_1), which tells
+    # the sources apart in the elements they share
+    return hailo.get_roi_from_buffer(buffer).get_stream_id()
 
 def get_source_type(input_source):
     # This function will return the source type based on the input source
@@ -104,6 +333,59 @@ def get_source_type(input_source):
         else:
             return 'file'
 
+# -----------------------------------------------------------------------------------------------
+# Per-source statistics for multi-source pipelines
+# -----------------------------------------------------------------------------------------------
+class SourceStats:
+    """
+    Counts frames entering the pipeline (src_<i>), frames reaching the callback
+    (identity_callback_<i>) and frames dropped by the per-source leaky queue
+    (queue_src_leak_<i>) for every source.
+    """
+    def __init__(self, pipeline, num_sources):
+        self.frames_in = [0] * num_sources
+        self.frames_out = [0] * num_sources
+        self.dropped = [0] * num_sources
+        self._last_in = [0] * num_sources
+        self._last_out = [0] * num_sources
+        self._last_time = time.monotonic()
+        for index in range(num_sources):
+            self._count(pipeline.get_by_name(f"src_{index}"), self.frames_in, index)
+            self._count(pipeline.get_by_name(f"identity_callback_{index}"), self.frames_out, index)
+            leak_queue = pipeline.get_by_name(f"queue_src_leak_{index}")
+            if leak_queue is not None:
+                # A leaky queue emits overrun for every buffer it has to drop
+                leak_queue.connect("overrun", self._on_overrun, index)
+
+    def _count(self, element, counters, index):
+        if element is None:
+            return
+        def probe(pad, info):
+            counters[index] += 1
+            return Gst.PadProbeReturn.OK
+        element.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, probe)
+
+    def _on_overrun(self, queue, index):
+        self.dropped[index] += 1
+
+    def get_stats(self):
+        return [
+            {'frames_in': frames_in, 'frames_out': frames_out, 'dropped': dropped}
+            for frames_in, frames_out, dropped in zip(self.frames_in, self.frames_out, self.dropped)
+        ]
+
+    def report(self):
+        now = time.monotonic()
+        elapsed = max(now - self._last_time, 1e-6)
+        for index, stats in enumerate(self.get_stats()):
+            fps_in = (stats['frames_in'] - self._last_in[index]) / elapsed
+            fps_out = (stats['frames_out'] - self._last_out[index]) / elapsed
+            print(f"Source {index}: in {fps_in:.1f} fps, out {fps_out:.1f} fps, dropped {stats['dropped']}")
+            self._last_in[index] = stats['frames_in']
+            self._last_out[index] = stats['frames_out']
+        self._last_time = now
+        return True
+
 # -----------------------------------------------------------------------------------------------
 # GStreamerApp class
 # -----------------------------------------------------------------------------------------------
@@ -117,15 +399,25 @@ class GStreamerApp:
         
         # Initialize variables
         tappas_postprocess_dir = os.environ.get('TAPPAS_POST_PROC_DIR', '')
-        if tappas_postprocess_dir == '':
+        # Backends running outside the pipeline do not use the TAPPAS post-processes
+        if tappas_postprocess_dir == '' and getattr(args, 'backend', 'hailo') == 'hailo':
             print("TAPPAS_POST_PROC_DIR environment variable is not set. Please set it to by sourcing setup_env.sh")
             exit(1)
         self.current_path = os.path.dirname(os.path.abspath(__file__))
         self.postprocess_dir = tappas_postprocess_dir
-        self.video_source = self.options_menu.input
-        self.source_type = get_source_type(self.video_source)
+        inputs = self.options_menu.input
+        self.video_sources = list(inputs) if isinstance(inputs, (list, tuple)) else [inputs]
+        self.source_types = [get_source_type(source) for source in self.video_sources]
+        # The first source is kept under the single-source names used by existing apps
+        self.video_source = self.video_sources[0]
+        self.source_type = self.source_types[0]
+        self.source_stats = None
+        self.instrumentation = None
+        self._callbacks_attached = False
         self.user_data = user_data
         self.video_sink = "xvimagesink"
+        # Runs in a separate process and consumes the frames passed with user_data.set_frame()
+        self.user_frame_consumer = display_user_data_frame
         
         # Set Hailo parameters; these parameters should be set based on the model used
         self.batch_size = 1
@@ -139,13 +431,35 @@ class GStreamerApp:
         # Set user data parameters
         user_data.use_frame = self.options_menu.use_frame
 
-        self.sync = "false" if (self.options_menu.disable_sync or self.source_type != "file") else "true"
+        live_source = any(source_type != "file" for source_type in self.source_types)
+        self.live_source = live_source
+        self.sync = "false" if (self.options_menu.disable_sync or live_source) else "true"
+        self.queue_drops = None
+        # Applied by self.queue() while the subclass builds its pipeline string
+        try:
+            self.queue_policies = parse_queue_policies(getattr(args, 'queue_policy', []), live=live_source)
+        except ValueError as e:
+            print(e)
+            exit(1)
         
         if self.options_menu.dump_dot:
             os.environ["GST_DEBUG_DUMP_DOT_DIR"] = self.current_path
     
+    @property
+    def num_sources(self):
+        return len(self.video_sources)
+
+    def queue(self, name, max_size_buffers=3, max_size_bytes=0, max_size_time=0):
+        # QUEUE() with the queue policies of this app
+        return QUEUE(name, max_size_buffers, max_size_bytes, max_size_time, policies=self.queue_policies)
+
+    def stream_suffix(self, index):
+        # Per-source element names get a _<index> suffix when there is more than one source
+        return f"_{index}" if self.num_sources > 1 else ""
+
     def on_fps_measurement(self, sink, fps, droprate, avgfps):
-        print(f"FPS: {fps:.2f}, Droprate: {droprate:.2f}, Avg FPS: {avgfps:.2f}")
+        name = f"{sink.get_name()} " if self.num_sources > 1 else ""
+        print(f"{name}FPS: {fps:.2f}, Droprate: {droprate:.2f}, Avg FPS: {avgfps:.2f}")
         return True
 
     def create_pipeline(self):
@@ -159,11 +473,17 @@ class GStreamerApp:
             print(e)
             print(pipeline_string)
             exit(1)
+        try:
+            check_paired_queues(self.pipeline, PAIRED_JOINERS + (getattr(self, 'muxer_element', 'hailomuxer'),))
+        except ValueError as e:
+            print(e)
+            exit(1)
         
         # Connect to hailo_display fps-measurements
         if self.options_menu.show_fps:
             print("Showing FPS")
-            self.pipeline.get_by_name("hailo_display").connect("fps-measurements", self.on_fps_measurement)
+            for index in range(self.num_sources):
+                self.pipeline.get_by_name(f"hailo_display{self.stream_suffix(index)}").connect("fps-measurements", self.on_fps_measurement)
 
         # Create a GLib Main Loop
         self.loop = GLib.MainLoop()
@@ -193,36 +513,62 @@ class GStreamerApp:
         Gst.debug_bin_to_dot_file(self.pipeline, Gst.DebugGraphDetails.ALL, "pipeline")
         return False
     
-    def run(self):
+    def attach_callbacks(self):
+        """
+        Connects the bus watch and the user callback probes. run() calls it; subclasses that
+        preroll or seek before run() call it first so no frame passes identity_callback unseen.
+        """
+        if self._callbacks_attached:
+            return
+        self._callbacks_attached = True
         # Add a watch for messages on the pipeline's bus
         bus = self.pipeline.get_bus()
         bus.add_signal_watch()
         bus.connect("message", self.bus_call, self.loop)
 
-        # Connect pad probe to the identity element
-        identity = self.pipeline.get_by_name("identity_callback")
-        if identity is None:
-            print("Warning: identity_callback element not found, add <identity name=identity_callback> in your pipeline where you want the callback to be called.")
-        else:
-            identity_pad = identity.get_static_pad("src")
-            identity_pad.add_probe(Gst.PadProbeType.BUFFER, self.app_callback, self.user_data)
-
-        # Get xvimagesink element and disable QoS
-        # xvimagesink is instantiated by fpsdisplaysink
-        hailo_display = self.pipeline.get_by_name("hailo_display")
-        if hailo_display is None:
-            print("Warning: hailo_display element not found, add <fpsdisplaysink name=hailo_display> to your pipeline to support fps display.")
-        else:
-            xvimagesink = hailo_display.get_by_name("xvimagesink0")
-            if xvimagesink is not None:
-                xvimagesink.set_property("qos", False)
+        for index in range(self.num_sources):
+            suffix = self.stream_suffix(index)
+            # Connect pad probe to the identity element
+            identity = self.pipeline.get_by_name(f"identity_callback{suffix}")
+            if identity is None:
+                print(f"Warning: identity_callback{suffix} element not found, add <identity name=identity_callback{suffix}> in your pipeline where you want the callback to be called.")
+            else:
+                identity_pad = identity.get_static_pad("src")
+                identity_pad.add_probe(Gst.PadProbeType.BUFFER, self.app_callback, self.user_data)
+
+            hailo_display = self.pipeline.get_by_name(f"hailo_display{suffix}")
+            if hailo_display is None:
+                print(f"Warning: hailo_display{suffix} element not found, add <fpsdisplaysink name=hailo_display{suffix}> to your pipeline to support fps display.")
+
+    def run(self):
+        self.attach_callbacks()
+
+        # Per-source frame and drop accounting when several sources share the pipeline
+        if self.num_sources > 1:
+            self.source_stats = SourceStats(self.pipeline, self.num_sources)
+            GLib.timeout_add_seconds(5, self.source_stats.report)
         
-        # Disable QoS to prevent frame drops
-        disable_qos(self.pipeline)
+        # QoS stays off on the inference path; a best-effort display may skip late frames
+        display_qos = self.queue_policies['display'].leaky
+        display_elements = set()
+        for index in range(self.num_sources):
+            display_elements |= get_downstream_elements(self.pipeline.get_by_name(f"queue_videoconvert{self.stream_suffix(index)}"))
+        set_qos(self.pipeline, lambda element: display_qos and element in display_elements)
+
+        # Account for every frame a queue drops
+        self.queue_drops = QueueDrops(self.pipeline, live=self.live_source)
+        if self.options_menu.queue_report_interval:
+            GLib.timeout_add_seconds(self.options_menu.queue_report_interval, self.queue_drops.report)
+
+        # Instrument after the callback probes are in place so the callback time is measured too
+        if self.options_menu.instrument:
+            source_key = get_stream_id if self.num_sources > 1 and hailo is not None else None
+            self.instrumentation = PipelineInstrumentation(self.pipeline, source_key=source_key)
+            self.instrumentation.start(summary_interval=self.options_menu.instrument_interval)
         
         # Start a subprocess to run the display_user_data_frame function
         if self.options_menu.use_frame:
-            display_process = multiprocessing.Process(target=display_user_data_frame, args=(self.user_data,))
+            display_process = multiprocessing.Process(target=self.user_frame_consumer, args=(self.user_data,))
             display_process.start()
 
         # Set pipeline to PLAYING state
@@ -244,84 +590,193 @@ class GStreamerApp:
         if self.options_menu.use_frame:
             display_process.terminate()
             display_process.join()
+            print(f"User frame stats: {self.user_data.get_frame_stats()}")
+        if self.instrumentation is not None:
+            self.instrumentation.print_summary()
+        if self.user_data.frame_ring is not None:
+            self.user_data.frame_ring.close()
 
 # ---------------------------------------------------------
 # Functions used to get numpy arrays from GStreamer buffers
 # ---------------------------------------------------------
 
-def handle_rgb(map_info, width, height):
-    # The copy() method is used to create a copy of the numpy array. This is necessary because the original numpy array is created from buffer data, and it does not own the data it represents. Instead, it's just a view of the buffer's data.
-    return np.ndarray(shape=(height, width, 3), dtype=np.uint8, buffer=map_info.data).copy()
+# Plane layouts are resolved in this order:
+# 1. GstVideoMeta attached to the buffer (set by libcamerasrc, v4l2src and most hardware elements)
+# 2. A GstVideo.VideoInfo parsed from the negotiated caps
+# 3. The default GStreamer layout (rows padded to 4 bytes, planes packed back to back)
+# Padded buffers (e.g. the 1536x864 rpi source) only work with 1 or 2.
+
+def _round_up_4(value):
+    return (value + 3) & ~3
+
+def _default_plane_layout(format, width, height):
+    if format == 'RGB':
+        return [0], [_round_up_4(width * 3)]
+    if format == 'NV12':
+        y_stride = _round_up_4(width)
+        return [0, y_stride * (height + (height & 1))], [y_stride, y_stride]
+    if format == 'YUYV':
+        return [0], [_round_up_4(width * 2)]
+    raise ValueError(f"Unsupported format: {format}")
+
+def get_plane_layout(buffer, format, width, height, video_info=None):
+    """
+    Returns the per-plane byte offsets and strides of a video buffer.
+
+    Args:
+        buffer (GstBuffer): The GStreamer Buffer holding the frame.
+        format (str): The video format ('RGB', 'NV12', 'YUYV').
+        width (int): The width of the video frame.
+        height (int): The height of the video frame.
+        video_info (GstVideo.VideoInfo, optional): Video info negotiated on the pad.
+
+    Returns:
+        tuple: (offsets, strides) lists with one entry per plane.
+    """
+    meta = GstVideo.buffer_get_video_meta(buffer)
+    if meta is not None:
+        return list(meta.offset[:meta.n_planes]), list(meta.stride[:meta.n_planes])
+    if video_info is not None:
+        n_planes = video_info.finfo.n_planes
+        return list(video_info.offset[:n_planes]), list(video_info.stride[:n_planes])
+    return _default_plane_layout(format, width, height)
+
+def view_rgb(data, width, height, offsets, strides):
+    return np.ndarray(shape=(height, width, 3), dtype=np.uint8, buffer=data,
+                      offset=offsets[0], strides=(strides[0], 3, 1))
 
-def handle_nv12(map_info, width, height):
-    y_plane_size = width * height
-    uv_plane_size = width * height // 2
-    y_plane = np.ndarray(shape=(height, width), dtype=np.uint8, buffer=map_info.data[:y_plane_size]).copy()
-    uv_plane = np.ndarray(shape=(height//2, width//2, 2), dtype=np.uint8, buffer=map_info.data[y_plane_size:]).copy()
+def view_nv12(data, width, height, offsets, strides):
+    y_plane = np.ndarray(shape=(height, width), dtype=np.uint8, buffer=data,
+                         offset=offsets[0], strides=(strides[0], 1))
+    uv_plane = np.ndarray(shape=(height // 2, width // 2, 2), dtype=np.uint8, buffer=data,
+                          offset=offsets[1], strides=(strides[1], 2, 1))
     return y_plane, uv_plane
 
-def handle_yuyv(map_info, width, height):
-    return np.ndarray(shape=(height, width, 2), dtype=np.uint8, buffer=map_info.data).copy()
+def view_yuyv(data, width, height, offsets, strides):
+    return np.ndarray(shape=(height, width, 2), dtype=np.uint8, buffer=data,
+                      offset=offsets[0], strides=(strides[0], 2, 1))
 
 FORMAT_HANDLERS = {
-    'RGB': handle_rgb,
-    'NV12': handle_nv12,
-    'YUYV': handle_yuyv,
+    'RGB': view_rgb,
+    'NV12': view_nv12,
+    'YUYV': view_yuyv,
 }
 
-def get_numpy_from_buffer(buffer, format, width, height):
+def _copy_planes(planes):
+    # np.copy always produces contiguous arrays, dropping any row padding
+    if isinstance(planes, tuple):
+        return tuple(np.copy(plane) for plane in planes)
+    return np.copy(planes)
+
+def get_video_info_from_pad(pad: Gst.Pad):
+    caps = pad.get_current_caps()
+    if caps is None:
+        return None
+    return GstVideo.VideoInfo.new_from_caps(caps)
+
+@contextmanager
+def get_numpy_view_from_buffer(buffer, format, width, height, video_info=None, copy=False):
     """
-    Converts a GstBuffer to a numpy array based on provided format, width, and height.
-    
+    Maps a GstBuffer and yields numpy views of its planes without copying the frame.
+
+    The views are read-only and point directly into the mapped buffer memory, so they are
+    only valid inside the with block (i.e. for the duration of the pad probe). Use copy=True,
+    or np.copy() on the yielded arrays, to take ownership of the data.
+
     Args:
-        buffer (GstBuffer): The GStreamer Buffer to convert.
-        format (str): The video format ('RGB', 'NV12', 'YUYV', etc.).
+        buffer (GstBuffer): The GStreamer Buffer to map.
+        format (str): The video format ('RGB', 'NV12', 'YUYV').
         width (int): The width of the video frame.
         height (int): The height of the video frame.
-        
-    Returns:
-        np.ndarray: A numpy array representing the buffer's data, or a tuple of arrays for certain formats.
+        video_info (GstVideo.VideoInfo, optional): Used for strides when the buffer has no GstVideoMeta.
+        copy (bool): Yield contiguous copies owned by the caller instead of views.
+
+    Yields:
+        np.ndarray: A view of the frame, or a tuple of views for multi-plane formats.
+
+    Example:
+        with get_numpy_view_from_buffer(buffer, format, width, height) as frame:
+            mean = frame.mean()
     """
+    handler = FORMAT_HANDLERS.get(format)
+    if handler is None:
+        raise ValueError(f"Unsupported format: {format}")
+    offsets, strides = get_plane_layout(buffer, format, width, height, video_info)
+
     # Map the buffer to access data
     success, map_info = buffer.map(Gst.MapFlags.READ)
     if not success:
         raise ValueError("Buffer mapping failed")
-    
+
     try:
-        # Handle different formats based on the provided format parameter
-        handler = FORMAT_HANDLERS.get(format)
-        if handler is None:
-            raise ValueError(f"Unsupported format: {format}")
-        return handler(map_info, width, height)
+        planes = handler(map_info.data, width, height, offsets, strides)
+        if copy:
+            planes = _copy_planes(planes)
+        else:
+            for plane in (planes if isinstance(planes, tuple) else (planes,)):
+                plane.flags.writeable = False
+        yield planes
     finally:
+        planes = None
         buffer.unmap(map_info)
 
+def get_numpy_from_buffer(buffer, format, width, height, video_info=None):
+    """
+    Converts a GstBuffer to a numpy array based on provided format, width, and height.
+
+    The returned arrays own their data and can outlive the buffer. Prefer
+    get_numpy_view_from_buffer when the frame is only needed inside the probe.
+
+    Args:
+        buffer (GstBuffer): The GStreamer Buffer to convert.
+        format (str): The video format ('RGB', 'NV12', 'YUYV', etc.).
+        width (int): The width of the video frame.
+        height (int): The height of the video frame.
+        video_info (GstVideo.VideoInfo, optional): Used for strides when the buffer has no GstVideoMeta.
+
+    Returns:
+        np.ndarray: A numpy array representing the buffer's data, or a tuple of arrays for certain formats.
+    """
+    with get_numpy_view_from_buffer(buffer, format, width, height, video_info, copy=True) as planes:
+        return planes
+
 # ---------------------------------------------------------
 # Useful functions for working with GStreamer
 # ---------------------------------------------------------
         
-def disable_qos(pipeline):
+def get_downstream_elements(element):
     """
-    Iterate through all elements in the given GStreamer pipeline and set the qos property to False
-    where applicable.
-    When the 'qos' property is set to True, the element will measure the time it takes to process each buffer and will drop frames if latency is too high.
-    We are running on long pipelines, so we want to disable this feature to avoid dropping frames.
-    :param pipeline: A GStreamer pipeline object
+    Returns the element and everything downstream of it, including the children of sink bins.
     """
-    # Ensure the pipeline is a Gst.Pipeline instance
-    if not isinstance(pipeline, Gst.Pipeline):
-        print("The provided object is not a GStreamer Pipeline")
-        return
+    elements = set()
+    pending = [element] if element is not None else []
+    while pending:
+        element = pending.pop()
+        if element in elements:
+            continue
+        elements.add(element)
+        if isinstance(element, Gst.Bin):
+            it = element.iterate_recurse()
+            while True:
+                result, child = it.next()
+                if result != Gst.IteratorResult.OK:
+                    break
+                elements.add(child)
+        for pad in element.srcpads:
+            peer = pad.get_peer()
+            if peer is not None and peer.get_parent_element() is not None:
+                pending.append(peer.get_parent_element())
+    return elements
 
-    # Iterate through all elements in the pipeline
-    it = pipeline.iterate_elements()
+def set_qos(pipeline, enable):
+    """
+    Sets the qos property of every element in the pipeline, including those inside bins such as
+    fpsdisplaysink, to enable(element).
+    """
+    it = pipeline.iterate_recurse()
     while True:
         result, element = it.next()
         if result != Gst.IteratorResult.OK:
             break
-
-        # Check if the element has the 'qos' property
-        if 'qos' in GObject.list_properties(element):
-            # Set the 'qos' property to False
-            element.set_property('qos', False)
-            print(f"Set qos to False for {element.get_name()}")
+        if 'qos' in [prop.name for prop in GObject.list_properties(element)]:
+            element.set_property('qos', bool(enable(element)))
@@ -0,0 +1,376 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from functools import partial
+import cv2
+import numpy as np
+from detection_batch import DetectionBatch, LabelTable
+from inference_backend import InferenceBackend, coco_label_table
+from yolov8_postprocess import YoloV8PostProcess
+
+try:
+    from hailo_platform import HEF, VDevice, HailoSchedulingAlgorithm, FormatType
+except ImportError:
+    VDevice = None
+
+# -----------------------------------------------------------------------------------------------
+# Direct HailoRT detector
+# -----------------------------------------------------------------------------------------------
+# Fallback path for machines without TAPPAS, talking to the NPU through the HailoRT async API.
+# Replaces the loop in archive/hailo_object_detector.py, which allocated three arrays per frame
+# and serialized capture, a blocking write/read and display on one thread.
+# - All memory is allocated once, in BatchSlots: the captured frames, the network input batch
+#   and the output tensors. Frames are read and resized straight into them.
+# - A capture thread fills one slot at a time and submits it with run_async as soon as it holds
+#   batch_size frames. With `in_flight` slots (at least two) the next batch is being captured
+#   and written while the NPU works on the previous one.
+# - HailoRT completion callbacks only mark the slot as done; decoding happens on the consumer
+#   side, which waits for the slots in submission order, yields (pts, tag, DetectionBatch) and
+#   then returns the slot to the free pool.
+# Frames can also be pushed with submit() instead of the capture thread, which makes the
+# detector the "hailort" InferenceBackend.
+# HEFs with on-chip NMS deliver per-class detection lists. HEFs with raw outputs are decoded on
+# the host with YoloV8PostProcess.
+
+PAGE_SIZE = 4096
+
+
+def aligned_empty(shape, dtype=np.uint8, alignment=PAGE_SIZE):
+    """
+    Allocates a page-aligned array, so the driver can map it for DMA without a bounce copy.
+    """
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape)) * dtype.itemsize
+    raw = np.empty(size + alignment, dtype=np.uint8)
+    offset = -raw.ctypes.data % alignment
+    return raw[offset:offset + size].view(dtype).reshape(shape)
+
+
+def aligned_batch(batch_size, shape, dtype=np.uint8, alignment=PAGE_SIZE):
+    """
+    Allocates a (batch_size,) + shape array whose every image starts on a page boundary, so each
+    one can be bound on its own. Images are padded to whole pages, the batch axis is not
+    contiguous unless the image size is a multiple of the alignment.
+    """
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape)) * dtype.itemsize
+    stride = -(-size // alignment) * alignment
+    raw = aligned_empty((batch_size, stride), alignment=alignment)
+    return raw[:, :size].view(dtype).reshape((batch_size,) + tuple(shape))
+
+
+def load_labels(path):
+    """
+    Reads the "labels" list of a TAPPAS style labels JSON into a LabelTable, COCO by default.
+    """
+    if path is None:
+        return coco_label_table()
+    with open(path, 'r') as f:
+        labels = json.load(f)['labels']
+    # hailortpp numbers classes from 1 and keeps "unlabeled" at index 0
+    if labels and labels[0] == "unlabeled":
+        labels = labels[1:]
+    return LabelTable(dict(enumerate(labels)))
+
+
+class BatchSlot:
+    """
+    Preallocated buffers and bindings for one batch in flight.
+    """
+    def __init__(self, index, configured_model, batch_size, frame_shape, input_shape, output_specs):
+        self.index = index
+        # Capture buffers, only needed when the detector reads the source itself
+        self.frames = [aligned_empty(frame_shape) for _ in range(batch_size)] if frame_shape else []
+        # Every image is bound separately, so each one starts on its own page
+        self.inputs = aligned_batch(batch_size, input_shape)
+        self.outputs = {name: aligned_batch(batch_size, shape, dtype) for name, shape, dtype in output_specs}
+        self.bindings = []
+        for i in range(batch_size):
+            bindings = configured_model.create_bindings(
+                output_buffers={name: buffer[i] for name, buffer in self.outputs.items()}
+            )
+            bindings.input().set_buffer(self.inputs[i])
+            self.bindings.append(bindings)
+        self.done = threading.Event()
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.pts = []
+        self.tags = []
+        self.error = None
+        self.done.clear()
+
+
+class AsyncHailoDetector(InferenceBackend):
+    """
+    Double-buffered asynchronous inference on a Hailo device through HailoRT.
+
+    Args:
+        hef_path (str): Compiled network.
+        batch_size (int): Frames per run_async call.
+        in_flight (int): Number of batch slots. Two or more keep the NPU busy while the next
+            batch is captured and the previous one is decoded.
+        labels (LabelTable, optional): Labels for the returned detections, COCO by default.
+        score_threshold (float): Minimum confidence of returned detections.
+        post_process (YoloV8PostProcess, optional): Host decoder for HEFs without on-chip NMS.
+            Created from the default config when needed.
+        timeout_ms (int): HailoRT wait timeout.
+    """
+    def __init__(self, hef_path, batch_size=2, in_flight=2, labels=None, score_threshold=0.3,
+                 post_process=None, timeout_ms=10000):
+        if VDevice is None:
+            raise ImportError("hailo_platform (HailoRT python bindings) is required for the direct HailoRT detector")
+        self.hef_path = hef_path
+        self.batch_size = batch_size
+        self.in_flight = max(in_flight, 2)
+        self.label_table = labels or coco_label_table()
+        self.score_threshold = score_threshold
+        self.post_process = post_process
+        self.timeout_ms = timeout_ms
+        self.running = False
+        self.capture_thread = None
+        self.stats = {'captured': 0, 'dropped': 0, 'batches': 0, 'inferred': 0, 'errors': 0}
+
+        params = VDevice.create_params()
+        params.scheduling_algorithm = HailoSchedulingAlgorithm.ROUND_ROBIN
+        self.vdevice = VDevice(params)
+        self.infer_model = self.vdevice.create_infer_model(hef_path)
+        self.infer_model.set_batch_size(batch_size)
+        self.infer_model.input().set_format_type(FormatType.UINT8)
+        for output in self.infer_model.outputs:
+            output.set_format_type(FormatType.FLOAT32)
+        self.configured_model = self.infer_model.configure()
+        self.input_shape = tuple(self.infer_model.input().shape)
+        self.input_size = self.input_shape[:2]
+        # On-chip NMS outputs carry an NMS format order in the HEF, raw decoder tensors do not
+        self.has_nms = any(
+            info.format.order.name.startswith("HAILO_NMS") for info in HEF(hef_path).get_output_vstream_infos()
+        )
+        if not self.has_nms and self.post_process is None:
+            self.post_process = YoloV8PostProcess(score_threshold=score_threshold, labels=self.label_table.labels)
+        print(f"Loaded {hef_path}: input {self.input_shape}, outputs {self.infer_model.output_names}, "
+              f"batch {batch_size}, {self.in_flight} batches in flight")
+
+        self.free_slots = queue.Queue()
+        # Slots in submission order, then None once finish() was called
+        self.submitted = queue.Queue()
+        self.slots = []
+        # The slot currently being filled
+        self._filling = None
+
+    def _allocate(self, frame_shape=None):
+        output_specs = [(output.name, output.shape, np.float32) for output in self.infer_model.outputs]
+        for index in range(self.in_flight):
+            slot = BatchSlot(index, self.configured_model, self.batch_size,
+                             frame_shape, self.input_shape, output_specs)
+            self.slots.append(slot)
+            self.free_slots.put(slot)
+
+    def start(self, source, width=None, height=None, drop_when_busy=None):
+        """
+        Opens the source and starts the capture thread.
+
+        Args:
+            source (str or int): Video device, file or anything cv2.VideoCapture accepts.
+            width (int, optional): Requested capture width.
+            height (int, optional): Requested capture height.
+            drop_when_busy (bool, optional): Drop frames instead of waiting when every slot is in
+                flight. Defaults to True for /dev/video* devices, False for files.
+        """
+        capture = cv2.VideoCapture(source)
+        if width and height:
+            capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+            capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        if not capture.isOpened():
+            raise RuntimeError(f"Cannot open video source {source}")
+        ok, frame = capture.read()
+        if not ok:
+            raise RuntimeError(f"Cannot read from video source {source}")
+        if drop_when_busy is None:
+            drop_when_busy = str(source).startswith("/dev/video")
+        self._allocate(frame.shape)
+        self.running = True
+        self.capture_thread = threading.Thread(
+            target=self._capture_loop, args=(capture, frame, drop_when_busy), daemon=True
+        )
+        self.capture_thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.capture_thread is not None:
+            self.capture_thread.join()
+
+    def close(self):
+        self.stop()
+        self.configured_model.shutdown()
+        self.vdevice.release()
+
+    def _next_slot(self, capture, drop_when_busy):
+        # Returns a free slot, None when stopped or the source ended
+        while self.running:
+            try:
+                return self.free_slots.get(timeout=0.1)
+            except queue.Empty:
+                if drop_when_busy:
+                    # Every slot is in flight: keep the camera drained so latency stays low
+                    if not capture.grab():
+                        return None
+                    self.stats['dropped'] += 1
+        return None
+
+    def _capture_loop(self, capture, frame, drop_when_busy):
+        while self.running:
+            slot = self._filling or self._next_slot(capture, drop_when_busy)
+            if slot is None:
+                break
+            self._filling = slot
+            target = slot.frames[slot.count]
+            if frame is not None:
+                # The frame read in start() to size the buffers
+                np.copyto(target, frame)
+                frame = None
+            elif not capture.read(target)[0]:
+                break
+            self.stats['captured'] += 1
+            self._fill(slot, target, capture.get(cv2.CAP_PROP_POS_MSEC), target, bgr=True)
+        capture.release()
+        self.finish()
+
+    def _fill(self, slot, frame, pts, tag, bgr=False):
+        # Resize and convert in place into the slot's input batch
+        height, width = self.input_size
+        network_input = slot.inputs[slot.count]
+        cv2.resize(frame, (width, height), dst=network_input, interpolation=cv2.INTER_LINEAR)
+        if bgr:
+            cv2.cvtColor(network_input, cv2.COLOR_BGR2RGB, dst=network_input)
+        slot.pts.append(pts)
+        slot.tags.append(tag)
+        slot.count += 1
+        self._filling = slot
+        if slot.count == self.batch_size:
+            self._submit(slot)
+            self._filling = None
+
+    def submit(self, frame, pts, tag=None):
+        if not self.slots:
+            self._allocate()
+        slot = self._filling or self.free_slots.get()
+        self._fill(slot, frame, pts, tag)
+        return True
+
+    def finish(self):
+        slot, self._filling = self._filling, None
+        if slot is not None:
+            if slot.count:
+                self._submit(slot)
+            else:
+                self.free_slots.put(slot)
+        self.submitted.put(None)
+
+    def _submit(self, slot):
+        self.configured_model.wait_for_async_ready(timeout_ms=self.timeout_ms)
+        self.configured_model.run_async(slot.bindings[:slot.count], partial(self._on_done, slot))
+        self.submitted.put(slot)
+        self.stats['batches'] += 1
+
+    def _on_done(self, slot, completion_info):
+        # Runs on a HailoRT thread: mark the slot and return immediately
+        if completion_info.exception:
+            slot.error = completion_info.exception
+        slot.done.set()
+
+    def _decode(self, slot):
+        if not self.has_nms:
+            outputs = {name: buffer[:slot.count] for name, buffer in slot.outputs.items()}
+            return self.post_process(outputs, pts=slot.pts)
+        batches = []
+        for i in range(slot.count):
+            per_class = slot.bindings[i].output().get_buffer()
+            class_ids, confidences, boxes = [], [], []
+            for class_id, detections in enumerate(per_class):
+                detections = np.asarray(detections, dtype=np.float32).reshape(-1, 5)
+                detections = detections[detections[:, 4] >= self.score_threshold]
+                if len(detections):
+                    # NMS rows are ymin, xmin, ymax, xmax, score
+                    boxes.append(detections[:, [1, 0, 3, 2]])
+                    confidences.append(detections[:, 4])
+                    class_ids.append(np.full(len(detections), class_id, dtype=np.int32))
+            if boxes:
+                batches.append(DetectionBatch(slot.pts[i], np.concatenate(class_ids), np.concatenate(confidences),
+                                              np.concatenate(boxes), self.label_table))
+            else:
+                batches.append(DetectionBatch.empty(slot.pts[i], self.label_table))
+        return batches
+
+    def results(self):
+        """
+        Yields (pts, tag, DetectionBatch) in submission order until finish() or the end of the
+        source. With the capture thread, the tag is the captured frame, a preallocated buffer
+        that stays valid until the next item is requested.
+        """
+        while True:
+            slot = self.submitted.get()
+            if slot is None:
+                return
+            slot.done.wait()
+            try:
+                if slot.error is not None:
+                    self.stats['errors'] += 1
+                    print(f"Inference failed: {slot.error}")
+                    for pts, tag in zip(slot.pts, slot.tags):
+                        yield pts, tag, DetectionBatch.empty(pts, self.label_table)
+                    continue
+                for pts, tag, detections in zip(slot.pts, slot.tags, self._decode(slot)):
+                    yield pts, tag, detections
+                self.stats['inferred'] += slot.count
+            finally:
+                slot.reset()
+                self.free_slots.put(slot)
+
+
+def draw_detections(frame, detections):
+    height, width = frame.shape[:2]
+    scale = np.array([width, height, width, height], dtype=np.float32)
+    for box, label, confidence in zip(detections.boxes * scale, detections.labels(), detections.confidences):
+        x0, y0, x1, y1 = box.astype(int)
+        cv2.rectangle(frame, (x0, y0), (x1, y1), (0, 255, 0), 2)
+        cv2.putText(frame, f"{label} {confidence:.2f}", (x0, max(y0 - 4, 12)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Direct HailoRT detection without TAPPAS")
+    parser.add_argument("--input", default="/dev/video0", help="Video device or file")
+    parser.add_argument("--hef-path", required=True, help="Path to HEF file")
+    parser.add_argument("--labels-json", default=None, help="Path to labels JSON file")
+    parser.add_argument("--width", type=int, default=None)
+    parser.add_argument("--height", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=2)
+    parser.add_argument("--in-flight", type=int, default=2, help="Batches submitted to the NPU at once")
+    parser.add_argument("--score-threshold", type=float, default=0.3)
+    parser.add_argument("--headless", action="store_true", help="Do not display frames")
+    args = parser.parse_args()
+
+    detector = AsyncHailoDetector(args.hef_path, args.batch_size, args.in_flight,
+                                  load_labels(args.labels_json), args.score_threshold)
+    detector.start(args.input, args.width, args.height)
+    start = time.monotonic()
+    try:
+        for pts, frame, detections in detector.results():
+            if args.headless:
+                continue
+            draw_detections(frame, detections)
+            cv2.imshow("Live Feed", frame)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        elapsed = time.monotonic() - start
+        detector.close()
+        cv2.destroyAllWindows()
+        stats = detector.stats
+        print(f"{stats['inferred']} frames in {elapsed:.1f} s ({stats['inferred'] / max(elapsed, 1e-6):.1f} fps), "
+              f"{stats['batches']} batches, {stats['dropped']} dropped, {stats['errors']} errors")
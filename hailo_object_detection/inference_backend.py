@@ -0,0 +1,377 @@
+import argparse
+import dataclasses
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import cv2
+import numpy as np
+from detection_batch import DetectionBatch, LabelTable
+from yolov8_postprocess import batched_nms
+
+# -----------------------------------------------------------------------------------------------
+# Inference backends
+# -----------------------------------------------------------------------------------------------
+# A backend takes frames in order and hands back one DetectionBatch per frame, in the same order:
+# - "hailo"   hailonet/hailofilter inside the GStreamer pipeline (TAPPAS, the default)
+# - "hailort" AsyncHailoDetector, HailoRT without TAPPAS (hailort_detector.py)
+# - "cpu"     CpuBackend, a YOLOv8 ONNX model on a process pool with ONNX Runtime or OpenCV DNN
+# The last two run outside GStreamer. BackendBridge takes the frames out of the pipeline at an
+# appsink, runs them through the backend and pushes them back into an appsrc in order, keeping
+# the detections for app_callback.
+
+COCO_LABELS = (
+    "person", "bicycle", "car", "motorcycle", "airplane", "bus", "train", "truck", "boat",
+    "traffic light", "fire hydrant", "stop sign", "parking meter", "bench", "bird", "cat", "dog",
+    "horse", "sheep", "cow", "elephant", "bear", "zebra", "giraffe", "backpack", "umbrella",
+    "handbag", "tie", "suitcase", "frisbee", "skis", "snowboard", "sports ball", "kite",
+    "baseball bat", "baseball glove", "skateboard", "surfboard", "tennis racket", "bottle",
+    "wine glass", "cup", "fork", "knife", "spoon", "bowl", "banana", "apple", "sandwich", "orange",
+    "broccoli", "carrot", "hot dog", "pizza", "donut", "cake", "chair", "couch", "potted plant",
+    "bed", "dining table", "toilet", "tv", "laptop", "mouse", "remote", "keyboard", "cell phone",
+    "microwave", "oven", "toaster", "sink", "refrigerator", "book", "clock", "vase", "scissors",
+    "teddy bear", "hair drier", "toothbrush",
+)
+
+
+def coco_label_table():
+    return LabelTable(dict(enumerate(COCO_LABELS)))
+
+
+class InferenceBackend:
+    """
+    Interface of the out-of-pipeline inference backends.
+
+    submit() is called from one producer thread and results() is consumed by one other thread.
+    Every submitted frame produces exactly one result, in submission order.
+    """
+    # Network input as (height, width); frames are resized to it by the backend
+    input_size = (640, 640)
+
+    def submit(self, frame, pts, tag=None):
+        """
+        Queues an RGB frame for inference. The frame is only read during the call, so it may
+        be a view of a mapped buffer. tag is returned untouched with the result.
+
+        Returns:
+            bool: False when the frame is not inferred (skipped) but still produces a result.
+        """
+        raise NotImplementedError
+
+    def finish(self):
+        """
+        Signals that no more frames follow; results() ends after the last one.
+        """
+        raise NotImplementedError
+
+    def results(self):
+        """
+        Yields (pts, tag, DetectionBatch) in submission order.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def run(self, on_result):
+        """
+        Calls on_result(pts, tag, detections) for every result on the calling thread.
+        """
+        for pts, tag, detections in self.results():
+            on_result(pts, tag, detections)
+
+
+# -----------------------------------------------------------------------------------------------
+# CPU backend
+# -----------------------------------------------------------------------------------------------
+# Each pool worker loads its own copy of the model once, in the pool initializer. Workers are
+# limited to one intra-op thread so the pool, not the runtime, spreads the load over the cores.
+# The pool is created after the pipeline, so its workers are spawned rather than forked: a fork
+# would inherit the GStreamer/GLib threads and locks without the threads that own them.
+
+_worker = {}
+
+
+def _init_worker(model_path, engine, score_threshold, iou_threshold, max_detections):
+    _worker.update(engine=engine, score_threshold=score_threshold, iou_threshold=iou_threshold,
+                   max_detections=max_detections)
+    if engine == "onnxruntime":
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = 1
+        options.inter_op_num_threads = 1
+        session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        _worker.update(session=session, input_name=session.get_inputs()[0].name)
+    else:
+        cv2.setNumThreads(1)
+        _worker['net'] = cv2.dnn.readNetFromONNX(model_path)
+
+
+def _infer(frame):
+    # frame: (H, W, 3) uint8 RGB at the network input size
+    blob = (frame.transpose(2, 0, 1)[None] * np.float32(1 / 255)).astype(np.float32)
+    if _worker['engine'] == "onnxruntime":
+        output = _worker['session'].run(None, {_worker['input_name']: blob})[0]
+    else:
+        _worker['net'].setInput(blob)
+        output = _worker['net'].forward()
+    return decode_yolov8_onnx(output[0], frame.shape[1], frame.shape[0], _worker['score_threshold'],
+                              _worker['iou_threshold'], _worker['max_detections'])
+
+
+def decode_yolov8_onnx(output, width, height, score_threshold, iou_threshold, max_detections):
+    """
+    Decodes the (4 + classes, anchors) output of an exported YOLOv8 ONNX model, whose box rows
+    are centre x, centre y, width and height in input pixels and whose scores are already
+    activated.
+
+    Returns:
+        tuple: class_ids, confidences and normalized xyxy boxes.
+    """
+    scores = output[4:]
+    classes, anchors = np.nonzero(scores > score_threshold)
+    confidences = scores[classes, anchors]
+    cx, cy, w, h = output[:4, anchors]
+    boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+    keep = batched_nms(boxes, confidences, classes, iou_threshold, max_detections)
+    scale = np.array([width, height, width, height], dtype=np.float32)
+    return (classes[keep].astype(np.int32), confidences[keep].astype(np.float32),
+            np.clip(boxes[keep] / scale, 0.0, 1.0).astype(np.float32))
+
+
+class CpuBackend(InferenceBackend):
+    """
+    YOLOv8 ONNX inference on a process pool with ordered result reassembly.
+
+    Args:
+        model_path (str): Exported YOLOv8 ONNX model with a 640x640 input.
+        engine (str): "onnxruntime" or "opencv".
+        workers (int, optional): Pool size, defaults to one less than the number of cores.
+        frame_skip (int): Infer only every (frame_skip + 1)th frame.
+        max_in_flight (int, optional): Frames queued or running in the pool, defaults to twice
+            the number of workers.
+        drop_when_busy (bool): When the pool is full, skip the frame instead of waiting.
+        score_threshold (float): Minimum confidence of returned detections.
+        iou_threshold (float): NMS overlap threshold.
+        max_detections (int): Most detections kept per class.
+        labels (LabelTable, optional): Defaults to the COCO labels.
+
+    Skipped frames, whether by frame_skip or because the pool was busy, still produce a result:
+    the detections of the last inferred frame, restamped with their own pts.
+    """
+    def __init__(self, model_path, engine="onnxruntime", workers=None, frame_skip=0, max_in_flight=None,
+                 drop_when_busy=False, score_threshold=0.3, iou_threshold=0.45, max_detections=100, labels=None):
+        self.engine = engine
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.frame_skip = frame_skip
+        self.drop_when_busy = drop_when_busy
+        self.label_table = labels or coco_label_table()
+        self.stats = {'submitted': 0, 'inferred': 0, 'skipped': 0, 'busy': 0, 'errors': 0}
+        self._slots = threading.Semaphore(max_in_flight or 2 * self.workers)
+        self._pending = queue.Queue()
+        self._pool = multiprocessing.get_context("spawn").Pool(
+            self.workers, initializer=_init_worker,
+            initargs=(model_path, engine, score_threshold, iou_threshold, max_detections),
+        )
+
+    def _release(self, _):
+        self._slots.release()
+
+    def submit(self, frame, pts, tag=None):
+        index = self.stats['submitted']
+        self.stats['submitted'] += 1
+        if index % (self.frame_skip + 1):
+            self.stats['skipped'] += 1
+            self._pending.put((pts, tag, None))
+            return False
+        if not self._slots.acquire(blocking=not self.drop_when_busy):
+            self.stats['busy'] += 1
+            self._pending.put((pts, tag, None))
+            return False
+        height, width = self.input_size
+        if frame.shape[:2] == (height, width):
+            frame = np.array(frame)
+        else:
+            frame = cv2.resize(frame, (width, height))
+        result = self._pool.apply_async(_infer, (frame,), callback=self._release, error_callback=self._release)
+        self._pending.put((pts, tag, result))
+        return True
+
+    def finish(self):
+        self._pending.put(None)
+
+    def results(self):
+        last = None
+        while True:
+            entry = self._pending.get()
+            if entry is None:
+                return
+            pts, tag, result = entry
+            if result is not None:
+                try:
+                    class_ids, confidences, boxes = result.get()
+                except Exception as e:
+                    # Keep the order intact, the frame still gets a (stale) result
+                    print(f"CPU inference failed: {e}")
+                    self.stats['errors'] += 1
+                else:
+                    last = DetectionBatch(pts, class_ids, confidences, boxes, self.label_table)
+                    self.stats['inferred'] += 1
+                    yield pts, tag, last
+                    continue
+            if last is not None:
+                yield pts, tag, dataclasses.replace(last, pts=pts)
+            else:
+                yield pts, tag, DetectionBatch.empty(pts, self.label_table)
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
+
+
+def create_backend(args, hef_path=None):
+    """
+    Creates the out-of-pipeline backend selected with --backend, None for "hailo".
+    hef_path overrides --hef-path for the hailort backend.
+    """
+    if args.backend == "cpu":
+        if args.cpu_model is None:
+            raise ValueError("--cpu-model is required with --backend cpu")
+        return CpuBackend(args.cpu_model, engine=args.cpu_engine, workers=args.cpu_workers,
+                          frame_skip=args.frame_skip, drop_when_busy=args.drop_when_busy)
+    if args.backend == "hailort":
+        from hailort_detector import AsyncHailoDetector, load_labels
+        return AsyncHailoDetector(hef_path or args.hef_path, batch_size=2, labels=load_labels(args.labels_json))
+    return None
+
+
+# -----------------------------------------------------------------------------------------------
+# GStreamer bridge
+# -----------------------------------------------------------------------------------------------
+
+def BACKEND_BRIDGE(sink_name="backend_sink", src_name="backend_src"):
+    """
+    Pipeline fragment: frames leave at the appsink and the chain continues from the appsrc.
+    """
+    return (
+        f"appsink name={sink_name} emit-signals=false sync=false max-buffers=2 drop=false "
+        f"appsrc name={src_name} format=time is-live=true ! "
+    )
+
+
+class BackendBridge:
+    """
+    Runs the frames between an appsink and an appsrc through an InferenceBackend.
+
+    One thread pulls samples and submits them, a second one consumes the ordered results, keeps
+    the detections by pts for pop_detections() and pushes the original buffer to the appsrc.
+    """
+    def __init__(self, backend, appsink, appsrc):
+        self.backend = backend
+        self.appsink = appsink
+        self.appsrc = appsrc
+        self.detections = {}
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._pull_loop, daemon=True),
+            threading.Thread(target=self._push_loop, daemon=True),
+        ]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def _pull_loop(self):
+        from hailo_rpi_common import get_caps_from_pad, get_numpy_view_from_buffer
+        caps_set = False
+        while True:
+            sample = self.appsink.emit("pull-sample")
+            if sample is None:
+                # EOS or the pipeline is shutting down
+                break
+            buffer = sample.get_buffer()
+            if not caps_set:
+                self.appsrc.set_property("caps", sample.get_caps())
+                caps_set = True
+            format, width, height = get_caps_from_pad(self.appsink.get_static_pad("sink"))
+            with get_numpy_view_from_buffer(buffer, format, width, height) as frame:
+                self.backend.submit(frame, buffer.pts, tag=buffer)
+        self.backend.finish()
+
+    def _push_loop(self):
+        for pts, buffer, detections in self.backend.results():
+            with self._lock:
+                self.detections[pts] = detections
+                # Forget detections whose buffer never reached the callback
+                if len(self.detections) > 256:
+                    del self.detections[next(iter(self.detections))]
+            self.appsrc.emit("push-buffer", buffer)
+        self.appsrc.emit("end-of-stream")
+
+    def pop_detections(self, pts):
+        with self._lock:
+            detections = self.detections.pop(pts, None)
+        if detections is None:
+            return DetectionBatch.empty(pts, getattr(self.backend, 'label_table', None))
+        return detections
+
+    def close(self):
+        self.backend.close()
+
+
+def add_backend_arguments(parser):
+    parser.add_argument(
+        "--backend", default="hailo", choices=["hailo", "hailort", "cpu"],
+        help="Inference backend: hailonet in the pipeline, HailoRT without TAPPAS, or CPU"
+    )
+    parser.add_argument("--cpu-model", default=None, help="YOLOv8 ONNX model for the CPU backend")
+    parser.add_argument("--cpu-engine", default="onnxruntime", choices=["onnxruntime", "opencv"])
+    parser.add_argument("--cpu-workers", type=int, default=None, help="CPU backend worker processes")
+    parser.add_argument("--frame-skip", type=int, default=0, help="CPU backend infers every (N+1)th frame")
+    parser.add_argument(
+        "--drop-when-busy", action="store_true",
+        help="CPU backend skips frames instead of waiting when every worker is busy"
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput of an inference backend on synthetic frames")
+    add_backend_arguments(parser)
+    parser.add_argument("--hef-path", default=None, help="HEF for the hailort backend")
+    parser.add_argument("--labels-json", default=None)
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    args = parser.parse_args()
+    if args.backend == "hailo":
+        parser.error("the hailo backend runs inside the GStreamer pipeline, see benchmark_pipeline.py")
+
+    backend = create_backend(args)
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 255, (args.height, args.width, 3), dtype=np.uint8) for _ in range(8)]
+    submit_times = {}
+    latencies = []
+
+    def produce():
+        for index in range(args.frames):
+            submit_times[index] = time.perf_counter()
+            backend.submit(frames[index % len(frames)], index)
+        backend.finish()
+
+    start = time.perf_counter()
+    producer = threading.Thread(target=produce)
+    producer.start()
+    count = 0
+    for pts, tag, detections in backend.results():
+        latencies.append(time.perf_counter() - submit_times.pop(pts))
+        count += 1
+    elapsed = time.perf_counter() - start
+    producer.join()
+    backend.close()
+    latencies = np.array(latencies) * 1e3
+    print(f"{args.backend}: {count} frames in {elapsed:.2f} s, {count / elapsed:.1f} frames/s, "
+          f"latency p50 {np.percentile(latencies, 50):.1f} ms p95 {np.percentile(latencies, 95):.1f} ms")
+    if hasattr(backend, 'stats'):
+        print(f"Stats: {backend.stats}")
@@ -0,0 +1,309 @@
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+import argparse
+import json
+import threading
+import time
+from dataclasses import dataclass
+from hailo_rpi_common import set_qos
+
+# -----------------------------------------------------------------------------------------------
+# Runtime swap of the inference sub-bin
+# -----------------------------------------------------------------------------------------------
+# A new HEF, thresholds, batch size or labels file used to mean restarting the pipeline, which
+# drops the camera and the display for seconds. InferenceSwapper replaces the elements between
+# queue_hailonet and hailofilter while the rest of the pipeline keeps running:
+# 1. the replacement is parsed into a bin and brought to PLAYING next to the running chain, so
+#    the HEF is loaded before the flow is touched
+# 2. the pad feeding the old chain is blocked; frames back up in (or are dropped by) the source
+#    queues, and because the tee in front of hailomuxer pushes to both branches from one thread
+#    the bypass branch stops with it
+# 3. EOS is pushed into the old chain and dropped at its end, so the frames already in flight
+#    are still inferred and reach the muxer; the two muxer branches stay paired
+# 4. the old chain is unlinked and removed, the new bin is linked in its place and the pad is
+#    unblocked
+# If the new elements fail to start or link once the old chain is gone, the two pads are linked
+# directly and unblocked: frames reach the muxer without detections until a later swap succeeds.
+# The output gap is measured on the pad after the chain, from the last frame of the old chain
+# to the first frame of the new one.
+#
+# While the replacement is preloaded both networks are configured on the device, which relies on
+# the HailoRT scheduler sharing it. Without it, swap(preload=False) loads the new network after
+# the old one is released, at the cost of the HEF load time in the gap.
+
+
+@dataclass
+class SwapReport:
+    prepare_ms: float = 0.0
+    block_ms: float = 0.0
+    drain_ms: float = 0.0
+    relink_ms: float = 0.0
+    gap_ms: float = 0.0
+    # Frames missing from the output cadence during the gap
+    gap_frames: int = 0
+    drained: bool = True
+
+    def __str__(self):
+        return (
+            f"Inference swap: output gap {self.gap_ms:.1f} ms ({self.gap_frames} frames), "
+            f"prepare {self.prepare_ms:.1f} ms, block {self.block_ms:.1f} ms, "
+            f"drain {self.drain_ms:.1f} ms{'' if self.drained else ' (timed out)'}, "
+            f"relink {self.relink_ms:.1f} ms"
+        )
+
+
+class InferenceSwapper:
+    """
+    Replaces the chain of elements between two elements of a running pipeline.
+
+    Args:
+        pipeline (Gst.Pipeline): The running pipeline.
+        first (str): Name of the first element of the chain, its sink pad peer stays in place.
+        last (str): Name of the last element of the chain, its src pad peer stays in place.
+    """
+    def __init__(self, pipeline, first="queue_hailonet", last="hailofilter"):
+        self.pipeline = pipeline
+        first_element = pipeline.get_by_name(first)
+        last_element = pipeline.get_by_name(last)
+        if first_element is None or last_element is None:
+            raise ValueError(f"The pipeline has no {first} ! ... ! {last} chain")
+        self.upstream_pad = first_element.get_static_pad("sink").get_peer()
+        self.downstream_pad = last_element.get_static_pad("src").get_peer()
+        self.swaps = 0
+        self.last_report = None
+        self.frame_interval = None
+        self._lock = threading.Lock()
+        self._swapping = False
+        self._last_output = None
+        self._resumed = None
+        self._first_output = threading.Event()
+        self.downstream_pad.add_probe(Gst.PadProbeType.BUFFER, self._on_output)
+
+    def _on_output(self, pad, info):
+        now = time.monotonic()
+        if self._swapping:
+            if not self._first_output.is_set():
+                self._resumed = now
+                self._first_output.set()
+        elif self._last_output is not None:
+            # Smoothed output frame interval, the unit of the reported gap
+            interval = now - self._last_output
+            self.frame_interval = interval if self.frame_interval is None else 0.9 * self.frame_interval + 0.1 * interval
+        self._last_output = now
+        return Gst.PadProbeReturn.OK
+
+    def get_chain(self):
+        """
+        Returns the top-level elements between the two fixed pads, in stream order.
+        """
+        elements = []
+        pad = self.upstream_pad.get_peer()
+        while pad is not None and pad != self.downstream_pad:
+            element = pad.get_parent_element()
+            elements.append(element)
+            pad = element.srcpads[0].get_peer() if element.srcpads else None
+        if pad is None:
+            raise RuntimeError("The inference chain is not linked through to the downstream pad")
+        return elements
+
+    def swap(self, description, preload=True, timeout=2.0):
+        """
+        Replaces the chain with the elements of a pipeline description.
+
+        Blocks the caller until the first frame leaves the new chain, so call it from the main
+        loop or a worker thread, never from a streaming thread.
+
+        Args:
+            description (str): Pipeline fragment, for example get_inference_element().
+            preload (bool): Load the new elements before blocking the old chain.
+            timeout (float): Seconds to wait for data to block, drain and resume.
+
+        Returns:
+            SwapReport
+        """
+        with self._lock:
+            report = SwapReport()
+            start = time.monotonic()
+            new_bin = Gst.parse_bin_from_description(description.strip().rstrip("!").strip(), True)
+            new_bin.set_name(f"inference_bin_{self.swaps}")
+            # QoS stays off on the inference path
+            set_qos(new_bin, lambda element: False)
+            self.pipeline.add(new_bin)
+            if preload and new_bin.sync_state_with_parent() is False:
+                self._discard(new_bin)
+                raise RuntimeError("The new inference elements failed to start")
+            prepared = time.monotonic()
+            report.prepare_ms = (prepared - start) * 1e3
+
+            old_elements = self.get_chain()
+            old_sink = self.upstream_pad.get_peer()
+            old_src = self.downstream_pad.get_peer()
+            # After a failed swap the pads are linked directly and there is nothing to drain
+            bypassed = not old_elements
+            blocked = threading.Event()
+            drained = threading.Event()
+
+            def on_eos(pad, info):
+                if info.get_event().type != Gst.EventType.EOS:
+                    return Gst.PadProbeReturn.OK
+                drained.set()
+                # The EOS only ends the old chain, the rest of the pipeline keeps running
+                return Gst.PadProbeReturn.DROP
+
+            def on_blocked(pad, info):
+                if not blocked.is_set():
+                    blocked.set()
+                    # Drain the frames already in the old chain
+                    if not bypassed:
+                        old_sink.send_event(Gst.Event.new_eos())
+                return Gst.PadProbeReturn.OK
+
+            eos_probe = None if bypassed else old_src.add_probe(Gst.PadProbeType.EVENT_DOWNSTREAM, on_eos)
+            block_probe = self.upstream_pad.add_probe(Gst.PadProbeType.BLOCK_DOWNSTREAM, on_blocked)
+            if not blocked.wait(timeout):
+                self.upstream_pad.remove_probe(block_probe)
+                if eos_probe is not None:
+                    old_src.remove_probe(eos_probe)
+                self._discard(new_bin)
+                raise RuntimeError("No data reached the inference chain, nothing was swapped")
+            report.block_ms = (time.monotonic() - prepared) * 1e3
+
+            drain_start = time.monotonic()
+            report.drained = bypassed or drained.wait(timeout)
+            report.drain_ms = (time.monotonic() - drain_start) * 1e3
+
+            relink_start = time.monotonic()
+            self.upstream_pad.unlink(old_sink)
+            if not bypassed:
+                old_src.unlink(self.downstream_pad)
+                old_src.remove_probe(eos_probe)
+            for element in old_elements:
+                element.set_state(Gst.State.NULL)
+                self.pipeline.remove(element)
+            # From here on the old chain is gone: every failure links the pads directly so the
+            # source and the display keep running without detections, and unblocks them
+            try:
+                if not preload and new_bin.sync_state_with_parent() is False:
+                    raise RuntimeError("The new inference elements failed to start")
+                if self.upstream_pad.link(new_bin.get_static_pad("sink")) != Gst.PadLinkReturn.OK:
+                    raise RuntimeError("Failed to link the new inference elements")
+                if new_bin.get_static_pad("src").link(self.downstream_pad) != Gst.PadLinkReturn.OK:
+                    self.upstream_pad.unlink(new_bin.get_static_pad("sink"))
+                    raise RuntimeError("Failed to link the new inference elements")
+            except RuntimeError as e:
+                self._discard(new_bin)
+                self.upstream_pad.link(self.downstream_pad)
+                self.upstream_pad.remove_probe(block_probe)
+                raise RuntimeError(f"{e}, frames bypass inference until the next successful swap") from None
+            last_output = self._last_output
+            self._first_output.clear()
+            self._swapping = True
+            report.relink_ms = (time.monotonic() - relink_start) * 1e3
+            self.upstream_pad.remove_probe(block_probe)
+
+            if self._first_output.wait(timeout) and last_output is not None:
+                report.gap_ms = (self._resumed - last_output) * 1e3
+                if self.frame_interval:
+                    report.gap_frames = max(round(report.gap_ms / 1e3 / self.frame_interval) - 1, 0)
+            else:
+                report.gap_ms = float("nan")
+            self._swapping = False
+            self._first_output.clear()
+            self.swaps += 1
+            self.last_report = report
+            return report
+
+    def _discard(self, element):
+        element.set_state(Gst.State.NULL)
+        self.pipeline.remove(element)
+
+
+def load_inference_config(path):
+    """
+    Reads the inference parameters to swap in from a JSON file with any of the keys hef_path,
+    nms_score_threshold, nms_iou_threshold, batch_size and labels_json.
+    """
+    with open(path, "r") as f:
+        config = json.load(f)
+    keys = ('hef_path', 'nms_score_threshold', 'nms_iou_threshold', 'batch_size', 'labels_json')
+    unknown = set(config) - set(keys)
+    if unknown:
+        raise ValueError(f"Unknown inference config keys: {', '.join(sorted(unknown))}")
+    return config
+
+
+def add_inference_swap_arguments(parser):
+    parser.add_argument(
+        "--inference-config", default=None, metavar="JSON",
+        help="Swap in the inference parameters from this JSON file on SIGHUP, without restarting the pipeline"
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    # Swap an identity stand-in for hailonet back and forth in a live test pipeline and report the
+    # output gap of every swap and the frames lost overall
+    parser = argparse.ArgumentParser(description="Swap stand-in inference elements in a running pipeline")
+    parser.add_argument("--swaps", type=int, default=10)
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds between swaps")
+    parser.add_argument("--framerate", type=int, default=30)
+    parser.add_argument("--no-preload", action="store_true")
+    args = parser.parse_args()
+
+    Gst.init(None)
+
+    def inference_element(sleep_us):
+        # identity sleep-time stands in for the NPU round trip
+        return (
+            "queue name=queue_hailonet max-size-buffers=3 max-size-bytes=0 max-size-time=0 ! "
+            f"videoconvert ! identity name=hailonet sleep-time={sleep_us} ! "
+            "queue name=queue_hailofilter max-size-buffers=3 max-size-bytes=0 max-size-time=0 ! "
+            "identity name=hailofilter ! "
+        )
+
+    pipeline = Gst.parse_launch(
+        "videotestsrc is-live=true pattern=ball ! "
+        f"video/x-raw, format=RGB, width=640, height=640, framerate={args.framerate}/1 ! "
+        "queue name=queue_src leaky=downstream max-size-buffers=3 max-size-bytes=0 max-size-time=0 ! "
+        "identity name=source_count ! "
+        + inference_element(5000)
+        + "queue name=queue_hmuc max-size-buffers=3 max-size-bytes=0 max-size-time=0 ! "
+        "fakesink name=sink sync=false"
+    )
+    counts = {'source': 0, 'output': 0, 'dropped': 0}
+
+    def count(name):
+        def probe(pad, info):
+            counts[name] += 1
+            return Gst.PadProbeReturn.OK
+        return probe
+
+    pipeline.get_by_name("source_count").get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, count('source'))
+    pipeline.get_by_name("sink").get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, count('output'))
+    pipeline.get_by_name("queue_src").connect("overrun", lambda queue: counts.__setitem__('dropped', counts['dropped'] + 1))
+    swapper = InferenceSwapper(pipeline)
+    pipeline.set_state(Gst.State.PLAYING)
+
+    loop = GLib.MainLoop()
+    reports = []
+
+    def run_swaps():
+        for index in range(args.swaps):
+            time.sleep(args.interval)
+            report = swapper.swap(inference_element(2000 if index % 2 else 8000), preload=not args.no_preload)
+            print(report)
+            reports.append(report)
+        time.sleep(args.interval)
+        GLib.idle_add(loop.quit)
+
+    threading.Thread(target=run_swaps, daemon=True).start()
+    loop.run()
+    pipeline.set_state(Gst.State.NULL)
+
+    gaps = sorted(report.gap_ms for report in reports)
+    if gaps:
+        print(f"{len(gaps)} swaps, output gap median {gaps[len(gaps) // 2]:.1f} ms max {gaps[-1]:.1f} ms, "
+              f"most frames missed {max(report.gap_frames for report in reports)}")
+    print(f"Frames: {counts['source']} into the chain, {counts['output']} out, "
+          f"{counts['dropped']} dropped by the source queue")
@@ -0,0 +1,257 @@
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+import argparse
+import threading
+import time
+import numpy as np
+import cv2
+from hailo_rpi_common import get_caps_from_pad, get_numpy_view_from_buffer
+
+# -----------------------------------------------------------------------------------------------
+# Motion-gated inference
+# -----------------------------------------------------------------------------------------------
+# The camera looks at mostly empty sky, so most frames carry no new information for the NPU.
+# The gate compares the grayscale frame with a running background at full resolution and only
+# lets frames through to the network when enough blocks changed. The difference is reduced to
+# the largest change of every block, so a target of a pixel or two still marks its block;
+# sampling every Nth pixel would miss most of them.
+#
+# Gating is done with a pad probe on the hailonet sink pad that toggles hailonet's
+# pass-through property. Gated frames still flow through hailofilter to hmux, just without
+# output tensors, so they reach the callback with an empty ROI and the bypass branch of
+# hailomuxer stays in step with the inference branch.
+# hailonet checks pass-through at the top of its chain function, which runs on the streaming
+# thread right after the probe, so the value set by the probe applies to the buffer being
+# pushed. Buffers already inside hailonet (a batch being filled or inferred) would read a
+# changed value later, so the probe only flips the property once all of them have left
+# hailonet. Decisions are held for a whole network batch, so an inferred batch is always
+# complete and leaves without waiting for more frames.
+
+# ITU-R BT.601 luma weights scaled to 8 bits, applied in integer math
+LUMA_WEIGHTS = np.array([77, 150, 29], dtype=np.uint16)
+
+
+class MotionGate:
+    """
+    Frame-difference gate against a running background.
+
+    Args:
+        downsample (int): Size of the square blocks the difference is reduced over; a changed
+            pixel marks its whole block.
+        pixel_threshold (int): Minimum gray level difference for a pixel to count as changed.
+        min_changed_fraction (float): Fraction of changed blocks needed to open the gate. The
+            default opens it on a single block of a 640x640 frame.
+        background_alpha (float): Weight of the current frame in the running background.
+        keep_alive_interval (int): Let one frame through at least every N frames, 0 to disable.
+        batch_size (int): Network batch size; a decision is held for this many frames.
+        drain_timeout (float): Longest wait in seconds for hailonet to empty before flipping
+            pass-through. On timeout the current mode is kept for the next batch.
+    """
+    def __init__(self, downsample=8, pixel_threshold=12, min_changed_fraction=0.0001,
+                 background_alpha=0.05, keep_alive_interval=30, batch_size=1, drain_timeout=0.5):
+        self.downsample = downsample
+        self.pixel_threshold = pixel_threshold
+        self.min_changed_fraction = min_changed_fraction
+        self.background_alpha = background_alpha
+        self.keep_alive_interval = keep_alive_interval
+        self.batch_size = batch_size
+        self.drain_timeout = drain_timeout
+        self.background = None
+        self._background_gray = None
+        self._difference = None
+        self.hailonet = None
+        self._pass_through = False
+        # Buffers pushed into hailonet that have not left it yet
+        self._in_hailonet = 0
+        self._drained = threading.Condition()
+        self.reset_stats()
+        self._frames_since_pass = 0
+        self._batch_position = 0
+        self._batch_decision = True
+
+    def reset_stats(self):
+        self.frames = 0
+        self.passed = 0
+        self.keep_alive_passes = 0
+        self.deferred_switches = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def to_gray(self, frame):
+        if frame.ndim == 2:
+            return frame
+        if frame.shape[2] == 3:
+            return cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        return (frame[..., :3] @ LUMA_WEIGHTS >> 8).astype(np.uint8)
+
+    def block_max(self, image):
+        # Largest value of every downsample x downsample block, one axis at a time
+        block = self.downsample
+        height = image.shape[0] - image.shape[0] % block
+        width = image.shape[1] - image.shape[1] % block
+        rows = image[:height, :width].reshape(height // block, block, width).max(axis=1)
+        return rows.reshape(height // block, width // block, block).max(axis=2)
+
+    def has_motion(self, frame):
+        """
+        Updates the background with the frame and returns True if the frame differs from it.
+        """
+        gray = self.to_gray(frame)
+        if self.background is None or self.background.shape != gray.shape:
+            self.background = gray.astype(np.float32)
+            self._background_gray = np.empty_like(gray)
+            self._difference = np.empty_like(gray)
+            return True
+        # Difference and running average in place, no per-frame allocation at full resolution
+        cv2.convertScaleAbs(self.background, dst=self._background_gray)
+        cv2.absdiff(gray, self._background_gray, dst=self._difference)
+        changed_blocks = self.block_max(self._difference) > self.pixel_threshold
+        cv2.accumulateWeighted(gray, self.background, self.background_alpha)
+        return bool(np.count_nonzero(changed_blocks) >= self.min_changed_fraction * changed_blocks.size)
+
+    def process(self, frame):
+        """
+        Returns True if the frame should go through inference.
+        """
+        start = time.perf_counter()
+        if self._batch_position == 0:
+            decision = self.has_motion(frame)
+            if not decision and self.keep_alive_interval and self._frames_since_pass >= self.keep_alive_interval:
+                decision = True
+                self.keep_alive_passes += 1
+            self._batch_decision = decision
+        self._batch_position = (self._batch_position + 1) % self.batch_size
+
+        self.frames += 1
+        if self._batch_decision:
+            self.passed += 1
+            self._frames_since_pass = 0
+        else:
+            self._frames_since_pass += 1
+        latency = time.perf_counter() - start
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        return self._batch_decision
+
+    def get_stats(self):
+        frames = max(self.frames, 1)
+        return {
+            'frames': self.frames,
+            'passed': self.passed,
+            'gated': self.frames - self.passed,
+            'keep_alive_passes': self.keep_alive_passes,
+            'deferred_switches': self.deferred_switches,
+            'pass_rate': self.passed / frames,
+            'mean_latency_us': self.total_latency / frames * 1e6,
+            'max_latency_us': self.max_latency * 1e6,
+        }
+
+    # ---------------------------------------------------------
+    # GStreamer integration
+    # ---------------------------------------------------------
+
+    def attach(self, hailonet):
+        """
+        Installs the gate as a buffer probe on the hailonet sink pad and counts the buffers
+        leaving its src pad.
+        """
+        self.hailonet = hailonet
+        self._pass_through = hailonet.get_property("pass-through")
+        sink_pad = hailonet.get_static_pad("sink")
+        sink_pad.add_probe(Gst.PadProbeType.BUFFER, self._probe_callback)
+        sink_pad.add_probe(Gst.PadProbeType.EVENT_FLUSH, self._on_flush)
+        hailonet.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self._on_leave)
+
+    def set_pass_through(self, pass_through):
+        """
+        Flips hailonet's pass-through once no buffer is left inside it.
+
+        Returns:
+            bool: False if hailonet did not empty within drain_timeout and the mode was kept.
+        """
+        if pass_through == self._pass_through:
+            return True
+        with self._drained:
+            if not self._drained.wait_for(lambda: self._in_hailonet == 0, timeout=self.drain_timeout):
+                self.deferred_switches += 1
+                return False
+        self.hailonet.set_property("pass-through", pass_through)
+        self._pass_through = pass_through
+        return True
+
+    def left_hailonet(self):
+        with self._drained:
+            self._in_hailonet = max(self._in_hailonet - 1, 0)
+            if self._in_hailonet == 0:
+                self._drained.notify_all()
+
+    def _probe_callback(self, pad, info):
+        buffer = info.get_buffer()
+        if buffer is None:
+            return Gst.PadProbeReturn.OK
+        format, width, height = get_caps_from_pad(pad)
+        if format is not None:
+            with get_numpy_view_from_buffer(buffer, format, width, height) as frame:
+                infer = self.process(frame[0] if isinstance(frame, tuple) else frame)
+            if not self.set_pass_through(not infer):
+                # Keep the mode hailonet is in for the rest of this batch
+                self._batch_decision = not self._pass_through
+        with self._drained:
+            self._in_hailonet += 1
+        return Gst.PadProbeReturn.OK
+
+    def _on_leave(self, pad, info):
+        self.left_hailonet()
+        return Gst.PadProbeReturn.OK
+
+    def _on_flush(self, pad, info):
+        # A flush discards whatever hailonet was holding
+        if info.get_event().type == Gst.EventType.FLUSH_STOP:
+            with self._drained:
+                self._in_hailonet = 0
+                self._drained.notify_all()
+        return Gst.PadProbeReturn.OK
+
+    def report(self):
+        stats = self.get_stats()
+        print(
+            f"Motion gate: {stats['passed']}/{stats['frames']} frames inferred ({stats['pass_rate']:.1%}), "
+            f"keep-alive {stats['keep_alive_passes']}, deferred switches {stats['deferred_switches']}, "
+            f"latency mean {stats['mean_latency_us']:.0f} us max {stats['max_latency_us']:.0f} us"
+        )
+        self.reset_stats()
+        # Returning True keeps the GLib timeout running
+        return True
+
+
+def add_motion_gate_arguments(parser):
+    parser.add_argument("--motion-gate", action="store_true", help="Only run inference on frames with motion")
+    parser.add_argument(
+        "--gate-keep-alive", type=int, default=30,
+        help="Run inference on at least one frame every N frames when the gate is closed, 0 to disable"
+    )
+    parser.add_argument("--gate-threshold", type=int, default=12, help="Gray level change that counts as motion, well above the sensor noise: every pixel is compared")
+    parser.add_argument(
+        "--gate-report-interval", type=int, default=10,
+        help="Seconds between motion gate statistics reports"
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    # Offline evaluation of the gate on a recorded clip, no hailo hardware required
+    parser = argparse.ArgumentParser(description="Evaluate the motion gate on a recorded clip")
+    parser.add_argument("clip", help="Path to a video file")
+    add_motion_gate_arguments(parser)
+    args = parser.parse_args()
+
+    gate = MotionGate(pixel_threshold=args.gate_threshold, keep_alive_interval=args.gate_keep_alive)
+    capture = cv2.VideoCapture(args.clip)
+    while True:
+        ret, frame = capture.read()
+        if not ret:
+            break
+        gate.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    capture.release()
+    print(gate.get_stats())
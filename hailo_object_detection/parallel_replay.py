@@ -0,0 +1,485 @@
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+import argparse
+import multiprocessing
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Optional
+import numpy as np
+
+from detection import GStreamerDetectionApp, get_detection_parser, user_app_callback_class
+from detection_store import COLUMNS, DetectionCollector, DetectionStore, add_detection_store_arguments
+
+# -----------------------------------------------------------------------------------------------
+# Parallel replay of archived footage
+# -----------------------------------------------------------------------------------------------
+# The file source decodes with one avdec_h264 of two threads, so a long recording replays at the
+# speed of one decoder while the rest of the CPU and most of the NPU sit idle. Replay splits the
+# recording instead:
+# 1. the sample tables of the MP4 (moov/trak/stbl) give the presentation time of every keyframe
+#    without reading the media data
+# 2. the recording is cut at the keyframes nearest to equal shares of its duration, so every
+#    segment starts with a frame that decodes on its own
+# 3. every segment runs in its own detection pipeline in a worker process: a flushing key-unit
+#    seek to the segment start with the stop position at the next segment's start, fakesink,
+#    no clock sync
+# 4. each worker keeps the frames with start <= pts < stop and returns them as one block; the
+#    blocks are merged in time order with absolute times of recording start + pts
+# The tracker restarts in every segment, so a track crossing a boundary is split in two. Track
+# ids are offset by the segment index to stay unique in the merged stream.
+#
+# Fragmented MP4 keeps its sample tables in the fragments and is replayed as a single segment.
+# Several processes can only share a Hailo device through the HailoRT multi-process service
+# (hailort_service), which the workers use when more than one runs with the hailo backend.
+
+# Seconds between 1904-01-01 (MP4 epoch) and 1970-01-01
+MP4_EPOCH_OFFSET = 2082844800
+PREROLL_TIMEOUT = 30
+
+
+@dataclass
+class KeyframeIndex:
+    # Presentation times of the keyframes in seconds, ascending
+    keyframes: np.ndarray
+    duration: float
+    frames: int = 0
+    # Unix time of mvhd creation_time, None if the muxer left it unset
+    creation_time: Optional[float] = None
+    fragmented: bool = False
+
+
+def _iter_boxes(data, start=0, end=None):
+    # (type, payload start, box end) of the boxes in data[start:end]
+    end = len(data) if end is None else end
+    while start + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", data, start)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, start + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - start
+        if size < header:
+            raise ValueError(f"Corrupt MP4 box {kind!r} at offset {start}")
+        yield kind, start + header, min(start + size, end)
+        start += size
+
+
+def _find_box(data, start, end, *path):
+    for kind, payload, box_end in _iter_boxes(data, start, end):
+        if kind == path[0]:
+            return (payload, box_end) if len(path) == 1 else _find_box(data, payload, box_end, *path[1:])
+    return None
+
+
+def _read_moov(path):
+    # Reads only the moov box, wherever the muxer put it; mdat is skipped
+    with open(path, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        offset = 0
+        while offset + 8 <= file_size:
+            f.seek(offset)
+            header = f.read(16)
+            size, kind = struct.unpack_from(">I4s", header)
+            header_size = 8
+            if size == 1:
+                size = struct.unpack_from(">Q", header, 8)[0]
+                header_size = 16
+            elif size == 0:
+                size = file_size - offset
+            if size < header_size:
+                break
+            if kind == b"moov":
+                f.seek(offset + header_size)
+                return f.read(size - header_size)
+            offset += size
+    raise ValueError(f"{path} has no moov box, only MP4 recordings can be split")
+
+
+def _table(data, start, dtype, columns=1):
+    # Sample table with a version/flags word and an entry count in front of its entries
+    count = struct.unpack_from(">I", data, start + 4)[0]
+    return np.frombuffer(data, dtype=dtype, count=count * columns, offset=start + 8).reshape(count, columns)
+
+
+def read_keyframe_index(path):
+    """
+    Reads the keyframe presentation times of the video track of an MP4 file.
+
+    Returns:
+        KeyframeIndex
+    """
+    moov = _read_moov(path)
+    mvhd = _find_box(moov, 0, len(moov), b"mvhd")
+    if mvhd is None:
+        raise ValueError(f"{path} has no movie header")
+    start = mvhd[0]
+    if moov[start] == 1:
+        creation, movie_timescale, movie_duration = struct.unpack_from(">Q8xIQ", moov, start + 4)
+    else:
+        creation, movie_timescale, movie_duration = struct.unpack_from(">I4xII", moov, start + 4)
+    creation_time = creation - MP4_EPOCH_OFFSET if creation else None
+    movie_length = movie_duration / movie_timescale if movie_timescale else 0.0
+
+    if _find_box(moov, 0, len(moov), b"mvex") is not None:
+        return KeyframeIndex(np.zeros(1), movie_length, creation_time=creation_time, fragmented=True)
+
+    for kind, trak, trak_end in _iter_boxes(moov):
+        if kind != b"trak":
+            continue
+        hdlr = _find_box(moov, trak, trak_end, b"mdia", b"hdlr")
+        if hdlr is None or moov[hdlr[0] + 8:hdlr[0] + 12] != b"vide":
+            continue
+        mdhd = _find_box(moov, trak, trak_end, b"mdia", b"mdhd")[0]
+        if moov[mdhd] == 1:
+            timescale, = struct.unpack_from(">I", moov, mdhd + 20)
+        else:
+            timescale, = struct.unpack_from(">I", moov, mdhd + 12)
+        stbl = _find_box(moov, trak, trak_end, b"mdia", b"minf", b"stbl")
+
+        stts = _table(moov, _find_box(moov, *stbl, b"stts")[0], ">u4", 2)
+        deltas = np.repeat(stts[:, 1].astype(np.int64), stts[:, 0].astype(np.int64))
+        decode_times = np.concatenate(([0], np.cumsum(deltas)[:-1])) if len(deltas) else deltas
+        times = decode_times
+        ctts = _find_box(moov, *stbl, b"ctts")
+        if ctts is not None:
+            # Version 0 offsets are unsigned by the spec but muxers write negative ones as well
+            offsets = _table(moov, ctts[0], ">i4", 2)
+            times = decode_times + np.repeat(offsets[:, 1].astype(np.int64), offsets[:, 0].astype(np.int64))
+
+        # qtdemux starts the presentation at the first edit: leading empty edits delay it and
+        # the media time of the first real edit is skipped
+        delay = 0.0
+        media_start = 0
+        elst = _find_box(moov, trak, trak_end, b"edts", b"elst")
+        if elst is not None:
+            version = moov[elst[0]]
+            entries = _table(moov, elst[0], ">u8, >i8, >i4" if version == 1 else ">u4, >i4, >i4")[:, 0]
+            for segment_duration, media_time, _ in entries.tolist():
+                if media_time == -1:
+                    delay += segment_duration / movie_timescale
+                else:
+                    media_start = media_time
+                    break
+
+        stss = _find_box(moov, *stbl, b"stss")
+        if stss is None:
+            # Every sample is a sync sample
+            keyframes = times
+        else:
+            keyframes = times[_table(moov, stss[0], ">u4")[:, 0].astype(np.int64) - 1]
+        keyframes = np.sort((keyframes - media_start) / timescale + delay)
+        duration = float((times.max() + deltas[-1] - media_start) / timescale + delay) if len(times) else movie_length
+        return KeyframeIndex(keyframes, duration, frames=len(times), creation_time=creation_time)
+    raise ValueError(f"{path} has no video track")
+
+
+def split_segments(index, count, min_seconds=30.0):
+    """
+    Cuts a recording into at most count segments at the keyframes nearest to equal shares of
+    its duration.
+
+    Args:
+        index (KeyframeIndex): Keyframes of the recording.
+        count (int): Segments wanted.
+        min_seconds (float): Shortest segment worth the start-up of a pipeline.
+
+    Returns:
+        list: (start, stop) in seconds per segment; the stop of the last one is None (end of file).
+    """
+    count = max(1, min(count, int(index.duration // min_seconds)))
+    keyframes = index.keyframes
+    if index.fragmented or count == 1 or len(keyframes) < 2:
+        return [(0.0, None)]
+    targets = index.duration * np.arange(1, count) / count
+    right = np.clip(np.searchsorted(keyframes, targets), 1, len(keyframes) - 1)
+    nearest = np.where(targets - keyframes[right - 1] < keyframes[right] - targets, right - 1, right)
+    cuts = np.unique(keyframes[nearest])
+    cuts = cuts[(cuts > keyframes[0]) & (cuts < index.duration)]
+    bounds = [0.0] + cuts.tolist()
+    return list(zip(bounds, bounds[1:] + [None]))
+
+
+class ReplayDetectionApp(GStreamerDetectionApp):
+    """
+    Detection pipeline over one segment of a recording, as fast as it decodes.
+
+    Args:
+        start_ns (int): Presentation time of the keyframe the segment starts with.
+        stop_ns (int, optional): End of the segment, exclusive; None replays to the end.
+        multi_process (bool): Open the Hailo device through the HailoRT multi-process service.
+    """
+    def __init__(self, args, user_data, start_ns=0, stop_ns=None, multi_process=False):
+        self.start_ns = start_ns
+        self.stop_ns = stop_ns
+        self.multi_process = multi_process
+        self.error = None
+        self.reached_eos = False
+        super().__init__(args, user_data)
+
+    def create_pipeline(self):
+        # Nothing is displayed; the frames only have to reach the callback
+        self.video_sink = "fakesink"
+        super().create_pipeline()
+
+    def get_inference_element(self):
+        inference_element = super().get_inference_element()
+        if self.multi_process:
+            inference_element = inference_element.replace(
+                "hailonet name=hailonet ", "hailonet name=hailonet multi-process-service=true ", 1
+            )
+        return inference_element
+
+    def bus_call(self, bus, message, loop):
+        if message.type == Gst.MessageType.EOS:
+            self.reached_eos = True
+        elif message.type == Gst.MessageType.ERROR:
+            err, debug = message.parse_error()
+            self.error = f"{err}, {debug}"
+        return super().bus_call(bus, message, loop)
+
+    def _on_flush(self, pad, info):
+        if info.get_event().type != Gst.EventType.FLUSH_STOP:
+            return Gst.PadProbeReturn.OK
+        # Everything after the seek's flush is re-decoded from the segment start; the frames the
+        # callback saw while prerolling are discarded, in the streaming thread that runs it
+        self.user_data.frame_count = 0
+        self.user_data.trackers.clear()
+        if self.user_data.detection_writer is not None:
+            self.user_data.detection_writer.clear()
+        return Gst.PadProbeReturn.REMOVE
+
+    def run(self):
+        seek = self.start_ns or self.stop_ns is not None
+        # The callback sees the frames of the preroll too: without a seek they are the first
+        # frames of the file, with one they are replaced at the flush
+        self.attach_callbacks()
+        if seek:
+            identity = self.pipeline.get_by_name("identity_callback")
+            identity.get_static_pad("src").add_probe(Gst.PadProbeType.EVENT_FLUSH, self._on_flush)
+        self.pipeline.set_state(Gst.State.PAUSED)
+        result, _, _ = self.pipeline.get_state(PREROLL_TIMEOUT * Gst.SECOND)
+        if result == Gst.StateChangeReturn.FAILURE:
+            self.error = "The pipeline failed to preroll"
+            self.pipeline.set_state(Gst.State.NULL)
+            return
+        if seek:
+            seeked = self.pipeline.seek(
+                1.0, Gst.Format.TIME, Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT,
+                Gst.SeekType.SET, self.start_ns,
+                Gst.SeekType.NONE if self.stop_ns is None else Gst.SeekType.SET,
+                Gst.CLOCK_TIME_NONE if self.stop_ns is None else self.stop_ns,
+            )
+            if not seeked:
+                self.error = f"Seek to {self.start_ns / 1e9:.3f}s failed"
+                self.pipeline.set_state(Gst.State.NULL)
+                return
+        super().run()
+
+
+def replay_segment(task):
+    """
+    Runs one segment in this process. Module-level so a spawned worker can unpickle it.
+
+    Args:
+        task (dict): path, index, start_ns, stop_ns, time_base_ns, app_args and multi_process.
+
+    Returns:
+        dict: index, block of the detections inside the segment, frames, elapsed and error.
+    """
+    Gst.init(None)
+    args = get_detection_parser().parse_args(task['app_args'] + ["--input", task['path'], "--disable-sync"])
+    user_data = user_app_callback_class()
+    # Workers report through their result, not the log
+    user_data.logger.interval = float("inf")
+    user_data.time_base_ns = task['time_base_ns']
+    collector = DetectionCollector()
+    user_data.detection_writer = collector
+    app = ReplayDetectionApp(args, user_data, task['start_ns'], task['stop_ns'], task['multi_process'])
+
+    start = time.perf_counter()
+    app.run()
+    elapsed = time.perf_counter() - start
+
+    # A key-unit seek may start a little early and decoders may pass a frame past the stop;
+    # those frames belong to the neighbouring segments
+    def inside(pts):
+        keep = pts >= task['start_ns']
+        if task['stop_ns'] is not None:
+            keep &= pts < task['stop_ns']
+        return keep
+
+    block = collector.to_block()
+    keep = inside(block['pts'])
+    return {
+        'index': task['index'],
+        'block': {name: values[keep] for name, values in block.items()},
+        'frames': int(np.count_nonzero(inside(np.unique(np.array(collector.frame_pts, dtype=np.int64))))),
+        'elapsed': elapsed,
+        # An interrupted worker returns from run() too, with only part of the segment
+        'error': app.error or (None if app.reached_eos else "Stopped before the end of the segment"),
+    }
+
+
+def merge_segments(results):
+    """
+    Merges the blocks of replayed segments into one block in time order, with the track ids of
+    every segment offset by its index so they stay unique.
+    """
+    blocks = []
+    for result in sorted(results, key=lambda result: result['index']):
+        block = dict(result['block'])
+        track_ids = block['track_id']
+        block['track_id'] = np.where(track_ids >= 0, track_ids + (result['index'] << 32), -1)
+        blocks.append(block)
+    if not blocks:
+        return {name: np.zeros(0, dtype) for name, dtype in COLUMNS.items()}
+    merged = {name: np.concatenate([block[name] for block in blocks]).astype(dtype, copy=False) for name, dtype in COLUMNS.items()}
+    order = np.argsort(merged['time_ns'], kind='stable')
+    return {name: values[order] for name, values in merged.items()}
+
+
+def recording_start_ns(path, index=None):
+    """
+    Absolute time of pts 0 of a recording: the MP4 creation time, else the file modification time
+    minus the duration (recorders write until the end), else the modification time alone.
+    """
+    if index is None:
+        try:
+            index = read_keyframe_index(path)
+        except ValueError:
+            return int(os.path.getmtime(path) * 1e9)
+    start_time = index.creation_time if index.creation_time is not None else os.path.getmtime(path) - index.duration
+    return int(start_time * 1e9)
+
+
+def default_workers(backend="hailo"):
+    # Every pipeline decodes with two threads and converts with three more; the NPU is shared
+    cpus = os.cpu_count() or 2
+    return max(1, cpus // 2 if backend == "hailo" else cpus // 4)
+
+
+def replay(path, app_args, workers=None, segments=None, time_base_ns=None, min_segment_seconds=30.0):
+    """
+    Replays a recording with its segments in parallel worker processes.
+
+    Args:
+        path (str): MP4 recording.
+        app_args (list): Detection app arguments of the workers, e.g. ["--hef-path", "..."].
+        workers (int, optional): Worker processes, default_workers() by default.
+        segments (int, optional): Segments to cut, twice the workers by default so a slow
+            segment does not hold up the end of the run.
+        time_base_ns (int, optional): Absolute time of pts 0, the MP4 creation time by default,
+            else the file modification time minus the duration.
+        min_segment_seconds (float): Shortest segment.
+
+    Returns:
+        (dict, dict): The merged block and run statistics.
+    """
+    backend = get_detection_parser().parse_args(app_args + ["--input", path]).backend
+    workers = workers or default_workers(backend)
+    index = read_keyframe_index(path)
+    if time_base_ns is None:
+        time_base_ns = recording_start_ns(path, index)
+    bounds = split_segments(index, segments or 2 * workers, min_segment_seconds)
+    tasks = [
+        {
+            'path': path,
+            'index': segment_index,
+            'start_ns': int(round(start * 1e9)),
+            'stop_ns': None if stop is None else int(round(stop * 1e9)),
+            'time_base_ns': time_base_ns,
+            'app_args': list(app_args),
+            'multi_process': backend == "hailo" and min(workers, len(bounds)) > 1,
+        }
+        for segment_index, (start, stop) in enumerate(bounds)
+    ]
+
+    start = time.perf_counter()
+    results = []
+    # spawn: a forked GStreamer/GLib process inherits threads and locks it cannot use. Every
+    # segment gets a fresh process, the app leaves GLib timeouts and probes behind
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), mp_context=context, max_tasks_per_child=1) as pool:
+        futures = [pool.submit(replay_segment, task) for task in tasks]
+        for future in as_completed(futures):
+            result = future.result()
+            if result['error']:
+                raise RuntimeError(f"Segment {result['index']} of {path} failed: {result['error']}")
+            results.append(result)
+    elapsed = time.perf_counter() - start
+
+    merged = merge_segments(results)
+    frames = sum(result['frames'] for result in results)
+    stats = {
+        'duration': index.duration,
+        'keyframes': len(index.keyframes),
+        'segments': len(tasks),
+        'workers': min(workers, len(tasks)),
+        'frames': frames,
+        # Frames of the file by its sample table; a replay that lost or doubled frames differs
+        'source_frames': index.frames,
+        'detections': len(merged['time_ns']),
+        'elapsed': elapsed,
+        'fps': frames / elapsed if elapsed else 0.0,
+        'speed': index.duration / elapsed if elapsed else 0.0,
+        'segment_fps': [result['frames'] / result['elapsed'] for result in sorted(results, key=lambda r: r['index']) if result['elapsed']],
+    }
+    return merged, stats
+
+
+def write_detections(block, path):
+    # One .npz of the merged columns; np.load(path) gives them back by name
+    np.savez(path, **block)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Replay a recording through the detection pipeline in parallel segments. "
+                    "Arguments not listed here are passed to the detection app of every worker."
+    )
+    parser.add_argument("recording", help="MP4 recording")
+    parser.add_argument("--workers", type=int, default=None, help="Worker pipelines, half the cores by default")
+    parser.add_argument("--segments", type=int, default=None, help="Segments to cut, twice the workers by default")
+    parser.add_argument("--min-segment-seconds", type=float, default=30.0)
+    parser.add_argument(
+        "--start-time", default=None,
+        help="ISO time of the first frame, the MP4 creation time or file time by default"
+    )
+    parser.add_argument("--output", default=None, metavar="NPZ", help="Write the merged detections to this file")
+    parser.add_argument("--index-only", action="store_true", help="Print the keyframe index and segments and exit")
+    add_detection_store_arguments(parser)
+    args, app_args = parser.parse_known_args()
+
+    if args.index_only:
+        index = read_keyframe_index(args.recording)
+        print(f"{args.recording}: {index.duration:.1f}s, {index.frames} frames, {len(index.keyframes)} keyframes"
+              f"{' (fragmented)' if index.fragmented else ''}")
+        for start, stop in split_segments(index, args.segments or 2 * (args.workers or default_workers()), args.min_segment_seconds):
+            print(f"  {start:10.3f}s - {'end' if stop is None else f'{stop:.3f}s'}")
+        raise SystemExit(0)
+
+    time_base_ns = None
+    if args.start_time:
+        from datetime import datetime
+        time_base_ns = int(datetime.fromisoformat(args.start_time).timestamp() * 1e9)
+    merged, stats = replay(args.recording, app_args, args.workers, args.segments, time_base_ns, args.min_segment_seconds)
+
+    if args.output:
+        write_detections(merged, args.output)
+    if args.store:
+        store = DetectionStore(args.store, segment_seconds=args.store_segment_hours * 3600)
+        merged['run'][:] = store.new_run()
+        store.write(merged)
+        store.close()
+    print(
+        f"Replayed {stats['duration']:.1f}s in {stats['elapsed']:.1f}s ({stats['speed']:.1f}x real time): "
+        f"{stats['segments']} segments on {stats['workers']} workers, {stats['frames']} frames at "
+        f"{stats['fps']:.1f} fps, {stats['detections']} detections"
+    )
+    if stats['source_frames'] and stats['frames'] != stats['source_frames']:
+        print(f"Warning: the file has {stats['source_frames']} frames, {stats['frames']} reached the callback")
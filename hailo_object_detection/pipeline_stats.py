@@ -0,0 +1,223 @@
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+import math
+import re
+import threading
+import time
+
+# -----------------------------------------------------------------------------------------------
+# Pipeline instrumentation
+# -----------------------------------------------------------------------------------------------
+# Attaches buffer probes to the sink and src pads of every queue and of the named processing
+# stages (hailonet, hailofilter, identity_callback, ...), including their per-source copies
+# (identity_callback_0, ...). For each stage the time a buffer spends between entering and
+# leaving it is recorded in a fixed log-scale histogram, matched by source and PTS: the sources
+# of a multi-source pipeline share hailonet and their timestamps collide there. Queues are
+# additionally sampled for their fill level and count overruns, which for leaky queues is one
+# dropped buffer each.
+# The enter and leave probes of a stage run on different streaming threads, so they share the
+# in-flight buffers under a lock. Probes only read the clock and update a dict and a list,
+# keeping the overhead per buffer and stage in the low microseconds.
+
+# Stage names; per-source elements carry a _<index> suffix and are matched too
+DEFAULT_STAGES = ("src_convert", "hailonet", "hailofilter", "identity_callback", "hailooverlay")
+PER_SOURCE_SUFFIX = re.compile(r"_\d+$")
+
+# Histogram bins: 10 per decade from 10 us to 10 s, plus an overflow bin
+HISTOGRAM_MIN = 1e-5
+BINS_PER_DECADE = 10
+NUM_BINS = 6 * BINS_PER_DECADE + 1
+# Buffers that enter a stage and never leave it are forgotten after this many newer buffers
+MAX_IN_FLIGHT = 256
+
+
+def bin_upper_edge(index):
+    return HISTOGRAM_MIN * 10 ** ((index + 1) / BINS_PER_DECADE)
+
+
+def stage_matches(name, stages):
+    return name in stages or PER_SOURCE_SUFFIX.sub("", name) in stages
+
+
+class StageStats:
+    def __init__(self, name, element, source_key=None):
+        self.name = name
+        self.element = element
+        self.source_key = source_key
+        self.is_queue = element.get_factory().get_name() == "queue"
+        self.histogram = [0] * NUM_BINS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.lost = 0
+        self.overruns = 0
+        self.level_samples = 0
+        self.level_total = 0
+        self.level_max = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def _key(self, buffer):
+        return (self.source_key(buffer) if self.source_key is not None else None, buffer.pts)
+
+    def on_enter(self, pad, info):
+        buffer = info.get_buffer()
+        if buffer is not None and buffer.pts != Gst.CLOCK_TIME_NONE:
+            key = self._key(buffer)
+            with self._lock:
+                self._in_flight[key] = time.perf_counter()
+                if len(self._in_flight) > MAX_IN_FLIGHT:
+                    # Dicts keep insertion order, the first key is the oldest buffer
+                    self._in_flight.pop(next(iter(self._in_flight)), None)
+                    self.lost += 1
+        return Gst.PadProbeReturn.OK
+
+    def on_leave(self, pad, info):
+        buffer = info.get_buffer()
+        if buffer is None:
+            return Gst.PadProbeReturn.OK
+        key = self._key(buffer)
+        with self._lock:
+            start = self._in_flight.pop(key, None)
+        if start is not None:
+            self.add(time.perf_counter() - start)
+        return Gst.PadProbeReturn.OK
+
+    def add(self, latency):
+        index = 0
+        if latency > HISTOGRAM_MIN:
+            index = min(int(math.log10(latency / HISTOGRAM_MIN) * BINS_PER_DECADE), NUM_BINS - 1)
+        self.histogram[index] += 1
+        self.count += 1
+        self.total += latency
+        if latency > self.max:
+            self.max = latency
+
+    def on_overrun(self, queue):
+        self.overruns += 1
+
+    def sample_level(self):
+        level = self.element.get_property("current-level-buffers")
+        self.level_samples += 1
+        self.level_total += level
+        self.level_max = max(self.level_max, level)
+
+    def percentile(self, fraction):
+        # Upper edge of the histogram bin holding the requested fraction of samples
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.histogram):
+            seen += count
+            if seen >= target:
+                return min(bin_upper_edge(index), self.max)
+        return self.max
+
+    def snapshot(self):
+        snapshot = {
+            'count': self.count,
+            'mean_ms': 1e3 * self.total / self.count if self.count else 0.0,
+            'p50_ms': 1e3 * self.percentile(0.5),
+            'p95_ms': 1e3 * self.percentile(0.95),
+            'p99_ms': 1e3 * self.percentile(0.99),
+            'max_ms': 1e3 * self.max,
+            'lost': self.lost,
+        }
+        if self.is_queue:
+            snapshot.update({
+                'level_current': self.element.get_property("current-level-buffers"),
+                'level_mean': self.level_total / self.level_samples if self.level_samples else 0.0,
+                'level_max': self.level_max,
+                'max_size_buffers': self.element.get_property("max-size-buffers"),
+                'dropped': self.overruns if self.element.get_property("leaky") else 0,
+                'overruns': self.overruns,
+            })
+        return snapshot
+
+
+class PipelineInstrumentation:
+    """
+    Per-stage latency histograms, queue fill levels and drop counts for a pipeline.
+
+    Args:
+        pipeline (Gst.Pipeline): The pipeline to instrument. Attach it after the application probes
+            so the callback time is included in the identity_callback stage.
+        stages (iterable): Names of non-queue elements to measure, with or without a _<index>
+            suffix. Every queue is always measured.
+        sample_interval_ms (int): How often queue levels are sampled.
+        source_key (callable, optional): Returns the source of a buffer. Used by the elements that
+            several sources share, those without a _<index> suffix, to tell equal timestamps of
+            different sources apart.
+    """
+    def __init__(self, pipeline, stages=DEFAULT_STAGES, sample_interval_ms=100, source_key=None):
+        self.pipeline = pipeline
+        self.stages = {}
+        self._started = time.monotonic()
+        self._source_key = source_key
+        stage_names = set(stages)
+        it = pipeline.iterate_recurse()
+        while True:
+            result, element = it.next()
+            if result != Gst.IteratorResult.OK:
+                break
+            factory = element.get_factory()
+            is_queue = factory is not None and factory.get_name() == "queue"
+            if is_queue or stage_matches(element.get_name(), stage_names):
+                self._attach(element)
+        self._sample_interval_ms = sample_interval_ms
+
+    def _attach(self, element):
+        sink_pad = element.get_static_pad("sink")
+        src_pad = element.get_static_pad("src")
+        if sink_pad is None or src_pad is None:
+            return
+        name = element.get_name()
+        shared = self._source_key is not None and not PER_SOURCE_SUFFIX.search(name)
+        stage = StageStats(name, element, self._source_key if shared else None)
+        sink_pad.add_probe(Gst.PadProbeType.BUFFER, stage.on_enter)
+        src_pad.add_probe(Gst.PadProbeType.BUFFER, stage.on_leave)
+        if stage.is_queue:
+            element.connect("overrun", stage.on_overrun)
+        self.stages[stage.name] = stage
+
+    def start(self, summary_interval=10):
+        """
+        Starts sampling queue levels and, if summary_interval is set, printing a periodic summary.
+        Needs a running GLib main loop.
+        """
+        GLib.timeout_add(self._sample_interval_ms, self._sample)
+        if summary_interval:
+            GLib.timeout_add_seconds(summary_interval, self.print_summary)
+
+    def _sample(self):
+        for stage in self.stages.values():
+            if stage.is_queue:
+                stage.sample_level()
+        return True
+
+    def snapshot(self):
+        """
+        Returns a dict of stage name to statistics since the instrumentation was attached.
+        """
+        return {name: stage.snapshot() for name, stage in self.stages.items()}
+
+    def format_summary(self):
+        lines = [f"{'stage':<28}{'count':>8}{'mean ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'queue':>12}{'drops':>8}"]
+        for name, stats in self.snapshot().items():
+            queue = ""
+            drops = ""
+            if 'level_mean' in stats:
+                queue = f"{stats['level_mean']:.1f}/{stats['max_size_buffers']}"
+                drops = str(stats['dropped'])
+            lines.append(
+                f"{name:<28}{stats['count']:>8}{stats['mean_ms']:>10.2f}{stats['p95_ms']:>10.2f}"
+                f"{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}{queue:>12}{drops:>8}"
+            )
+        return "\n".join(lines)
+
+    def print_summary(self):
+        print(f"Pipeline stages after {time.monotonic() - self._started:.0f} s:")
+        print(self.format_summary())
+        return True
@@ -0,0 +1,541 @@
+import argparse
+import math
+import queue
+import threading
+import time
+from dataclasses import dataclass
+import numpy as np
+
+# -----------------------------------------------------------------------------------------------
+# Closed-loop night-sky exposure
+# -----------------------------------------------------------------------------------------------
+# The camera's auto exposure meters the whole frame, so at dusk and under moonlight foreground
+# lights crush the sky to black or a dark horizon blows it out. The controller meters the sky only:
+# - a pad probe takes a luma histogram of every Nth pixel of the sky region at most once per
+#   sample_interval; every other frame costs a clock check
+# - the metered percentile of the histogram is compared with the target in stops. Inside the
+#   deadband nothing happens; outside it the error has to persist for `confirm` samples before
+#   acting, and after an adjustment samples are ignored for settle_time while the sensor catches up
+# - corrections move along an exposure ladder: exposure time first, then gain, then gamma from
+#   the value the camera was configured with. The camera's auto exposure meters the first sampled
+#   frame and the controller takes over in manual mode from the exposure it picked
+# - a worker thread writes the changed controls through UVCCamera.apply_settings (one
+#   VIDIOC_S_EXT_CTRLS). Only the newest pending adjustment is kept, so the streaming thread never
+#   waits on USB and a slow write never leaves stale adjustments queued behind it
+
+# ITU-R BT.601 luma weights scaled to 8 bits, applied in integer math
+LUMA_WEIGHTS = np.array([77, 150, 29], dtype=np.uint16)
+# Luma at and above which a sky pixel counts as clipped
+CLIPPED_LUMA = 250
+
+
+def sky_histogram(frame, roi=(0.0, 0.0, 1.0, 1.0), downsample=8):
+    """
+    256-bin luma histogram of the sky region from every Nth pixel in both directions.
+
+    Args:
+        frame: RGB (H, W, 3), YUYV (H, W, 2) or gray (H, W) array, or a tuple of planes whose first
+            is luma (NV12).
+        roi (tuple): (x0, y0, x1, y1) of the sky region as fractions of the frame.
+        downsample (int): Pixel step.
+
+    Returns:
+        np.ndarray: (256,) pixel fractions.
+    """
+    if isinstance(frame, tuple):
+        frame = frame[0]
+    height, width = frame.shape[:2]
+    x0, y0, x1, y1 = roi
+    small = frame[int(y0 * height):int(y1 * height):downsample, int(x0 * width):int(x1 * width):downsample]
+    if small.ndim == 2:
+        luma = small
+    elif small.shape[2] == 2:
+        luma = small[..., 0]
+    else:
+        luma = small[..., :3] @ LUMA_WEIGHTS >> 8
+    histogram = np.bincount(luma.ravel(), minlength=256).astype(np.float32)
+    return histogram / max(histogram.sum(), 1.0)
+
+
+def histogram_percentile(histogram, percentile):
+    return int(np.searchsorted(np.cumsum(histogram), percentile / 100.0))
+
+
+@dataclass
+class LadderStep:
+    """
+    One control of the exposure ladder, moving from start to end over `stops` of brightness.
+    """
+    key: str
+    start: int
+    end: int
+    stops: float
+    logarithmic: bool = False
+
+    def value(self, level):
+        fraction = min(max(level / self.stops, 0.0), 1.0)
+        if self.logarithmic:
+            return round(self.start * (self.end / self.start) ** fraction)
+        return round(self.start + (self.end - self.start) * fraction)
+
+    def level(self, value):
+        if self.start == self.end:
+            return 0.0
+        if self.logarithmic:
+            fraction = math.log(max(value, 1) / self.start) / math.log(self.end / self.start)
+        else:
+            fraction = (value - self.start) / (self.end - self.start)
+        return min(max(fraction, 0.0), 1.0) * self.stops
+
+
+class ExposureLadder:
+    """
+    Maps one brightness level in stops to control values, filling the steps in order.
+    """
+    def __init__(self, steps):
+        self.steps = [step for step in steps if step.stops > 0]
+        self.stops = sum(step.stops for step in self.steps)
+
+    @classmethod
+    def from_controls(cls, controls, max_exposure=None, gain_stops=4.0, gamma_stops=1.0, max_gamma=None,
+                      current_gamma=None):
+        """
+        Builds the ladder from the ControlInfo of a camera, by control key.
+
+        Exposure runs from the shortest time to max_exposure (longer blurs moving objects), gain
+        over its full range and gamma from its configured value (the device default unless given)
+        to max_gamma, 1.5x the configured value unless given. Gamma lifts a dark sky far more than
+        a bright one, so its range is kept short.
+        """
+        steps = []
+        exposure = controls['exposure_time_absolute']
+        longest = min(max_exposure or exposure.maximum, exposure.maximum)
+        shortest = max(exposure.minimum, 1)
+        steps.append(LadderStep(exposure.key, shortest, longest, math.log2(longest / shortest), logarithmic=True))
+        gain = controls.get('gain')
+        if gain is not None:
+            steps.append(LadderStep(gain.key, gain.minimum, gain.maximum, gain_stops))
+        gamma = controls.get('gamma')
+        if gamma is not None:
+            lowest = gamma.default_value if current_gamma is None else current_gamma
+            highest = min(max_gamma or lowest * 3 // 2, gamma.maximum)
+            # A gamma already at its maximum has nothing left to lift
+            steps.append(LadderStep(gamma.key, lowest, highest, gamma_stops if highest > lowest else 0.0))
+        return cls(steps)
+
+    def settings(self, level):
+        settings = {}
+        for step in self.steps:
+            settings[step.key] = step.value(level)
+            level -= step.stops
+        return settings
+
+    def level(self, values):
+        # Steps fill in order, so a later step only counts once the earlier ones are full
+        level = 0.0
+        for step in self.steps:
+            step_level = step.level(values.get(step.key, step.start))
+            level += step_level
+            if step_level < step.stops:
+                break
+        return level
+
+
+class SkyExposureController:
+    """
+    Keeps the sky at a target brightness by adjusting exposure, gain and gamma with hysteresis.
+
+    Args:
+        camera (UVCCamera): Camera to control; it is switched to manual exposure at the first
+            sampled frame.
+        roi (tuple): (x0, y0, x1, y1) of the sky region as fractions of the frame.
+        target (float): Desired luma (0-255) of the metered percentile.
+        percentile (float): Percentile of the sky histogram that is metered. The median ignores
+            stars, aircraft and the odd street light.
+        max_clipped (float): Fraction of clipped sky pixels that forces a darker step.
+        deadband (float): Error in stops tolerated without adjusting.
+        confirm (int): Consecutive out-of-band samples needed before adjusting.
+        max_step (float): Largest single adjustment in stops.
+        loop_gain (float): Fraction of the error corrected per adjustment; below 1 damps the
+            overshoot of controls that do not scale brightness linearly.
+        sample_interval (float): Seconds between histogram samples.
+        settle_time (float): Seconds after an adjustment during which samples are ignored.
+        downsample (int): Pixel step of the histogram.
+        max_exposure (int, optional): Longest exposure_time_absolute to use, in 100 us units.
+        gain_stops (float): Brightness the full gain range is worth.
+        gamma_stops (float): Brightness the gamma step is worth; 0 leaves gamma alone.
+        threaded (bool): Write settings from a worker thread. The simulation applies inline.
+    """
+    def __init__(self, camera, roi=(0.0, 0.0, 1.0, 1.0), target=60.0, percentile=50.0, max_clipped=0.02,
+                 deadband=0.4, confirm=2, max_step=1.0, loop_gain=0.7, sample_interval=0.5, settle_time=0.5,
+                 downsample=8, max_exposure=None, gain_stops=4.0, gamma_stops=1.0, threaded=True):
+        self.camera = camera
+        self.roi = roi
+        self.target = target
+        self.percentile = percentile
+        self.max_clipped = max_clipped
+        self.deadband = deadband
+        self.confirm = confirm
+        self.max_step = max_step
+        self.loop_gain = loop_gain
+        self.sample_interval = sample_interval
+        self.settle_time = settle_time
+        self.downsample = downsample
+        self.max_exposure = max_exposure
+        self.gain_stops = gain_stops
+        self.gamma_stops = gamma_stops
+        self.threaded = threaded
+        self.ladder = None
+        self.level = 0.0
+        self.settings = {}
+        self.metered = None
+        self.clipped = 0.0
+        self._last_sample = -math.inf
+        self._settle_until = -math.inf
+        self._error_sign = 0
+        self._error_count = 0
+        self._manual = False
+        self._taking_over = False
+        self._pending = queue.Queue(maxsize=1)
+        self._worker = None
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.samples = 0
+        self.adjustments = 0
+        self.superseded = 0
+        self.failures = 0
+        self.at_limit = 0
+        self.total_sample_time = 0.0
+        self.max_sample_time = 0.0
+        self.total_apply_latency = 0.0
+        self.max_apply_latency = 0.0
+
+    def start(self):
+        """
+        Builds the ladder from the camera's controls and starts the worker thread. The gamma step
+        starts at the gamma the camera is configured with. The camera stays in auto exposure until
+        the first frame is sampled, and the controller takes over at the exposure the camera
+        metered for that frame.
+        """
+        controls = {info.key: info for info in self.camera.get_controls()}
+        self.ladder = ExposureLadder.from_controls(
+            controls, self.max_exposure, self.gain_stops, self.gamma_stops,
+            current_gamma=self.camera.get_control_values().get('gamma'),
+        )
+        self._manual = False
+        self._taking_over = False
+        if self.threaded:
+            self._worker = threading.Thread(target=self._run_worker, daemon=True)
+            self._worker.start()
+
+    def stop(self):
+        if self._worker is not None:
+            self._replace_pending(None)
+            self._worker.join()
+            self._worker = None
+
+    def process(self, frame, now=None):
+        """
+        Samples the frame if it is time to and adjusts the exposure when the sky is out of band.
+
+        Args:
+            frame: Frame as accepted by sky_histogram.
+            now (float, optional): Timestamp in seconds, the monotonic clock by default.
+
+        Returns:
+            bool: True if the frame was sampled.
+        """
+        now = time.monotonic() if now is None else now
+        if now - self._last_sample < self.sample_interval or now < self._settle_until:
+            return False
+        if not self._manual:
+            # The camera has metered this frame in auto exposure; switch to manual where it stands
+            if not self._taking_over:
+                self._taking_over = True
+                self._settle_until = now + self.settle_time
+                if self.threaded:
+                    self._replace_pending((None, time.perf_counter()))
+                else:
+                    self._take_over(time.perf_counter())
+            return False
+        self._last_sample = now
+        start = time.perf_counter()
+        histogram = sky_histogram(frame, self.roi, self.downsample)
+        self.metered = histogram_percentile(histogram, self.percentile)
+        self.clipped = float(histogram[CLIPPED_LUMA:].sum())
+        self._update(math.log2(self.target / max(self.metered, 1)), now)
+        elapsed = time.perf_counter() - start
+        self.samples += 1
+        self.total_sample_time += elapsed
+        self.max_sample_time = max(self.max_sample_time, elapsed)
+        return True
+
+    def _update(self, error, now):
+        if self.clipped > self.max_clipped:
+            error = min(error, -2 * self.deadband)
+        if abs(error) <= self.deadband:
+            self._error_sign = 0
+            self._error_count = 0
+            return
+        sign = 1 if error > 0 else -1
+        self._error_count = self._error_count + 1 if sign == self._error_sign else 1
+        self._error_sign = sign
+        if self._error_count < self.confirm:
+            return
+
+        step = min(max(self.loop_gain * error, -self.max_step), self.max_step)
+        level = min(max(self.level + step, 0.0), self.ladder.stops)
+        if level == self.level:
+            # Already at the end of the ladder in this direction
+            self.at_limit += 1
+            return
+        # The level keeps moving when a step is smaller than one unit of the control, so small
+        # corrections add up until they change a value
+        self.level = level
+        settings = self.ladder.settings(level)
+        changed = {key: value for key, value in settings.items() if self.settings.get(key) != value}
+        if not changed:
+            return
+        self.settings = settings
+        self._error_count = 0
+        self._settle_until = now + self.settle_time
+        if self.threaded:
+            self._replace_pending((changed, time.perf_counter()))
+        else:
+            self._apply(changed, time.perf_counter())
+
+    def _replace_pending(self, item):
+        # Keep only the newest adjustment; it carries the complete target of the ladder. Settings of
+        # None take over from auto exposure, which no adjustment can be queued behind
+        while True:
+            try:
+                self._pending.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    dropped = self._pending.get_nowait()
+                except queue.Empty:
+                    continue
+                if dropped is not None:
+                    # The dropped adjustment's controls are still wanted if the newer one does not set them
+                    if item is not None:
+                        item = ({**dropped[0], **item[0]}, dropped[1])
+                    self.superseded += 1
+
+    def _run_worker(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            settings, requested = item
+            if settings is None:
+                self._take_over(requested)
+            else:
+                self._apply(settings, requested)
+
+    def _take_over(self, requested):
+        # Imported here so the detection app only needs python-v4l2 when the controller is used
+        import v4l2
+
+        with self._lock:
+            values = self.camera.get_control_values()
+        level = self.ladder.level(values)
+        self.settings = self.ladder.settings(level)
+        self.level = level
+        self._apply({'auto_exposure': v4l2.V4L2_EXPOSURE_MANUAL, **self.settings}, requested)
+        self._manual = True
+
+    def _apply(self, settings, requested):
+        # verify=False: the next sample shows the effect, and skipping the read-back keeps the
+        # write to a single ioctl
+        with self._lock:
+            result = self.camera.apply_settings(settings, verify=False)
+        latency = time.perf_counter() - requested
+        self.adjustments += 1
+        self.total_apply_latency += latency
+        self.max_apply_latency = max(self.max_apply_latency, latency)
+        if result.failed:
+            self.failures += 1
+            print(f"Sky exposure: failed to set {result.failed}")
+
+    def get_stats(self):
+        return {
+            'samples': self.samples,
+            'adjustments': self.adjustments,
+            'superseded': self.superseded,
+            'failures': self.failures,
+            'at_limit': self.at_limit,
+            'level': self.level,
+            'settings': dict(self.settings),
+            'metered': self.metered,
+            'clipped': self.clipped,
+            'mean_sample_us': self.total_sample_time / max(self.samples, 1) * 1e6,
+            'max_sample_us': self.max_sample_time * 1e6,
+            'mean_apply_ms': self.total_apply_latency / max(self.adjustments, 1) * 1e3,
+            'max_apply_ms': self.max_apply_latency * 1e3,
+        }
+
+    # ---------------------------------------------------------
+    # GStreamer integration
+    # ---------------------------------------------------------
+
+    def attach(self, element):
+        """
+        Samples the frames leaving the element with a buffer probe on its src pad.
+        """
+        # Imported here so the controller and its simulation run without GStreamer
+        from gi.repository import Gst
+        from hailo_rpi_common import get_caps_from_pad, get_numpy_view_from_buffer
+
+        def probe_callback(pad, info):
+            buffer = info.get_buffer()
+            if buffer is None:
+                return Gst.PadProbeReturn.OK
+            now = time.monotonic()
+            if now - self._last_sample < self.sample_interval or now < self._settle_until:
+                return Gst.PadProbeReturn.OK
+            format, width, height = get_caps_from_pad(pad)
+            if format is None:
+                return Gst.PadProbeReturn.OK
+            with get_numpy_view_from_buffer(buffer, format, width, height) as frame:
+                self.process(frame, now)
+            return Gst.PadProbeReturn.OK
+
+        element.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, probe_callback)
+
+    def report(self):
+        stats = self.get_stats()
+        print(
+            f"Sky exposure: level {stats['level']:.1f} stops {stats['settings']}, sky p{self.percentile:.0f} "
+            f"{stats['metered']}, clipped {stats['clipped']:.1%}, {stats['adjustments']} adjustments, "
+            f"sample {stats['mean_sample_us']:.0f} us, apply max {stats['max_apply_ms']:.1f} ms"
+        )
+        self.reset_stats()
+        # Returning True keeps the GLib timeout running
+        return True
+
+
+def parse_roi(text):
+    roi = tuple(float(value) for value in text.split(','))
+    if len(roi) != 4:
+        raise argparse.ArgumentTypeError("expected x0,y0,x1,y1")
+    return roi
+
+
+def add_sky_exposure_arguments(parser):
+    parser.add_argument(
+        "--sky-exposure", action="store_true",
+        help="Control exposure, gain and gamma of a USB camera from the sky brightness"
+    )
+    parser.add_argument("--sky-target", type=float, default=60.0, help="Target median sky luma (0-255)")
+    parser.add_argument(
+        "--sky-roi", type=parse_roi, default=(0.0, 0.0, 1.0, 1.0),
+        help="Sky region as x0,y0,x1,y1 fractions of the frame"
+    )
+    parser.add_argument(
+        "--sky-max-exposure", type=int, default=333,
+        help="Longest exposure in 100 us units, 333 keeps 30 fps"
+    )
+    parser.add_argument("--sky-sample-interval", type=float, default=0.5, help="Seconds between sky samples")
+    parser.add_argument(
+        "--sky-report-interval", type=int, default=30,
+        help="Seconds between sky exposure statistics reports"
+    )
+    return parser
+
+
+def make_sky_scene(width, height, horizon=0.6, rng=None):
+    """
+    Relative radiance of a synthetic scene: a sky brightening towards the horizon with stars,
+    and dark ground with a few bright lights below the horizon.
+
+    Returns:
+        tuple: (sky, lights) arrays; the sky scales with the ambient light, the lights do not.
+    """
+    rng = rng or np.random.default_rng(0)
+    rows = np.linspace(0.0, 1.0, height, dtype=np.float32)[:, None]
+    sky = np.broadcast_to(0.5 + 0.5 * np.minimum(rows / horizon, 1.0), (height, width)).copy()
+    ground = rows[:, 0] >= horizon
+    sky[ground] = 0.1
+    stars = rng.integers(0, [int(horizon * height), width], size=(150, 2))
+    sky[stars[:, 0], stars[:, 1]] *= rng.uniform(2, 10, len(stars))
+    lights = np.zeros((height, width), dtype=np.float32)
+    for x in rng.integers(0, width - 4, 6):
+        y = rng.integers(int(horizon * height) + 2, height - 4)
+        lights[y:y + 3, x:x + 3] = 2.0
+    return sky, lights
+
+
+def simulate(controller, fake, duration, fps, clip=None, width=320, height=240):
+    """
+    Runs a dusk-to-night sequence through the simulated camera: the ambient light falls by 12
+    stops, then moonrise brings back 3. Returns (time, metered luma, clipped fraction) per frame.
+    """
+    sky, lights = make_sky_scene(width, height)
+    capture = None
+    if clip is not None:
+        import cv2
+        capture = cv2.VideoCapture(clip)
+    trace = []
+    for index in range(int(duration * fps)):
+        t = index / fps
+        ambient_stops = -12.0 * min(t / (0.7 * duration), 1.0) + 3.0 * max(t / duration - 0.8, 0.0) / 0.2
+        ambient = 0.02 * 2.0 ** ambient_stops
+        if capture is not None:
+            ret, frame = capture.read()
+            if not ret:
+                capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ret, frame = capture.read()
+            scene = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (width, height)).astype(np.float32) / 255.0 * ambient
+        else:
+            scene = sky * ambient + lights
+        frame = fake.expose(scene)
+        if controller is not None:
+            controller.process(frame, now=t)
+        histogram = sky_histogram(frame, (0.0, 0.0, 1.0, 0.55), downsample=2)
+        trace.append((t, histogram_percentile(histogram, 50), float(histogram[CLIPPED_LUMA:].sum())))
+    if capture is not None:
+        capture.release()
+    return trace
+
+
+if __name__ == "__main__":
+    # Validation against the simulated camera of fake_v4l2.py, no hardware required
+    from fake_v4l2 import FakeV4L2Device
+    from uvccamconfig import UVCCamera
+
+    parser = argparse.ArgumentParser(description="Simulate the sky exposure controller over dusk and moonrise")
+    parser.add_argument("--clip", default=None, help="Recorded clip used as the scene instead of a synthetic sky")
+    parser.add_argument("--duration", type=float, default=600.0, help="Simulated seconds")
+    parser.add_argument("--fps", type=float, default=10.0)
+    parser.add_argument("--latency-ms", type=float, default=0.2, help="Simulated time per ioctl")
+    add_sky_exposure_arguments(parser)
+    args = parser.parse_args()
+
+    # The top of the frame is sky in the synthetic scene
+    roi = args.sky_roi if args.sky_roi != (0.0, 0.0, 1.0, 1.0) else (0.0, 0.0, 1.0, 0.55)
+    results = {}
+    for mode in ("camera auto exposure", "sky controller"):
+        fake = FakeV4L2Device(latency=args.latency_ms / 1e3)
+        camera = UVCCamera(ioctl=fake.ioctl)
+        controller = None
+        if mode == "sky controller":
+            controller = SkyExposureController(
+                camera, roi=roi, target=args.sky_target, sample_interval=args.sky_sample_interval,
+                max_exposure=args.sky_max_exposure, threaded=False,
+            )
+            controller.start()
+        trace = np.array(simulate(controller, fake, args.duration, args.fps, args.clip))
+        in_band = np.abs(np.log2(np.maximum(trace[:, 1], 1) / args.sky_target)) <= 1.0
+        print(f"{mode}: sky within 1 stop of target {in_band.mean():.0%} of the time, "
+              f"crushed (p50 < 8) {(trace[:, 1] < 8).mean():.0%}, clipped {trace[:, 2].mean():.1%}")
+        for t, metered, clipped in trace[::int(args.duration * args.fps / 10)]:
+            print(f"  t={t:5.0f}s sky p50 {metered:5.0f} clipped {clipped:.1%}")
+        if controller is not None:
+            stats = controller.get_stats()
+            print(f"  {stats['samples']} samples ({stats['mean_sample_us']:.0f} us mean), "
+                  f"{stats['adjustments']} adjustments, apply {stats['mean_apply_ms']:.2f} ms mean "
+                  f"{stats['max_apply_ms']:.2f} ms max, {stats['at_limit']} at the ladder limit, "
+                  f"final {stats['settings']}")
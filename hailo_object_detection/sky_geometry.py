@@ -0,0 +1,470 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass, asdict
+from typing import Optional
+import numpy as np
+
+# -----------------------------------------------------------------------------------------------
+# Per-pixel sky geometry
+# -----------------------------------------------------------------------------------------------
+# observable_space/observableSpace.py works out how far an observer a few feet above a spherical
+# earth can see and at which angle below the horizontal the ground blocks the view. This module
+# applies the same geometry to every pixel of a camera with a known mount height, field of view
+# and pointing, once, into float32 lookup tables:
+# - elevation: degrees above the horizontal of the ray through the pixel centre
+# - azimuth: compass bearing of that ray in degrees, clockwise from north
+# - los_range: metres along the ray until it meets the ground or, for rays above the
+#   observer's horizon, the ceiling altitude; no object below the ceiling can be farther away
+# The camera is a pinhole (no lens distortion). The tables are cached on disk under a hash of the
+# camera geometry, so startup is a file load instead of the trigonometry.
+#
+# describe() turns a whole batch of normalized boxes into bearings, angular sizes and range
+# bounds with array operations only. The range bounds come from the angular size and a prior on
+# the physical size of the object, capped by the line of sight.
+#
+# The same tables tell which part of the frame can contain sky at all. find_sky_crop() keeps the
+# rectangle of pixels above the horizon (the observer's own horizon, or a higher local one such as
+# a tree line) that are not covered by an optional static obstruction mask. SKY_CROP() crops the
+# capture to it before scaling and conversion, so the converters touch fewer pixels and the
+# network input holds more sky. SkyCrop.to_full_frame() maps detections back to the full frame.
+
+EARTH_RADIUS = 6371000.0  # metres
+# Bump when the table layout or the maths change so stale caches are not loaded
+LUT_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.expanduser("~/.cache/ufo_detector/sky_geometry")
+
+
+def horizon_dip(mount_height):
+    """
+    Degrees below the horizontal at which the ground starts to block the view.
+    """
+    return np.degrees(np.arccos(EARTH_RADIUS / (EARTH_RADIUS + mount_height)))
+
+
+def ray_range(elevation, mount_height, ceiling):
+    """
+    Distance along rays at the given elevations (degrees) to the ground, or to the ceiling
+    altitude for rays that clear the ground.
+    """
+    sin_e = np.sin(np.radians(elevation, dtype=np.float64))
+    r0 = EARTH_RADIUS + mount_height
+    # |P0 + t * d| = R on the vertical plane of the ray, nearest positive root
+    ground_disc = r0 * r0 * sin_e * sin_e - (r0 * r0 - EARTH_RADIUS * EARTH_RADIUS)
+    hits_ground = (sin_e < 0) & (ground_disc >= 0)
+    ground = -r0 * sin_e - np.sqrt(np.maximum(ground_disc, 0.0))
+    top = EARTH_RADIUS + max(ceiling, mount_height)
+    sky = -r0 * sin_e + np.sqrt(r0 * r0 * sin_e * sin_e + top * top - r0 * r0)
+    return np.where(hits_ground, ground, sky)
+
+
+@dataclass
+class CameraGeometry:
+    """
+    Mount and optics of a camera.
+
+    Args:
+        width, height (int): Frame size in pixels.
+        hfov (float): Horizontal field of view in degrees, used when fx is not given.
+        vfov (float, optional): Vertical field of view; square pixels when not given.
+        fx, fy, cx, cy (float, optional): Pinhole intrinsics in pixels, override the fields of view.
+        azimuth (float): Compass bearing of the optical axis, degrees clockwise from north.
+        elevation (float): Angle of the optical axis above the horizontal in degrees.
+        roll (float): Rotation of the image about the optical axis in degrees.
+        mount_height (float): Height of the camera above the ground in metres.
+        ceiling (float): Highest altitude in metres an object is assumed to fly at.
+    """
+    width: int
+    height: int
+    hfov: float = 62.2
+    vfov: Optional[float] = None
+    fx: Optional[float] = None
+    fy: Optional[float] = None
+    cx: Optional[float] = None
+    cy: Optional[float] = None
+    azimuth: float = 0.0
+    elevation: float = 0.0
+    roll: float = 0.0
+    mount_height: float = 1.83
+    ceiling: float = 20000.0
+
+    def intrinsics(self):
+        fx = self.fx if self.fx is not None else self.width / 2 / np.tan(np.radians(self.hfov) / 2)
+        if self.fy is not None:
+            fy = self.fy
+        elif self.vfov is not None:
+            fy = self.height / 2 / np.tan(np.radians(self.vfov) / 2)
+        else:
+            fy = fx
+        cx = self.cx if self.cx is not None else self.width / 2
+        cy = self.cy if self.cy is not None else self.height / 2
+        return float(fx), float(fy), float(cx), float(cy)
+
+    def rotation(self):
+        """
+        Columns are the camera right, down and forward axes in east, north, up coordinates.
+        """
+        az, el, roll = np.radians([self.azimuth, self.elevation, self.roll])
+        forward = np.array([np.sin(az) * np.cos(el), np.cos(az) * np.cos(el), np.sin(el)])
+        right = np.array([np.cos(az), -np.sin(az), 0.0])
+        down = np.cross(forward, right)
+        right, down = right * np.cos(roll) + down * np.sin(roll), down * np.cos(roll) - right * np.sin(roll)
+        return np.stack([right, down, forward], axis=1)
+
+    def cache_key(self):
+        config = json.dumps({'version': LUT_VERSION, **asdict(self)}, sort_keys=True)
+        return hashlib.sha1(config.encode()).hexdigest()[:16]
+
+
+@dataclass
+class BoxGeometry:
+    """
+    Geometry of a batch of boxes, every attribute an (N,) float32 array.
+
+    Attributes:
+        bearing, elevation: Direction of the box centre in degrees.
+        angular_width, angular_height: Angles subtended by the box in degrees.
+        angular_size: The larger of the two.
+        range_min, range_max: Distance bounds in metres.
+    """
+    bearing: np.ndarray
+    elevation: np.ndarray
+    angular_width: np.ndarray
+    angular_height: np.ndarray
+    angular_size: np.ndarray
+    range_min: np.ndarray
+    range_max: np.ndarray
+
+    def __len__(self):
+        return len(self.bearing)
+
+
+class SkyGeometry:
+    """
+    Per-pixel lookup tables of a camera and the batch conversions built on them.
+
+    Args:
+        camera (CameraGeometry): Mount and optics.
+        object_size (tuple): Smallest and largest physical object size in metres, the prior the
+            range bounds are derived from.
+        cache_dir (str, optional): Where the tables are cached, None to always compute them.
+    """
+    def __init__(self, camera, object_size=(0.3, 50.0), cache_dir=DEFAULT_CACHE_DIR):
+        self.camera = camera
+        self.object_size = object_size
+        self.fx, self.fy, self.cx, self.cy = camera.intrinsics()
+        self.loaded_from_cache = False
+        tables = self._load(cache_dir) if cache_dir else None
+        if tables is None:
+            tables = self.compute_tables()
+            if cache_dir:
+                self._save(cache_dir, tables)
+        else:
+            self.loaded_from_cache = True
+        self.elevation = tables['elevation']
+        self.azimuth = tables['azimuth']
+        self.los_range = tables['los_range']
+
+    def camera_rays(self, x, y):
+        """
+        Unit rays in camera coordinates through pixel positions x, y (arrays of equal shape).
+        """
+        rays = np.stack([(x - self.cx) / self.fx, (y - self.cy) / self.fy, np.ones_like(x)], axis=-1)
+        rays /= np.linalg.norm(rays, axis=-1, keepdims=True)
+        return rays
+
+    def world_rays(self, x, y):
+        """
+        Unit rays in east, north, up coordinates.
+        """
+        return self.camera_rays(x, y) @ self.camera.rotation().T
+
+    def compute_tables(self):
+        camera = self.camera
+        # Pixel centres
+        y, x = np.mgrid[0:camera.height, 0:camera.width].astype(np.float64) + 0.5
+        rays = self.world_rays(x, y)
+        elevation = np.degrees(np.arcsin(np.clip(rays[..., 2], -1.0, 1.0)))
+        azimuth = np.degrees(np.arctan2(rays[..., 0], rays[..., 1])) % 360.0
+        los_range = ray_range(elevation, camera.mount_height, camera.ceiling)
+        return {
+            'elevation': elevation.astype(np.float32),
+            'azimuth': azimuth.astype(np.float32),
+            'los_range': los_range.astype(np.float32),
+        }
+
+    def _cache_path(self, cache_dir):
+        return os.path.join(cache_dir, f"sky_geometry_{self.camera.cache_key()}.npz")
+
+    def _load(self, cache_dir):
+        path = self._cache_path(cache_dir)
+        try:
+            with np.load(path) as data:
+                tables = {name: data[name] for name in ('elevation', 'azimuth', 'los_range')}
+        except (OSError, KeyError, ValueError):
+            return None
+        shape = (self.camera.height, self.camera.width)
+        if any(table.shape != shape or table.dtype != np.float32 for table in tables.values()):
+            return None
+        return tables
+
+    def _save(self, cache_dir, tables):
+        path = self._cache_path(cache_dir)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # Written next to the cache and renamed so a reader never sees a partial file
+            temporary = f"{path}.{os.getpid()}.tmp"
+            with open(temporary, "wb") as f:
+                np.savez(f, **tables)
+            os.replace(temporary, path)
+        except OSError as e:
+            print(f"Could not cache the sky geometry in {cache_dir}: {e}")
+
+    def lookup(self, table, x, y):
+        """
+        Values of a table at pixel positions, clamped to the frame.
+        """
+        ix = np.clip(x.astype(np.int32), 0, self.camera.width - 1)
+        iy = np.clip(y.astype(np.int32), 0, self.camera.height - 1)
+        return table[iy, ix]
+
+    def describe(self, boxes):
+        """
+        Converts boxes to their direction, angular size and range bounds.
+
+        Args:
+            boxes (np.ndarray): (N, 4) normalized xmin, ymin, xmax, ymax, as in DetectionBatch.
+
+        Returns:
+            BoxGeometry
+        """
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        scale = np.array([self.camera.width, self.camera.height] * 2, dtype=np.float32)
+        x1, y1, x2, y2 = (boxes * scale).T
+        xc = (x1 + x2) * 0.5
+        yc = (y1 + y2) * 0.5
+        # Angles between the rays through opposite edges, measured at the box centre
+        u1, u2, uc = (x1 - self.cx) / self.fx, (x2 - self.cx) / self.fx, (xc - self.cx) / self.fx
+        v1, v2, vc = (y1 - self.cy) / self.fy, (y2 - self.cy) / self.fy, (yc - self.cy) / self.fy
+        angular_width = _angle_between(u1, vc, u2, vc)
+        angular_height = _angle_between(uc, v1, uc, v2)
+        angular_size = np.maximum(angular_width, angular_height)
+
+        los_range = self.lookup(self.los_range, xc, yc)
+        # An object of size s subtending angle a is s / (2 tan(a / 2)) away
+        extent = 2.0 * np.tan(np.maximum(angular_size, 1e-9) * 0.5)
+        range_max = np.minimum(self.object_size[1] / extent, los_range)
+        range_min = np.minimum(self.object_size[0] / extent, range_max)
+        return BoxGeometry(
+            bearing=self.lookup(self.azimuth, xc, yc),
+            elevation=self.lookup(self.elevation, xc, yc),
+            angular_width=np.degrees(angular_width).astype(np.float32),
+            angular_height=np.degrees(angular_height).astype(np.float32),
+            angular_size=np.degrees(angular_size).astype(np.float32),
+            range_min=range_min.astype(np.float32),
+            range_max=range_max.astype(np.float32),
+        )
+
+
+def _angle_between(u1, v1, u2, v2):
+    # Angle between the rays (u1, v1, 1) and (u2, v2, 1) in normalized image coordinates. atan2 of
+    # |a x b| and a . b needs no normalization and stays accurate for the tiny angles of distant
+    # objects.
+    cross_x = v1 - v2
+    cross_y = u2 - u1
+    cross_z = u1 * v2 - v1 * u2
+    cross = np.sqrt(cross_x * cross_x + cross_y * cross_y + cross_z * cross_z)
+    return np.arctan2(cross, u1 * u2 + v1 * v2 + 1.0)
+
+
+@dataclass
+class SkyCrop:
+    """
+    Rectangle of a frame that is kept, in pixels.
+    """
+    frame_width: int
+    frame_height: int
+    left: int
+    top: int
+    width: int
+    height: int
+
+    @property
+    def fraction(self):
+        return self.width * self.height / (self.frame_width * self.frame_height)
+
+    def to_full_frame(self, boxes):
+        """
+        Maps (N, 4) normalized boxes of the cropped frame to normalized full-frame boxes.
+        """
+        scale = np.array([self.width / self.frame_width, self.height / self.frame_height] * 2, dtype=np.float32)
+        offset = np.array([self.left / self.frame_width, self.top / self.frame_height] * 2, dtype=np.float32)
+        return np.asarray(boxes, dtype=np.float32) * scale + offset
+
+
+def find_sky_crop(geometry, horizon_elevation=None, obstruction=None, min_fraction=0.02, align=2):
+    """
+    Finds the rectangle that holds the usable sky of a camera.
+
+    Args:
+        geometry (SkyGeometry): Tables of the camera.
+        horizon_elevation (float, optional): Lowest usable elevation in degrees, the observer's
+            horizon by default.
+        obstruction (np.ndarray, optional): (height, width) bool mask of static obstructions.
+        min_fraction (float): Rows and columns with less usable sky than this are cropped away.
+        align (int): Crop edges are multiples of this, 2 keeps subsampled formats intact.
+
+    Returns:
+        SkyCrop, or None if no part of the frame is sky.
+    """
+    camera = geometry.camera
+    if horizon_elevation is None:
+        horizon_elevation = -horizon_dip(camera.mount_height)
+    usable = geometry.elevation >= horizon_elevation
+    if obstruction is not None:
+        usable &= ~obstruction
+    rows = np.flatnonzero(usable.mean(axis=1) >= min_fraction)
+    if len(rows) == 0:
+        return None
+    columns = np.flatnonzero(usable[rows[0]:rows[-1] + 1].mean(axis=0) >= min_fraction)
+    if len(columns) == 0:
+        return None
+    left = columns[0] // align * align
+    top = rows[0] // align * align
+    right = min(-(-(columns[-1] + 1) // align) * align, camera.width)
+    bottom = min(-(-(rows[-1] + 1) // align) * align, camera.height)
+    return SkyCrop(camera.width, camera.height, int(left), int(top), int(right - left), int(bottom - top))
+
+
+def load_obstruction_mask(path, width, height):
+    """
+    Reads an obstruction mask image, white where the view is blocked, at the frame size.
+    """
+    import cv2
+    image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise OSError(f"Could not read the obstruction mask {path}")
+    if image.shape != (height, width):
+        image = cv2.resize(image, (width, height), interpolation=cv2.INTER_NEAREST)
+    return image >= 128
+
+
+def SKY_CROP(crop, name="sky_crop"):
+    if crop is None:
+        return ""
+    right = crop.frame_width - crop.left - crop.width
+    bottom = crop.frame_height - crop.top - crop.height
+    return f"videocrop name={name} left={crop.left} right={right} top={crop.top} bottom={bottom} ! "
+
+
+def add_sky_geometry_arguments(parser):
+    parser.add_argument(
+        "--sky-geometry", action="store_true",
+        help="Report bearing, elevation and range bounds of the detections from the camera mount"
+    )
+    parser.add_argument("--camera-azimuth", type=float, default=0.0, help="Compass bearing of the camera in degrees")
+    parser.add_argument("--camera-elevation", type=float, default=0.0, help="Camera elevation above the horizontal in degrees")
+    parser.add_argument("--camera-roll", type=float, default=0.0, help="Camera roll about the optical axis in degrees")
+    parser.add_argument("--camera-hfov", type=float, default=62.2, help="Horizontal field of view in degrees")
+    parser.add_argument("--camera-vfov", type=float, default=None, help="Vertical field of view in degrees, square pixels by default")
+    parser.add_argument("--mount-height", type=float, default=1.83, help="Camera height above the ground in metres")
+    parser.add_argument(
+        "--sky-crop", action="store_true",
+        help="Crop the camera frames to the sky above the horizon before scaling and inference"
+    )
+    parser.add_argument(
+        "--horizon-elevation", type=float, default=None,
+        help="Lowest usable elevation in degrees, for a tree line or buildings; the observer's horizon by default"
+    )
+    parser.add_argument(
+        "--obstruction-mask", default=None,
+        help="Image of the camera view, white where static obstructions block the sky"
+    )
+    return parser
+
+
+def camera_geometry_from_args(args, width, height):
+    return CameraGeometry(
+        width=width, height=height, hfov=args.camera_hfov, vfov=args.camera_vfov,
+        azimuth=args.camera_azimuth, elevation=args.camera_elevation, roll=args.camera_roll,
+        mount_height=args.mount_height,
+    )
+
+
+if __name__ == "__main__":
+    # Builds the tables for a camera, loads them again from the cache and compares the batch
+    # conversion with the same trigonometry done per detection in Python
+    import math
+
+    parser = argparse.ArgumentParser(description="Build and benchmark the per-pixel sky geometry tables")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--detections", type=int, default=30, help="Detections per frame")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    add_sky_geometry_arguments(parser)
+    args = parser.parse_args()
+
+    camera = camera_geometry_from_args(args, args.width, args.height)
+    start = time.perf_counter()
+    geometry = SkyGeometry(camera, cache_dir=None)
+    compute_time = time.perf_counter() - start
+    geometry = SkyGeometry(camera, cache_dir=args.cache_dir)
+    start = time.perf_counter()
+    geometry = SkyGeometry(camera, cache_dir=args.cache_dir)
+    load_time = time.perf_counter() - start
+    size = sum(table.nbytes for table in (geometry.elevation, geometry.azimuth, geometry.los_range))
+    print(f"Tables {args.width}x{args.height}: {size / 2**20:.1f} MiB, computed in {compute_time * 1e3:.0f} ms, "
+          f"loaded from cache in {load_time * 1e3:.1f} ms")
+    print(f"Horizon dip at {args.mount_height} m: {horizon_dip(args.mount_height):.3f} deg, "
+          f"frame elevation {geometry.elevation.min():.1f} to {geometry.elevation.max():.1f} deg")
+    obstruction = load_obstruction_mask(args.obstruction_mask, args.width, args.height) if args.obstruction_mask else None
+    crop = find_sky_crop(geometry, args.horizon_elevation, obstruction)
+    if crop is None:
+        print("No sky in view")
+    else:
+        print(f"Sky crop {crop.width}x{crop.height}+{crop.left}+{crop.top}, {crop.fraction:.0%} of the pixels: {SKY_CROP(crop)}")
+
+    rng = np.random.default_rng(0)
+    batches = []
+    for _ in range(args.frames):
+        corner = rng.uniform(0.0, 0.95, (args.detections, 2))
+        extent = rng.uniform(0.002, 0.05, (args.detections, 2))
+        batches.append(np.hstack([corner, np.minimum(corner + extent, 1.0)]).astype(np.float32))
+
+    start = time.perf_counter()
+    for boxes in batches:
+        geometry.describe(boxes)
+    batch_time = (time.perf_counter() - start) / args.frames
+
+    fx, fy, cx, cy = camera.intrinsics()
+    rotation = camera.rotation()
+
+    def describe_one(box):
+        # Reference: the same conversion for one detection with the math module
+        def ray(x, y):
+            v = ((x - cx) / fx, (y - cy) / fy, 1.0)
+            n = math.sqrt(sum(c * c for c in v))
+            return [c / n for c in v]
+        x1, y1, x2, y2 = box[0] * camera.width, box[1] * camera.height, box[2] * camera.width, box[3] * camera.height
+        xc, yc = (x1 + x2) / 2, (y1 + y2) / 2
+        centre = ray(xc, yc)
+        world = [sum(rotation[row][col] * centre[col] for col in range(3)) for row in range(3)]
+        bearing = math.degrees(math.atan2(world[0], world[1])) % 360.0
+        elevation = math.degrees(math.asin(world[2]))
+        width = math.acos(min(1.0, sum(a * b for a, b in zip(ray(x1, yc), ray(x2, yc)))))
+        height = math.acos(min(1.0, sum(a * b for a, b in zip(ray(xc, y1), ray(xc, y2)))))
+        los = float(ray_range(elevation, camera.mount_height, camera.ceiling))
+        extent = 2 * math.tan(max(width, height, 1e-9) / 2)
+        return bearing, elevation, min(0.3 / extent, los), min(50.0 / extent, los)
+
+    start = time.perf_counter()
+    for boxes in batches:
+        for box in boxes.tolist():
+            describe_one(box)
+    loop_time = (time.perf_counter() - start) / args.frames
+
+    print(f"{args.detections} detections per frame: batch {batch_time * 1e6:.0f} us, "
+          f"per detection loop {loop_time * 1e6:.0f} us ({loop_time / batch_time:.1f}x)")
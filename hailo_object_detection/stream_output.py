@@ -0,0 +1,346 @@
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstVideo', '1.0')
+from gi.repository import Gst, GstVideo, GLib
+import argparse
+import time
+
+# -----------------------------------------------------------------------------------------------
+# Network stream of the encoded output with adaptive bitrate
+# -----------------------------------------------------------------------------------------------
+# The annotated video is encoded once by ENCODER_BRANCH (clip_recorder.py). STREAM_BRANCH hangs
+# off its encoded_t tee and sends RTP/H.264 to any number of UDP receivers through one
+# multiudpsink, so more receivers or the clip recorder cost no extra encode.
+#
+# The encoder sits behind the leaky queue_encoder, so it can never back-pressure detection, but
+# an encoder that cannot keep up still eats the CPU that videoconvert and the callback need.
+# AdaptiveEncoder samples the encoder queue, the stream queue and the system CPU idle time once
+# per interval:
+# - queue drops, a high queue fill or too little CPU headroom cut the bitrate multiplicatively
+#   and stretch the keyframe interval (keyframes are the most expensive frames to encode). Once
+#   both are at their limit, whole frames are dropped before the encoder: every 2nd, then two of
+#   every 3, ... up to max_frame_step
+# - a sustained empty queue with CPU to spare first brings the frames back, then raises the
+#   bitrate additively and brings the keyframe interval back down
+# The encoder is shared with the clip recorder, and lowering the bitrate or stretching the
+# keyframe interval would degrade the recorded clips (and grow their pre-roll) as well. With
+# --record-clips the encoder keeps its settings and dropping frames is the only response, so the
+# clips lose frame rate under CPU pressure but every frame they keep is encoded as configured.
+# x264enc applies bitrate changes while PLAYING; key-int-max cannot change then, so it is set to
+# the longest interval and keyframes are forced with upstream force-key-unit events at the
+# current interval instead.
+#
+# queue_stream does not leak: a leaky queue drops packets in the middle of a GOP and the
+# receivers decode garbage until the next keyframe. Once it is full, AdaptiveEncoder drops the
+# packets up to the next keyframe before they enter it, so receivers see the picture freeze.
+
+
+def STREAM_BRANCH(clients, mtu=1400):
+    """
+    Pipeline fragment that sends the encoded_t tee of ENCODER_BRANCH as RTP over UDP.
+
+    Args:
+        clients (list): "host:port" of every receiver.
+    """
+    return (
+        "encoded_t. ! "
+        "queue name=queue_stream max-size-buffers=30 max-size-bytes=0 max-size-time=0 ! "
+        f"rtph264pay name=stream_pay config-interval=-1 pt=96 mtu={mtu} ! "
+        f"multiudpsink name=stream_sink clients={','.join(clients)} sync=false async=false "
+    )
+
+
+def read_cpu_times(path="/proc/stat"):
+    # (idle, total) jiffies of all CPUs; idle includes iowait
+    with open(path, "r") as f:
+        fields = [int(value) for value in f.readline().split()[1:]]
+    return fields[3] + fields[4], sum(fields)
+
+
+class AdaptiveEncoder:
+    """
+    Adjusts x264enc bitrate, keyframe interval and the frames it encodes from the encoder queue,
+    the stream queue and CPU headroom.
+
+    Args:
+        encoder (Gst.Element): The x264enc.
+        encoder_queue (Gst.Element): The leaky queue in front of it.
+        stream_queue (Gst.Element, optional): The queue_stream of STREAM_BRANCH; packets are
+            dropped up to the next keyframe when it is full.
+        adapt_encoding (bool): Adapt bitrate and keyframe interval. False keeps the encoder's
+            settings (shared with the clip recorder) and only drops frames.
+        min_bitrate, max_bitrate (int): Bitrate range in kbit/s.
+        min_key_interval, max_key_interval (int): Keyframe interval range in frames.
+        max_frame_step (int): Most frames per encoded frame when dropping frames.
+        min_cpu_idle (float): CPU idle fraction below which the stream is degraded.
+        high_fill, low_fill (float): Queue fill fractions that count as congested and as idle.
+        decrease (float): Bitrate factor applied when congested.
+        increase (int): kbit/s added per recovery step.
+        recover_samples (int): Consecutive idle samples needed before a recovery step.
+        cpu_times (callable): Returns (idle, total) CPU time, /proc/stat by default.
+    """
+    def __init__(self, encoder, encoder_queue, stream_queue=None, adapt_encoding=True, min_bitrate=256,
+                 max_bitrate=4096, min_key_interval=30, max_key_interval=240, max_frame_step=4,
+                 min_cpu_idle=0.15, high_fill=0.6, low_fill=0.2, decrease=0.7, increase=256,
+                 recover_samples=3, cpu_times=read_cpu_times):
+        self.encoder = encoder
+        self.encoder_queue = encoder_queue
+        self.stream_queue = stream_queue
+        self.adapt_encoding = adapt_encoding
+        self.min_bitrate = min_bitrate
+        self.max_bitrate = max_bitrate
+        self.min_key_interval = min_key_interval
+        self.max_key_interval = max_key_interval
+        self.max_frame_step = max(max_frame_step, 1)
+        self.min_cpu_idle = min_cpu_idle
+        self.high_fill = high_fill
+        self.low_fill = low_fill
+        self.decrease = decrease
+        self.increase = increase
+        self.recover_samples = recover_samples
+        self.cpu_times = cpu_times
+
+        if adapt_encoding:
+            self.bitrate = min(max(encoder.get_property("bitrate"), min_bitrate), max_bitrate)
+            self.key_interval = min_key_interval
+        else:
+            self.bitrate = encoder.get_property("bitrate")
+            self.key_interval = encoder.get_property("key-int-max")
+        self.frame_step = 1
+        self.queue_capacity = max(encoder_queue.get_property("max-size-buffers"), 1)
+        self._last_cpu = cpu_times()
+        self._fill_total = 0
+        self._fill_samples = 0
+        self._drops = 0
+        self._packet_drops = 0
+        self._idle_samples = 0
+        self._frames_since_key = 0
+        self._frame_index = 0
+        self._dropping_to_keyframe = False
+        self.cpu_idle = 1.0
+        self.fill = 0.0
+        self.reset_stats()
+
+        if adapt_encoding:
+            # Longest interval as the encoder's own, shorter ones are forced
+            encoder.set_property("key-int-max", max_key_interval)
+            encoder.set_property("bitrate", self.bitrate)
+            encoder.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, self._on_frame)
+        encoder_queue.connect("overrun", self._on_overrun)
+        # Frames are skipped as they leave the queue, before videoconvert spends time on them
+        encoder_queue.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self._on_queued_frame)
+        if stream_queue is not None:
+            self.stream_capacity = max(stream_queue.get_property("max-size-buffers"), 1)
+            stream_queue.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, self._on_packet)
+
+    def reset_stats(self):
+        self.decreases = 0
+        self.increases = 0
+        self.dropped = 0
+        self.skipped = 0
+        self.dropped_packets = 0
+        self.forced_keyframes = 0
+
+    def _on_overrun(self, queue):
+        self._drops += 1
+
+    def _on_queued_frame(self, pad, info):
+        # Queue fill as seen by every frame leaving for the encoder
+        self._fill_total += self.encoder_queue.get_property("current-level-buffers")
+        self._fill_samples += 1
+        self._frame_index += 1
+        if self._frame_index % self.frame_step:
+            self.skipped += 1
+            return Gst.PadProbeReturn.DROP
+        return Gst.PadProbeReturn.OK
+
+    def _on_packet(self, pad, info):
+        # Runs before queue_stream; its only producer is this thread, so a queue seen below
+        # capacity here never blocks the encoder
+        buffer = info.get_buffer()
+        if buffer is None:
+            return Gst.PadProbeReturn.OK
+        full = self.stream_queue.get_property("current-level-buffers") >= self.stream_capacity
+        if self._dropping_to_keyframe:
+            if not full and not buffer.has_flags(Gst.BufferFlags.DELTA_UNIT):
+                self._dropping_to_keyframe = False
+        elif full:
+            self._dropping_to_keyframe = True
+        if self._dropping_to_keyframe:
+            self._packet_drops += 1
+            self.dropped_packets += 1
+            return Gst.PadProbeReturn.DROP
+        return Gst.PadProbeReturn.OK
+
+    def _on_frame(self, pad, info):
+        self._frames_since_key += 1
+        if self._frames_since_key >= self.key_interval:
+            self._frames_since_key = 0
+            self.forced_keyframes += 1
+            event = GstVideo.video_event_new_upstream_force_key_unit(Gst.CLOCK_TIME_NONE, True, 0)
+            self.encoder.get_static_pad("src").send_event(event)
+        return Gst.PadProbeReturn.OK
+
+    def sample(self):
+        """
+        Measures the last interval and adapts the encoder. Returns True to keep a GLib timeout.
+        """
+        idle, total = self.cpu_times()
+        last_idle, last_total = self._last_cpu
+        self._last_cpu = (idle, total)
+        self.cpu_idle = (idle - last_idle) / max(total - last_total, 1)
+        self.fill = self._fill_total / max(self._fill_samples, 1) / self.queue_capacity
+        drops = self._drops
+        packet_drops = self._packet_drops
+        self._fill_total = self._fill_samples = self._drops = self._packet_drops = 0
+        self.dropped += drops
+
+        if drops or packet_drops or self.fill >= self.high_fill or self.cpu_idle < self.min_cpu_idle:
+            self._idle_samples = 0
+            bitrate, key_interval = self.bitrate, self.key_interval
+            if self.adapt_encoding:
+                bitrate = max(int(self.bitrate * self.decrease), self.min_bitrate)
+                key_interval = min(int(self.key_interval * 1.5), self.max_key_interval)
+            if (bitrate, key_interval) != (self.bitrate, self.key_interval):
+                self.decreases += 1
+                self._set(bitrate, key_interval)
+            elif self.frame_step < self.max_frame_step:
+                self.decreases += 1
+                self.frame_step += 1
+        elif self.fill <= self.low_fill and self.cpu_idle >= 2 * self.min_cpu_idle:
+            self._idle_samples += 1
+            if self._idle_samples >= self.recover_samples:
+                self._idle_samples = 0
+                if self.frame_step > 1:
+                    self.increases += 1
+                    self.frame_step -= 1
+                elif self.adapt_encoding:
+                    bitrate = min(self.bitrate + self.increase, self.max_bitrate)
+                    key_interval = max(int(self.key_interval / 1.5), self.min_key_interval)
+                    if (bitrate, key_interval) != (self.bitrate, self.key_interval):
+                        self.increases += 1
+                        self._set(bitrate, key_interval)
+        else:
+            self._idle_samples = 0
+        return True
+
+    def _set(self, bitrate, key_interval):
+        self.bitrate = bitrate
+        self.key_interval = key_interval
+        self.encoder.set_property("bitrate", bitrate)
+
+    def attach(self, interval=1.0):
+        GLib.timeout_add(int(interval * 1000), self.sample)
+
+    def report(self):
+        print(
+            f"Stream: {self.bitrate} kbit/s, keyframe every {self.key_interval} frames, "
+            f"encoding 1 of {self.frame_step} frames, encoder queue {self.fill:.0%}, cpu idle {self.cpu_idle:.0%}, "
+            f"{self.decreases} decreases, {self.increases} increases, {self.dropped} frames dropped, "
+            f"{self.skipped} skipped, {self.dropped_packets} packets dropped to the next keyframe"
+        )
+        self.reset_stats()
+        # Returning True keeps the GLib timeout running
+        return True
+
+
+def _burn_cpu():
+    while True:
+        pass
+
+
+def add_stream_arguments(parser):
+    parser.add_argument(
+        "--stream", nargs="+", default=None, metavar="HOST:PORT",
+        help="Stream the annotated video as RTP/H.264 to these UDP receivers. The bitrate adapts to the "
+             "CPU and encoder queue unless --record-clips shares the encoder, then only the frame rate "
+             "of the encoder (and of the clips) drops under load"
+    )
+    parser.add_argument("--stream-min-bitrate", type=int, default=256, help="Lowest stream bitrate in kbit/s")
+    parser.add_argument("--stream-max-bitrate", type=int, default=4096, help="Highest stream bitrate in kbit/s")
+    parser.add_argument(
+        "--stream-min-cpu-idle", type=float, default=0.15,
+        help="CPU idle fraction below which the stream bitrate is reduced"
+    )
+    parser.add_argument(
+        "--stream-report-interval", type=int, default=10,
+        help="Seconds between stream statistics reports"
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    # Loopback test: encode a test pattern once, stream it to local udpsrc receivers and report
+    # what arrives while the encoder adapts. --burn-cpu adds busy processes to provoke a decrease.
+    import multiprocessing
+    from clip_recorder import ENCODER_BRANCH
+
+    parser = argparse.ArgumentParser(description="Stream a test pattern to local receivers with adaptive bitrate")
+    parser.add_argument("--receivers", type=int, default=2)
+    parser.add_argument("--base-port", type=int, default=5600)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--burn-cpu", type=int, default=0, help="Busy processes to start halfway through")
+    args = parser.parse_args()
+
+    Gst.init(None)
+    ports = [args.base_port + index for index in range(args.receivers)]
+    sender = Gst.parse_launch(
+        "videotestsrc is-live=true pattern=ball ! video/x-raw, width=640, height=640, framerate=30/1 ! "
+        "tee name=overlay_t ! queue ! fakesink sync=false "
+        + ENCODER_BRANCH("overlay_t", clip_sink=False)
+        + STREAM_BRANCH([f"127.0.0.1:{port}" for port in ports])
+    )
+    receivers = []
+    for port in ports:
+        receiver = Gst.parse_launch(
+            f"udpsrc port={port} caps=\"application/x-rtp, media=video, encoding-name=H264, payload=96, clock-rate=90000\" ! "
+            "rtph264depay ! h264parse ! fakesink name=received sync=false"
+        )
+        counts = {'frames': 0, 'bytes': 0}
+
+        def on_buffer(pad, info, counts=counts):
+            counts['frames'] += 1
+            counts['bytes'] += info.get_buffer().get_size()
+            return Gst.PadProbeReturn.OK
+
+        receiver.get_by_name("received").get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, on_buffer)
+        receiver.set_state(Gst.State.PLAYING)
+        receivers.append((port, receiver, counts))
+
+    controller = AdaptiveEncoder(sender.get_by_name("encoder"), sender.get_by_name("queue_encoder"),
+                                 sender.get_by_name("queue_stream"))
+    controller.attach()
+    sender.set_state(Gst.State.PLAYING)
+
+    loop = GLib.MainLoop()
+    burners = []
+    start = time.monotonic()
+
+    def tick():
+        elapsed = time.monotonic() - start
+        if args.burn_cpu and not burners and elapsed > args.duration / 2:
+            print(f"Starting {args.burn_cpu} busy processes")
+            for _ in range(args.burn_cpu):
+                process = multiprocessing.Process(target=_burn_cpu, daemon=True)
+                process.start()
+                burners.append(process)
+        received = ", ".join(
+            f"{port}: {counts['frames']} frames {counts['bytes'] * 8 / max(elapsed, 1e-3) / 1e3:.0f} kbit/s"
+            for port, _, counts in receivers
+        )
+        print(f"t={elapsed:4.0f}s {controller.bitrate} kbit/s key {controller.key_interval}, "
+              f"queue {controller.fill:.0%} cpu idle {controller.cpu_idle:.0%} | {received}")
+        if elapsed >= args.duration:
+            loop.quit()
+            return False
+        return True
+
+    GLib.timeout_add_seconds(2, tick)
+    try:
+        loop.run()
+    finally:
+        for process in burners:
+            process.terminate()
+        sender.set_state(Gst.State.NULL)
+        for _, receiver, _ in receivers:
+            receiver.set_state(Gst.State.NULL)
@@ -0,0 +1,123 @@
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+import numpy as np
+
+# -----------------------------------------------------------------------------------------------
+# Synthetic stand-in for the hailo python module
+# -----------------------------------------------------------------------------------------------
+# Used by the benchmark to run the real callback without a Hailo device. SyntheticDetector is
+# attached to the element that replaces hailofilter and records a set of pseudo-random
+# detections for every buffer PTS; get_roi_from_buffer() hands them back to the callback with
+# the same interface as hailo.HailoROI / hailo.HailoDetection.
+
+HAILO_DETECTION = "HAILO_DETECTION"
+
+LABELS = ("person", "bird", "airplane", "insect", "unknown")
+# Forget detections of buffers that never reached the callback
+MAX_PENDING = 512
+
+_pending = {}
+
+
+class HailoBBox:
+    __slots__ = ('_xmin', '_ymin', '_xmax', '_ymax')
+
+    def __init__(self, xmin, ymin, xmax, ymax):
+        self._xmin, self._ymin, self._xmax, self._ymax = xmin, ymin, xmax, ymax
+
+    def xmin(self):
+        return self._xmin
+
+    def ymin(self):
+        return self._ymin
+
+    def xmax(self):
+        return self._xmax
+
+    def ymax(self):
+        return self._ymax
+
+    def width(self):
+        return self._xmax - self._xmin
+
+    def height(self):
+        return self._ymax - self._ymin
+
+
+class HailoDetection:
+    __slots__ = ('_bbox', '_class_id', '_label', '_confidence')
+
+    def __init__(self, bbox, class_id, label, confidence):
+        self._bbox = bbox
+        self._class_id = class_id
+        self._label = label
+        self._confidence = confidence
+
+    def get_bbox(self):
+        return self._bbox
+
+    def get_class_id(self):
+        return self._class_id
+
+    def get_label(self):
+        return self._label
+
+    def get_confidence(self):
+        return self._confidence
+
+
+class HailoROI:
+    def __init__(self, detections):
+        self._detections = detections
+
+    def get_objects_typed(self, object_type):
+        return self._detections if object_type == HAILO_DETECTION else []
+
+
+def get_roi_from_buffer(buffer):
+    return HailoROI(_pending.pop(buffer.pts, []))
+
+
+class SyntheticDetector:
+    """
+    Attaches pseudo-random detections to every buffer leaving an element.
+
+    Objects drift slowly across the frame so the tracker sees realistic, persistent input.
+
+    Args:
+        objects (int): Number of simulated objects.
+        detection_rate (float): Probability that an object is detected in a given frame.
+        seed (int): Random seed, fixed so runs are comparable.
+    """
+    def __init__(self, objects=10, detection_rate=0.9, seed=0):
+        self.rng = np.random.default_rng(seed)
+        self.detection_rate = detection_rate
+        self.positions = self.rng.uniform(0.1, 0.9, (objects, 2))
+        self.velocities = self.rng.normal(0, 0.002, (objects, 2))
+        self.sizes = self.rng.uniform(0.01, 0.08, objects)
+        self.class_ids = self.rng.integers(0, len(LABELS), objects)
+        self.confidences = self.rng.uniform(0.3, 0.95, objects)
+
+    def attach(self, element):
+        element.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self._on_buffer)
+
+    def next_detections(self):
+        self.positions = (self.positions + self.velocities) % 1.0
+        visible = np.flatnonzero(self.rng.random(len(self.positions)) < self.detection_rate)
+        detections = []
+        for i in visible:
+            half = self.sizes[i] / 2
+            x, y = self.positions[i]
+            bbox = HailoBBox(float(x - half), float(y - half), float(x + half), float(y + half))
+            class_id = int(self.class_ids[i])
+            detections.append(HailoDetection(bbox, class_id, LABELS[class_id], float(self.confidences[i])))
+        return detections
+
+    def _on_buffer(self, pad, info):
+        buffer = info.get_buffer()
+        if buffer is not None:
+            if len(_pending) >= MAX_PENDING:
+                _pending.clear()
+            _pending[buffer.pts] = self.next_detections()
+        return Gst.PadProbeReturn.OK
@@ -1,4 +1,5 @@
 import json
+import time
 from gscam import GStreamerCamera
 
 if __name__ == "__main__":
@@ -27,21 +28,32 @@ if __name__ == "__main__":
     with open('gstreamer_options.json', 'r') as f:
         gstreamer_config = json.load(f)
 
-    # Enable local display by setting the 'display' option to True
+    # Any combination of outputs can run from the one capture
     gstreamer_config['display']['enabled'] = False
 
-    # Disable streaming or appsink for local display
+    # Stream to another machine
     gstreamer_config['stream']['enabled'] = True
     gstreamer_config['stream']['ip'] = "192.168.1.56"  # IP address of the receiving machine
     gstreamer_config['stream']['port'] = 5000  # Port for streaming
-    
+
+    # And hand frames to this process at the same time
+    gstreamer_config['appsink']['enabled'] = True
+
     # Example for local display
     # gstreamer_config['display']['enabled'] = True
 
-    # Example for appsink
-    # gstreamer_config['appsink']['enabled'] = False
-
-    # Configure and run GStreamer pipeline based on the updated configuration
+    # Configure the pipeline and read frames for a few seconds while it streams
     camera.configure_gstreamer(gstreamer_config)
+    camera.start()
+    deadline = time.monotonic() + 10
+    for pts, frame in camera.frames():
+        # frame is a read-only view of the buffer, valid until the next iteration
+        print(f"pts {pts / 1e9:.3f}s mean brightness {frame.mean():.1f}")
+        if time.monotonic() > deadline:
+            break
+    camera.stop()
+
+    print("Branch statistics:")
+    print(json.dumps(camera.get_stats(), indent=4))
 
     camera.close()
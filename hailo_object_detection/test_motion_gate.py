@@ -0,0 +1,86 @@
+import threading
+import time
+import numpy as np
+from motion_gate import MotionGate
+
+
+def sky_frames(count, size=640, seed=0):
+    # Dark sky with sensor noise, as RGB network input frames
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        gray = np.clip(rng.normal(20, 2, (size, size)), 0, 255).astype(np.uint8)
+        yield np.repeat(gray[..., None], 3, axis=2)
+
+
+def test_static_sky_closes_the_gate():
+    gate = MotionGate(keep_alive_interval=0)
+    frames = sky_frames(60)
+    # The first frame starts the background, which then averages out the noise
+    assert gate.process(next(frames))
+    for _, frame in zip(range(19), frames):
+        gate.process(frame)
+    assert not any(gate.process(frame) for frame in frames)
+
+
+def test_moving_2x2_dot_opens_the_gate():
+    gate = MotionGate(keep_alive_interval=0)
+    for frame in sky_frames(20):
+        gate.process(frame)
+    decisions = []
+    for index, frame in enumerate(sky_frames(30, seed=1)):
+        # A dot crossing the frame 3 px per frame, landing on every offset within the 8x8 blocks
+        x, y = 101 + 3 * index, 203 + index
+        frame[y:y + 2, x:x + 2] = 200
+        decisions.append(gate.process(frame))
+    assert all(decisions)
+
+
+def test_block_max_keeps_single_pixels():
+    gate = MotionGate(downsample=8)
+    image = np.zeros((20, 20), dtype=np.uint8)
+    image[13, 6] = 50
+    blocks = gate.block_max(image)
+    # The partial blocks along the edges are left out
+    assert blocks.shape == (2, 2)
+    assert blocks[1, 0] == 50
+    assert np.count_nonzero(blocks) == 1
+
+
+class FakeHailonet:
+    def __init__(self):
+        self.values = []
+
+    def get_property(self, name):
+        return False
+
+    def set_property(self, name, value):
+        self.values.append((name, value, time.monotonic()))
+
+
+def test_pass_through_waits_for_hailonet_to_drain():
+    gate = MotionGate()
+    gate.hailonet = FakeHailonet()
+    gate._in_hailonet = 2
+
+    def infer_batch():
+        time.sleep(0.05)
+        gate.left_hailonet()
+        gate.left_hailonet()
+
+    thread = threading.Thread(target=infer_batch)
+    start = time.monotonic()
+    thread.start()
+    assert gate.set_pass_through(True)
+    thread.join()
+    (name, value, flipped), = gate.hailonet.values
+    assert (name, value) == ("pass-through", True)
+    assert flipped - start >= 0.05
+
+
+def test_pass_through_kept_when_hailonet_does_not_drain():
+    gate = MotionGate(drain_timeout=0.01)
+    gate.hailonet = FakeHailonet()
+    gate._in_hailonet = 1
+    assert not gate.set_pass_through(True)
+    assert gate.hailonet.values == []
+    assert gate.get_stats()['deferred_switches'] == 1
@@ -0,0 +1,72 @@
+import pytest
+import v4l2
+from fake_v4l2 import FakeV4L2Device
+from uvccamconfig import UVCCamera
+
+
+@pytest.fixture
+def fake():
+    # The control metadata is cached per device for the whole process
+    UVCCamera.invalidate_control_cache()
+    yield FakeV4L2Device()
+    UVCCamera.invalidate_control_cache()
+
+
+def test_enumeration_returns_every_control(fake):
+    camera = UVCCamera(ioctl=fake.ioctl)
+    controls = camera.enumerate_controls()
+    expected = [control.id for control in fake.controls.values()
+                if control.type != v4l2.V4L2_CTRL_TYPE_CTRL_CLASS]
+    assert sorted(info.id for info in controls) == sorted(expected)
+    # Controls inactive in the current modes are still listed
+    keys = {info.key for info in controls}
+    assert {'exposure_time_absolute', 'white_balance_temperature'} <= keys
+
+
+def test_menu_names_are_decoded(fake):
+    camera = UVCCamera(ioctl=fake.ioctl)
+    controls = {info.key: info for info in camera.enumerate_controls()}
+    # Only the items the driver answers for, the gaps in the range are left out
+    assert controls['auto_exposure'].menu == {1: "Manual Mode", 3: "Aperture Priority Mode"}
+    assert controls['power_line_frequency'].menu == {0: "Disabled", 1: "50 Hz", 2: "60 Hz"}
+    assert controls['gain'].menu == {}
+
+
+def test_second_snapshot_is_one_ioctl(fake):
+    camera = UVCCamera(ioctl=fake.ioctl)
+    first = camera.get_all_controls()
+    assert first['Gamma']['current_value'] == 100
+    assert fake.calls['VIDIOC_QUERYCTRL'] > len(first)
+    fake.calls.clear()
+    # A second camera on the same device shares the cached metadata
+    second = UVCCamera(ioctl=fake.ioctl).get_all_controls()
+    assert fake.calls == {'VIDIOC_G_EXT_CTRLS': 1}
+    assert second == first
+
+
+def test_apply_settings_drops_the_failing_control(fake):
+    camera = UVCCamera(ioctl=fake.ioctl)
+    camera.get_control_values()
+    # The device now refuses a value the cached range allows, as after a firmware change
+    fake.controls[v4l2.V4L2_CID_GAIN].maximum = 50
+    fake.calls.clear()
+    result = camera.apply_settings({'brightness': 10, 'gain': 80, 'contrast': 40})
+    assert set(result.failed) == {'gain'}
+    assert set(result.changed) == {'brightness', 'contrast'}
+    # The whole request is refused once, then resent without the control error_idx points at
+    assert fake.calls['VIDIOC_S_EXT_CTRLS'] == 2
+    assert fake.values[v4l2.V4L2_CID_BRIGHTNESS] == 10
+    assert fake.values[v4l2.V4L2_CID_CONTRAST] == 40
+    assert fake.values[v4l2.V4L2_CID_GAIN] == 0
+    assert not result.ok
+
+
+def test_apply_settings_orders_dependent_controls(fake):
+    camera = UVCCamera(ioctl=fake.ioctl)
+    result = camera.apply_settings({'exposure_time_absolute': 300, 'auto_exposure': v4l2.V4L2_EXPOSURE_MANUAL})
+    assert result.ok
+    assert fake.values[v4l2.V4L2_CID_EXPOSURE_ABSOLUTE] == 300
+    # Applying the same settings again touches nothing
+    result = camera.apply_settings({'exposure_time_absolute': 300, 'auto_exposure': v4l2.V4L2_EXPOSURE_MANUAL})
+    assert result.ioctls == 0
+    assert result.changed == {}
@@ -0,0 +1,55 @@
+import json
+import numpy as np
+from yolov8_postprocess import DEFAULT_CONFIG, YoloV8PostProcess, batched_nms
+
+
+def cluster_and_separate_object(cluster_size=150):
+    # A dense cluster of heavily overlapping boxes and one separate, lower-scoring box, one class
+    rng = np.random.default_rng(0)
+    offsets = rng.uniform(0, 4, (cluster_size, 2))
+    cluster = np.hstack([100 + offsets, 200 + offsets])
+    boxes = np.vstack([cluster, [[400, 400, 480, 480]]]).astype(np.float32)
+    scores = np.r_[rng.uniform(0.8, 0.95, cluster_size), 0.73].astype(np.float32)
+    return boxes, scores
+
+
+def test_batched_nms_cluster_does_not_fill_the_cap():
+    boxes, scores = cluster_and_separate_object()
+    keep = batched_nms(boxes, scores, np.zeros(len(scores), dtype=np.int64), 0.7, max_per_group=8)
+    assert len(boxes) - 1 in keep
+    assert len(keep) == 2
+
+
+def test_batched_nms_caps_the_survivors():
+    # Ten separate boxes of one group, the best max_per_group of them are kept
+    boxes = np.array([[100 * i, 0, 100 * i + 50, 50] for i in range(10)], dtype=np.float32)
+    scores = np.linspace(0.9, 0.5, 10).astype(np.float32)
+    keep = batched_nms(boxes, scores, np.zeros(10, dtype=np.int64), 0.7, max_per_group=4)
+    assert keep.tolist() == [0, 1, 2, 3]
+
+
+def test_post_process_keeps_separate_object_next_to_dense_cluster(tmp_path):
+    with open(DEFAULT_CONFIG) as f:
+        config = json.load(f)
+    config.update(max_proposals_per_class=8, nms_scores_th=0.5, nms_iou_th=0.45)
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps(config))
+    post_process = YoloV8PostProcess(str(config_path))
+
+    # DFL logits peaked on the last bin give every stride 8 anchor a 240 px box, so the anchors of
+    # the 15x10 block all overlap and leave only a few boxes after NMS
+    outputs = {}
+    for decoder in post_process.decoders:
+        stride = decoder['stride']
+        shape = (1, post_process.image_height // stride, post_process.image_width // stride)
+        regression = np.zeros(shape + (4, post_process.regression_length), np.float32)
+        regression[..., -1] = 20.0
+        outputs[decoder['reg_layer']] = regression.reshape(shape + (-1,))
+        outputs[decoder['cls_layer']] = np.zeros(shape + (post_process.num_classes,), np.float32)
+    scores = outputs[post_process.decoders[0]['cls_layer']]
+    scores[0, 30:40, 30:45, 0] = np.linspace(0.8, 0.95, 150, dtype=np.float32).reshape(10, 15)
+    scores[0, 75, 75, 0] = 0.73
+
+    batch = post_process(outputs)[0]
+    assert np.isclose(batch.confidences, 0.73).any()
+    assert (batch.class_ids == 0).all()
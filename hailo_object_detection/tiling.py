@@ -0,0 +1,178 @@
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+import math
+import time
+from hailo_rpi_common import get_caps_from_pad
+
+# -----------------------------------------------------------------------------------------------
+# Tiled high-resolution inference
+# -----------------------------------------------------------------------------------------------
+# Distant lights and small craft are only a few pixels wide; scaling the full frame down to the
+# network input throws them away. In tiling mode the full-resolution frame goes to
+# hailotilecropper, which cuts it into overlapping tiles of roughly the network input size and
+# sends them through hailonet as one batch. hailotileaggregator maps the tile detections back to
+# full-frame coordinates and merges duplicates along tile borders with NMS.
+#
+# TileScheduler sits on the cropper sink pad. On the first buffer it computes the tile grid
+# from the negotiated frame size, and on every buffer it picks between the tile grid and a
+# single whole-frame tile, so tiles can run every Nth frame to trade resolution for throughput.
+# hailonet's batch size is fixed, so tiling every Nth frame runs every tile as its own batch;
+# the whole-frame tiles in between would otherwise wait for later frames to fill a batch.
+
+
+def compute_tile_grid(frame_width, frame_height, tile_size=640, min_overlap=0.1):
+    """
+    Computes how many tiles of tile_size pixels cover the frame with at least min_overlap.
+
+    Returns:
+        tuple: (tiles_x, tiles_y, overlap_x, overlap_y), overlaps as a fraction of the tile size.
+    """
+    def axis(length):
+        if length <= tile_size:
+            return 1, 0.0
+        step = tile_size * (1.0 - min_overlap)
+        tiles = math.ceil((length - tile_size) / step) + 1
+        overlap = (tiles * tile_size - length) / (tile_size * (tiles - 1))
+        return tiles, round(overlap, 4)
+
+    tiles_x, overlap_x = axis(frame_width)
+    tiles_y, overlap_y = axis(frame_height)
+    return tiles_x, tiles_y, overlap_x, overlap_y
+
+
+def TILE_CROPPER(name="cropper", aggregator="agg", iou_threshold=0.3, border_threshold=0.1):
+    """
+    Pipeline fragment with the cropper (linked from the preceding element) and a standalone
+    aggregator. The first link from the cropper carries the full frame to the aggregator, the
+    second one the tiles through the inference branch. The grid is set at runtime by TileScheduler.
+    """
+    return (
+        f"hailotilecropper name={name} internal-offset=true tiling-mode=0 "
+        "tiles-along-x-axis=1 tiles-along-y-axis=1 overlap-x-axis=0.0 overlap-y-axis=0.0 "
+        f"hailotileaggregator name={aggregator} flatten-detections=true iou-threshold={iou_threshold} "
+        f"border-threshold={border_threshold} remove-large-landscape=false "
+    )
+
+
+class TileScheduler:
+    """
+    Configures hailotilecropper and switches between tiled and whole-frame inference.
+
+    Args:
+        tile_size (int): Network input size the tiles are cut for.
+        min_overlap (float): Minimum overlap between neighbouring tiles, as a fraction of the tile.
+        interval (int): Run the tile grid every Nth frame and the whole frame in between.
+            1 tiles every frame.
+    """
+    def __init__(self, tile_size=640, min_overlap=0.1, interval=1):
+        self.tile_size = tile_size
+        self.min_overlap = min_overlap
+        self.interval = max(interval, 1)
+        self.grid = None
+        self.cropper = None
+        self._current = None
+        # PTS -> wall clock time the frame entered the cropper, for end-to-end latency
+        self._entry_times = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.frames = 0
+        self.tiled_frames = 0
+        self.tiles = 0
+        self.latencies = []
+        self._stats_start = time.monotonic()
+
+    def attach(self, cropper, output_element):
+        """
+        Installs the scheduler on the cropper sink pad and measures latency up to the src pad
+        of output_element (normally identity_callback).
+        """
+        self.cropper = cropper
+        cropper.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, self._on_frame)
+        output_element.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self._on_output)
+
+    def _set_grid(self, grid):
+        # Only touch the element when the grid actually changes
+        if grid == self._current:
+            return
+        tiles_x, tiles_y, overlap_x, overlap_y = grid
+        self.cropper.set_property("tiles-along-x-axis", tiles_x)
+        self.cropper.set_property("tiles-along-y-axis", tiles_y)
+        self.cropper.set_property("overlap-x-axis", overlap_x)
+        self.cropper.set_property("overlap-y-axis", overlap_y)
+        self._current = grid
+
+    def _on_frame(self, pad, info):
+        buffer = info.get_buffer()
+        if buffer is None:
+            return Gst.PadProbeReturn.OK
+        if self.grid is None:
+            format, width, height = get_caps_from_pad(pad)
+            if width is None:
+                return Gst.PadProbeReturn.OK
+            self.grid = compute_tile_grid(width, height, self.tile_size, self.min_overlap)
+            print(f"Tiling {width}x{height} into {self.grid[0]}x{self.grid[1]} tiles, "
+                  f"overlap {self.grid[2]:.2f}/{self.grid[3]:.2f}, every {self.interval} frame(s)")
+
+        # The probe runs right before the cropper's chain function, so the grid applies to this buffer
+        tiled = self.frames % self.interval == 0
+        self._set_grid(self.grid if tiled else (1, 1, 0.0, 0.0))
+        self.frames += 1
+        if tiled:
+            self.tiled_frames += 1
+            self.tiles += self.grid[0] * self.grid[1]
+        else:
+            self.tiles += 1
+        self._entry_times[buffer.pts] = time.monotonic()
+        return Gst.PadProbeReturn.OK
+
+    def _on_output(self, pad, info):
+        buffer = info.get_buffer()
+        if buffer is not None:
+            start = self._entry_times.pop(buffer.pts, None)
+            if start is not None:
+                self.latencies.append(time.monotonic() - start)
+        # Forget frames that never made it out (e.g. dropped by a leaky queue)
+        if len(self._entry_times) > 300:
+            self._entry_times.clear()
+        return Gst.PadProbeReturn.OK
+
+    def get_stats(self):
+        elapsed = max(time.monotonic() - self._stats_start, 1e-6)
+        latencies = sorted(self.latencies)
+        return {
+            'frames': self.frames,
+            'tiled_frames': self.tiled_frames,
+            'tiles_per_sec': self.tiles / elapsed,
+            'fps': self.frames / elapsed,
+            'latency_ms_mean': 1e3 * sum(latencies) / len(latencies) if latencies else 0.0,
+            'latency_ms_p95': 1e3 * latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0,
+        }
+
+    def report(self):
+        stats = self.get_stats()
+        print(
+            f"Tiling: {stats['fps']:.1f} fps, {stats['tiles_per_sec']:.1f} tiles/s "
+            f"({stats['tiled_frames']}/{stats['frames']} frames tiled), "
+            f"latency mean {stats['latency_ms_mean']:.1f} ms p95 {stats['latency_ms_p95']:.1f} ms"
+        )
+        self.reset_stats()
+        return True
+
+
+def add_tiling_arguments(parser):
+    parser.add_argument("--tiles", action="store_true", help="Run inference on full-resolution tiles")
+    parser.add_argument("--tile-overlap", type=float, default=0.1, help="Minimum overlap between tiles (fraction)")
+    parser.add_argument(
+        "--tile-interval", type=int, default=1,
+        help="Run the tile grid every Nth frame and whole-frame inference in between. Above 1 every "
+             "tile is inferred as its own batch, so --tile-batch-size must be 1 or left out"
+    )
+    parser.add_argument(
+        "--tile-batch-size", type=int, default=None,
+        help="hailonet batch size in tiling mode; the number of tiles per frame of a camera by default, "
+             "the default batch size for files and 1 with --tile-interval"
+    )
+    parser.add_argument("--tile-report-interval", type=int, default=10, help="Seconds between tiling reports")
+    return parser
@@ -1,79 +1,499 @@
 import os
+import re
+import time
+import ctypes
+import errno
+import dataclasses
 import v4l2
 import fcntl
+from dataclasses import dataclass, field
+from typing import Optional
+
+# Control types without a value to read in the bulk VIDIOC_G_EXT_CTRLS snapshot
+UNREADABLE_TYPES = (v4l2.V4L2_CTRL_TYPE_BUTTON, v4l2.V4L2_CTRL_TYPE_CTRL_CLASS, v4l2.V4L2_CTRL_TYPE_STRING)
+# ctrl_class value that lets one VIDIOC_G/S_EXT_CTRLS call mix control classes (Linux 4.4+)
+V4L2_CTRL_WHICH_CUR_VAL = 0
+
+# Control metadata only changes when the device does, so it is enumerated once per device path
+_control_cache = {}
+
+# Controls that are only writable while another control has one of the given values; uvcvideo
+# answers EACCES otherwise. The controls they depend on are written first.
+CONTROL_DEPENDENCIES = {
+    'exposure_time_absolute': ('auto_exposure', (v4l2.V4L2_EXPOSURE_MANUAL, v4l2.V4L2_EXPOSURE_SHUTTER_PRIORITY)),
+    'white_balance_temperature': ('white_balance_automatic', (0,)),
+    'focus_absolute': ('focus_automatic_continuous', (0,)),
+}
+MASTER_CONTROLS = {master for master, _ in CONTROL_DEPENDENCIES.values()}
+
+
+def control_key(name):
+    """
+    v4l2-ctl style key of a control name, e.g. "White Balance, Automatic" -> "white_balance_automatic".
+    """
+    return re.sub(r'[^a-z0-9]+', '_', name.lower()).strip('_')
+
+
+@dataclass
+class ControlInfo:
+    id: int
+    name: str
+    type: int
+    minimum: int
+    maximum: int
+    step: int
+    default_value: int
+    flags: int
+    menu: dict = field(default_factory=dict)
+
+    @property
+    def key(self):
+        return control_key(self.name)
+
+    @property
+    def readable(self):
+        return self.type not in UNREADABLE_TYPES and not self.flags & v4l2.V4L2_CTRL_FLAG_WRITE_ONLY
+
+
+# archive/hailo_object_detector.py keeps its own copy with the same defaults; the archive is
+# frozen and nothing imports it, this is the definition the current code uses
+@dataclass
+class CameraSettings:
+    brightness: int = 10
+    contrast: int = 40
+    saturation: int = 70
+    hue: int = 0
+    white_balance_automatic: bool = True
+    gamma: int = 150
+    gain: int = 5
+    power_line_frequency: int = 2  # 60 Hz for North American NTSC
+    sharpness: int = 4
+    backlight_compensation: int = 1
+    auto_exposure: int = 3  # Aperture Priority Mode
+    exposure_dynamic_framerate: bool = False
+    # Manual values, only written while the matching automatic mode is off; None leaves them alone
+    exposure_time_absolute: Optional[int] = None
+    white_balance_temperature: Optional[int] = None
+
+    def to_controls(self):
+        """
+        Returns control key to integer value for every field that is set.
+        """
+        return {key: int(value) for key, value in dataclasses.asdict(self).items() if value is not None}
+
+
+# Profiles for switching between daylight and the night sky. Night uses a long manual exposure
+# with high gain; manual white balance keeps stars from shifting colour as the scene darkens.
+DAY_SETTINGS = CameraSettings()
+NIGHT_SETTINGS = CameraSettings(
+    brightness=0,
+    contrast=40,
+    white_balance_automatic=False,
+    gamma=100,
+    gain=80,
+    sharpness=2,
+    backlight_compensation=0,
+    auto_exposure=v4l2.V4L2_EXPOSURE_MANUAL,
+    exposure_dynamic_framerate=True,
+    exposure_time_absolute=2000,
+    white_balance_temperature=4600,
+)
+
+
+@dataclass
+class ApplyResult:
+    """
+    Outcome of UVCCamera.apply_settings.
+
+    Attributes:
+        changed (dict): Control key to (old value, new value) of the controls written.
+        skipped (dict): Control key to reason for desired values that were not written
+            (unsupported, read-only, out of range or inactive).
+        failed (dict): Control key to reason for writes the driver rejected or that read back
+            a different value.
+        ioctls (int): Number of ioctls issued.
+        elapsed (float): Seconds taken.
+    """
+    changed: dict = field(default_factory=dict)
+    skipped: dict = field(default_factory=dict)
+    failed: dict = field(default_factory=dict)
+    ioctls: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def ok(self):
+        return not self.failed
 
 
 class UVCCamera:
-    def __init__(self, device='/dev/video0'):
+    """
+    V4L2 controls of a UVC camera.
+
+    Args:
+        device (str): Video device path.
+        ioctl (callable, optional): Replacement for fcntl.ioctl, e.g. FakeV4L2Device.ioctl from
+            fake_v4l2.py to run without a camera. The device is only opened for the real one.
+    """
+    def __init__(self, device='/dev/video0', ioctl=None):
         self.device = device
-        self.fd = os.open(self.device, os.O_RDWR)
-    
+        self._ioctl = ioctl or fcntl.ioctl
+        self.fd = os.open(self.device, os.O_RDWR) if ioctl is None else -1
+        # Preallocated VIDIOC_G_EXT_CTRLS request covering every readable control
+        self._snapshot = None
+        self._bulk_reads = True
+        # Control values as of the last snapshot or write, what apply_settings diffs against
+        self.state = None
+
     def get_control_value(self, control_id):
         ctrl = v4l2.v4l2_control()
         ctrl.id = control_id
-        fcntl.ioctl(self.fd, v4l2.VIDIOC_G_CTRL, ctrl)
+        self._ioctl(self.fd, v4l2.VIDIOC_G_CTRL, ctrl)
         return ctrl.value
-    
+
     def set_control_value(self, control_id, value):
         ctrl = v4l2.v4l2_control()
         ctrl.id = control_id
         ctrl.value = value
-        fcntl.ioctl(self.fd, v4l2.VIDIOC_S_CTRL, ctrl)
-    
-    def get_all_controls(self):
-        queryctrl = v4l2.v4l2_queryctrl()
-        controls = {}
+        self._ioctl(self.fd, v4l2.VIDIOC_S_CTRL, ctrl)
 
-        control_id = v4l2.V4L2_CID_BASE
-        while control_id < v4l2.V4L2_CID_LASTP1:
-            queryctrl.id = control_id
-            try:
-                fcntl.ioctl(self.fd, v4l2.VIDIOC_QUERYCTRL, queryctrl)
-                if not (queryctrl.flags & v4l2.V4L2_CTRL_FLAG_DISABLED):
-                    control_info = {
-                        'id': queryctrl.id,
-                        'name': queryctrl.name.decode(),
-                        'minimum': queryctrl.minimum,
-                        'maximum': queryctrl.maximum,
-                        'step': queryctrl.step,
-                        'default_value': queryctrl.default_value,
-                        'current_value': self.get_control_value(queryctrl.id),
-                    }
-                    controls[queryctrl.name.decode()] = control_info
-            except IOError:
-                pass
-            
-            control_id += 1
-
-        control_id = v4l2.V4L2_CID_PRIVATE_BASE
+    def enumerate_controls(self):
+        """
+        Walks the driver's control list with V4L2_CTRL_FLAG_NEXT_CTRL, which covers the user,
+        camera and every other class including driver-private controls, and decodes the items
+        of menu controls.
+
+        Returns:
+            list: ControlInfo of every enabled control.
+        """
+        controls = []
+        queryctrl = v4l2.v4l2_queryctrl()
+        queryctrl.id = v4l2.V4L2_CTRL_FLAG_NEXT_CTRL
         while True:
-            queryctrl.id = control_id
             try:
-                fcntl.ioctl(self.fd, v4l2.VIDIOC_QUERYCTRL, queryctrl)
-                if not (queryctrl.flags & v4l2.V4L2_CTRL_FLAG_DISABLED):
-                    control_info = {
-                        'id': queryctrl.id,
-                        'name': queryctrl.name.decode(),
-                        'minimum': queryctrl.minimum,
-                        'maximum': queryctrl.maximum,
-                        'step': queryctrl.step,
-                        'default_value': queryctrl.default_value,
-                        'current_value': self.get_control_value(queryctrl.id),
-                    }
-                    controls[queryctrl.name.decode()] = control_info
-            except IOError:
+                self._ioctl(self.fd, v4l2.VIDIOC_QUERYCTRL, queryctrl)
+            except OSError:
+                # EINVAL past the last control
                 break
-            
-            control_id += 1
-        
+            if queryctrl.type != v4l2.V4L2_CTRL_TYPE_CTRL_CLASS and not queryctrl.flags & v4l2.V4L2_CTRL_FLAG_DISABLED:
+                info = ControlInfo(
+                    id=queryctrl.id,
+                    name=queryctrl.name.decode(),
+                    type=queryctrl.type,
+                    minimum=queryctrl.minimum,
+                    maximum=queryctrl.maximum,
+                    step=queryctrl.step,
+                    default_value=queryctrl.default,
+                    flags=queryctrl.flags,
+                )
+                if info.type == v4l2.V4L2_CTRL_TYPE_MENU:
+                    info.menu = self._query_menu(info)
+                controls.append(info)
+            queryctrl.id |= v4l2.V4L2_CTRL_FLAG_NEXT_CTRL
         return controls
-    
-    def configure_camera(self, config):
-        for control_name, settings in config.items():
+
+    def _query_menu(self, info):
+        menu = {}
+        querymenu = v4l2.v4l2_querymenu()
+        for index in range(info.minimum, info.maximum + 1):
+            querymenu.id = info.id
+            querymenu.index = index
+            try:
+                self._ioctl(self.fd, v4l2.VIDIOC_QUERYMENU, querymenu)
+            except OSError:
+                # Menus may have holes, e.g. auto_exposure on UVC only offers 1 and 3
+                continue
+            menu[index] = querymenu.name.decode()
+        return menu
+
+    def get_controls(self, refresh=False):
+        """
+        Returns the cached ControlInfo list of this device, enumerating it on first use.
+        """
+        if refresh or self.device not in _control_cache:
+            _control_cache[self.device] = self.enumerate_controls()
+        return _control_cache[self.device]
+
+    @staticmethod
+    def invalidate_control_cache(device=None):
+        if device is None:
+            _control_cache.clear()
+        else:
+            _control_cache.pop(device, None)
+
+    def _build_snapshot(self):
+        all_controls = self.get_controls()
+        controls = [info for info in all_controls if info.readable]
+        array = (v4l2.v4l2_ext_control * len(controls))()
+        for item, info in zip(array, controls):
+            item.id = info.id
+        request = v4l2.v4l2_ext_controls()
+        request.ctrl_class = V4L2_CTRL_WHICH_CUR_VAL
+        request.count = len(controls)
+        request.controls = ctypes.cast(array, ctypes.POINTER(v4l2.v4l2_ext_control))
+        # Keep the array alive as long as the request points at it
+        self._snapshot = (all_controls, controls, array, request)
+
+    def get_control_values(self):
+        """
+        Reads the current value of every readable control, normally with a single
+        VIDIOC_G_EXT_CTRLS call.
+
+        Returns:
+            dict: Control key to value; None for controls that could not be read.
+        """
+        # Rebuild the request when the cached metadata was refreshed or invalidated
+        if self._snapshot is None or self._snapshot[0] is not _control_cache.get(self.device):
+            self._build_snapshot()
+        _, controls, array, request = self._snapshot
+        if self._bulk_reads and controls:
+            try:
+                self._ioctl(self.fd, v4l2.VIDIOC_G_EXT_CTRLS, request)
+            except OSError as e:
+                # Kernels before 4.4 cannot mix classes, and one failing control fails the
+                # whole call; fall back to one control per call from now on
+                if e.errno not in (errno.EINVAL, errno.EACCES, errno.EIO):
+                    raise
+                self._bulk_reads = False
+        if not self._bulk_reads:
+            values = {info.key: self._read_one(info) for info in controls}
+        else:
+            values = {
+                info.key: item.value64 if info.type == v4l2.V4L2_CTRL_TYPE_INTEGER64 else item.value
+                for item, info in zip(array, controls)
+            }
+        self.state = values
+        return values
+
+    def _read_one(self, info):
+        item = v4l2.v4l2_ext_control()
+        item.id = info.id
+        request = v4l2.v4l2_ext_controls()
+        request.ctrl_class = v4l2.V4L2_CTRL_ID2CLASS(info.id)
+        request.count = 1
+        request.controls = ctypes.pointer(item)
+        try:
+            self._ioctl(self.fd, v4l2.VIDIOC_G_EXT_CTRLS, request)
+        except OSError:
+            return None
+        return item.value64 if info.type == v4l2.V4L2_CTRL_TYPE_INTEGER64 else item.value
+
+    def get_all_controls(self, refresh=False):
+        """
+        Returns control name to metadata and current value. Metadata comes from the per-device
+        cache unless refresh is set, so a call normally costs one ioctl.
+        """
+        controls = self.get_controls(refresh)
+        values = self.get_control_values()
+        return {
+            info.name: {
+                'id': info.id,
+                'name': info.name,
+                'key': info.key,
+                'type': info.type,
+                'minimum': info.minimum,
+                'maximum': info.maximum,
+                'step': info.step,
+                'default_value': info.default_value,
+                'flags': info.flags,
+                'menu': info.menu,
+                'current_value': values.get(info.key),
+            }
+            for info in controls
+        }
+
+    def apply_settings(self, settings, verify=True, refresh=False):
+        """
+        Writes the desired settings, touching only the controls whose value differs from the
+        cached device state.
+
+        Changed controls go out in one VIDIOC_S_EXT_CTRLS call, the controls others depend on
+        (auto_exposure, white_balance_automatic, ...) first. Values for controls that stay
+        inactive under the desired modes are skipped instead of failing the whole call. With
+        verify, one VIDIOC_G_EXT_CTRLS reads the result back and refreshes the cached state.
+
+        Args:
+            settings (CameraSettings or dict): Desired values, by control key.
+            verify (bool): Read the controls back after writing.
+            refresh (bool): Read the device state before diffing instead of using the cache.
+
+        Returns:
+            ApplyResult
+        """
+        start = time.perf_counter()
+        result = ApplyResult()
+        desired = settings.to_controls() if isinstance(settings, CameraSettings) else dict(settings)
+        controls = {info.key: info for info in self.get_controls()}
+        if refresh or self.state is None:
+            self.get_control_values()
+            result.ioctls += 1
+
+        # Modes the device will be in once the desired values are written
+        target = dict(self.state)
+        target.update({key: value for key, value in desired.items() if key in controls})
+        changes = []
+        for key, value in desired.items():
+            info = controls.get(key)
+            if info is None:
+                result.skipped[key] = "not supported by the device"
+                continue
+            if info.flags & v4l2.V4L2_CTRL_FLAG_READ_ONLY:
+                result.skipped[key] = "read-only"
+                continue
+            if not info.minimum <= value <= info.maximum or (info.menu and value not in info.menu):
+                result.skipped[key] = f"{value} out of range [{info.minimum}, {info.maximum}]"
+                continue
+            dependency = CONTROL_DEPENDENCIES.get(key)
+            if dependency is not None and dependency[0] in target and target[dependency[0]] not in dependency[1]:
+                result.skipped[key] = f"inactive while {dependency[0]}={target[dependency[0]]}"
+                continue
+            if self.state.get(key) != value:
+                changes.append((info, value))
+        if not changes:
+            result.elapsed = time.perf_counter() - start
+            return result
+
+        # Stable sort: controls others depend on first, the rest in the order given
+        changes.sort(key=lambda change: change[0].key not in MASTER_CONTROLS)
+        written = self._write_controls(changes, result)
+        for info, value in written:
+            result.changed[info.key] = (self.state.get(info.key), value)
+            self.state[info.key] = value
+
+        if verify:
+            values = self.get_control_values()
+            result.ioctls += 1
+            for info, value in written:
+                if values.get(info.key) != value:
+                    result.failed[info.key] = f"reads back {values.get(info.key)}"
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    def _write_request(self, changes, ctrl_class=V4L2_CTRL_WHICH_CUR_VAL):
+        array = (v4l2.v4l2_ext_control * len(changes))()
+        for item, (info, value) in zip(array, changes):
+            item.id = info.id
+            if info.type == v4l2.V4L2_CTRL_TYPE_INTEGER64:
+                item.value64 = value
+            else:
+                item.value = value
+        request = v4l2.v4l2_ext_controls()
+        request.ctrl_class = ctrl_class
+        request.count = len(changes)
+        request.controls = ctypes.cast(array, ctypes.POINTER(v4l2.v4l2_ext_control))
+        return array, request
+
+    def _write_controls(self, changes, result):
+        # Returns the (info, value) pairs that were written. The driver applies a request
+        # atomically and reports the failing control in error_idx; that control is dropped
+        # and the rest retried.
+        pending = list(changes)
+        while pending:
+            array, request = self._write_request(pending)
+            result.ioctls += 1
             try:
-                self.set_control_value(settings['id'], settings['current_value'])
-            except Exception as e:
-                print(f"Error setting {control_name}: {e}")
-    
+                self._ioctl(self.fd, v4l2.VIDIOC_S_EXT_CTRLS, request)
+                return pending
+            except OSError as e:
+                if request.error_idx >= len(pending):
+                    # Rejected as a whole (e.g. mixed classes before Linux 4.4): one per call
+                    return self._write_one_by_one(pending, result)
+                info, value = pending.pop(request.error_idx)
+                result.failed[info.key] = f"{value}: {os.strerror(e.errno)}"
+        return pending
+
+    def _write_one_by_one(self, changes, result):
+        written = []
+        for info, value in changes:
+            array, request = self._write_request([(info, value)], v4l2.V4L2_CTRL_ID2CLASS(info.id))
+            result.ioctls += 1
+            try:
+                self._ioctl(self.fd, v4l2.VIDIOC_S_EXT_CTRLS, request)
+                written.append((info, value))
+            except OSError as e:
+                result.failed[info.key] = f"{value}: {os.strerror(e.errno)}"
+        return written
+
+    def configure_camera(self, config):
+        """
+        Applies a control dict as returned by get_all_controls, writing only what changed.
+        """
+        desired = {
+            settings.get('key', control_key(control_name)): settings['current_value']
+            for control_name, settings in config.items()
+            if settings.get('current_value') is not None
+        }
+        result = self.apply_settings(desired)
+        for key, reason in result.failed.items():
+            print(f"Error setting {key}: {reason}")
+        return result
+
+    def set_format(self, width, height, pixel_format='YUYV'):
+        """
+        Sets the capture format with VIDIOC_S_FMT unless it is already current.
+
+        Returns:
+            tuple: (width, height, pixel_format) the driver settled on, which may differ from
+            the request when the camera does not support it.
+        """
+        fmt = v4l2.v4l2_format()
+        fmt.type = v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE
+        self._ioctl(self.fd, v4l2.VIDIOC_G_FMT, fmt)
+        fourcc = v4l2.v4l2_fourcc(*pixel_format)
+        pix = fmt.fmt.pix
+        if (pix.width, pix.height, pix.pixelformat) != (width, height, fourcc):
+            pix.width = width
+            pix.height = height
+            pix.pixelformat = fourcc
+            self._ioctl(self.fd, v4l2.VIDIOC_S_FMT, fmt)
+        applied = pix.pixelformat.to_bytes(4, 'little').decode()
+        return pix.width, pix.height, applied
+
     def close(self):
-        os.close(self.fd)
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="List the controls of a UVC camera and time control snapshots")
+    parser.add_argument("--device", default="/dev/video0")
+    parser.add_argument("--fake", action="store_true", help="Use the simulated camera from fake_v4l2.py")
+    parser.add_argument("--latency-ms", type=float, default=0.2, help="Simulated time per ioctl")
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--profiles", action="store_true",
+                        help="Switch between the night and day profiles and time it (writes to the camera)")
+    args = parser.parse_args()
+
+    fake = None
+    if args.fake:
+        from fake_v4l2 import FakeV4L2Device
+        fake = FakeV4L2Device(latency=args.latency_ms / 1e3)
+    camera = UVCCamera(args.device, ioctl=fake.ioctl if fake else None)
+
+    start = time.perf_counter()
+    controls = camera.get_all_controls()
+    cold = time.perf_counter() - start
+    cold_calls = fake.total_calls() if fake else None
+
+    for name, info in controls.items():
+        menu = f" {info['menu']}" if info['menu'] else ""
+        print(f"{info['key']:<32}{info['current_value']!s:>8}  [{info['minimum']}, {info['maximum']}] default {info['default_value']}{menu}")
+
+    start = time.perf_counter()
+    for _ in range(args.iterations):
+        camera.get_all_controls()
+    warm = (time.perf_counter() - start) / args.iterations
+    print(f"First snapshot: {cold * 1e3:.2f} ms" + (f", {cold_calls} ioctls" if fake else ""))
+    print(f"Cached snapshot: {warm * 1e3:.3f} ms" +
+          (f", {(fake.total_calls() - cold_calls) / args.iterations:.0f} ioctl(s)" if fake else ""))
+
+    if args.profiles:
+        for name, settings in [('night', NIGHT_SETTINGS), ('day', DAY_SETTINGS), ('day', DAY_SETTINGS)]:
+            result = camera.apply_settings(settings)
+            print(f"Switch to {name}: {result.elapsed * 1e3:.2f} ms, {result.ioctls} ioctl(s), "
+                  f"{len(result.changed)} changed, {len(result.skipped)} skipped, {len(result.failed)} failed")
+            for key, reason in {**result.skipped, **result.failed}.items():
+                print(f"  {key}: {reason}")
+    camera.close()
@@ -0,0 +1,269 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+from detection_batch import DetectionBatch, LabelTable
+
+# -----------------------------------------------------------------------------------------------
+# Host-side YOLOv8 post-processing
+# -----------------------------------------------------------------------------------------------
+# Decodes the raw outputs of a YOLOv8 HEF compiled without on-chip NMS, driven by the same
+# JSON config the Hailo NMS uses (models/yolov8m_nms_config.json):
+# - every bbox_decoder contributes a (B, H, W, 4 * regression_length) box tensor and a
+#   (B, H, W, classes) score tensor at its stride
+# - anchors of all strides are concatenated once, so score thresholding, the DFL softmax and
+#   the distance-to-box decode run as single vectorized passes over the whole batch
+# - DFL is only evaluated for anchors that have at least one class above the score threshold
+# - candidates are capped at PRE_NMS_FACTOR * max_proposals_per_class per (image, class) before
+#   decoding, NMS runs for every image and class of the batch at once on padded per-group ranks,
+#   and max_proposals_per_class applies to the boxes that survive it
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../models/yolov8m_nms_config.json')
+
+
+# Candidates per group entering NMS, as a multiple of the boxes kept per group. The cap bounds the
+# suppression work; it is well above what one class of a real frame puts above the threshold.
+PRE_NMS_FACTOR = 30
+
+
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def batched_nms(boxes, scores, groups, iou_threshold, max_per_group, max_candidates=None):
+    """
+    Class-aware NMS over many groups (e.g. image x class) at once.
+
+    Candidates are ranked within their group and the best max_candidates of every group are
+    scattered into a padded (groups, K) layout. Suppression walks the K ranks once, handling
+    every group in the same vectorized step, and the max_per_group cap applies to the boxes that
+    survive it: a dense cluster of overlapping boxes suppresses itself instead of filling the
+    cap and pushing out separate objects of the same group.
+
+    Args:
+        boxes (np.ndarray): (N, 4) xyxy boxes.
+        scores (np.ndarray): (N,) scores.
+        groups (np.ndarray): (N,) integer group of every box; boxes of different groups never
+            suppress each other.
+        iou_threshold (float): Boxes overlapping a kept box by more than this are suppressed.
+        max_per_group (int): Most boxes kept per group.
+        max_candidates (int, optional): Most candidates per group entering NMS, defaults to
+            PRE_NMS_FACTOR * max_per_group.
+
+    Returns:
+        np.ndarray: Indices of the kept boxes, sorted by group and descending score.
+    """
+    if len(scores) == 0:
+        return np.zeros(0, dtype=np.intp)
+    order, group_index, rank = rank_within_groups(scores, groups, max_candidates or PRE_NMS_FACTOR * max_per_group)
+    k = int(rank.max()) + 1
+    padded = np.zeros((group_index[-1] + 1, k, 4), dtype=np.float32)
+    padded[group_index, rank] = boxes[order]
+    keep = np.zeros(padded.shape[:2], dtype=bool)
+    keep[group_index, rank] = True
+    areas = (padded[:, :, 2] - padded[:, :, 0]) * (padded[:, :, 3] - padded[:, :, 1])
+    kept = np.zeros(len(padded), dtype=np.int64)
+
+    for i in range(k):
+        # Boxes of rank i that survived the boxes above them, within the cap of their group
+        current = keep[:, i] & (kept < max_per_group)
+        keep[:, i] = current
+        rows = np.flatnonzero(current)
+        if not len(rows):
+            continue
+        kept[rows] += 1
+        if i + 1 == k:
+            break
+        box = padded[rows, i, None]
+        rest = padded[rows, i + 1:]
+        width = np.minimum(box[..., 2], rest[..., 2]) - np.maximum(box[..., 0], rest[..., 0])
+        height = np.minimum(box[..., 3], rest[..., 3]) - np.maximum(box[..., 1], rest[..., 1])
+        intersection = np.maximum(width, 0) * np.maximum(height, 0)
+        # iou > t  <=>  intersection > t * union, without the division
+        overlaps = intersection * (1 + iou_threshold) > iou_threshold * (areas[rows, i, None] + areas[rows, i + 1:])
+        keep[rows, i + 1:] &= ~overlaps
+    return order[keep[group_index, rank]]
+
+
+def rank_within_groups(scores, groups, limit):
+    """
+    Sorts candidates by group and descending score and keeps the best `limit` of each group.
+
+    Returns:
+        tuple: (order, group_index, rank) - candidate indices, the dense index of their group
+        and their rank within it.
+    """
+    order = np.lexsort((-scores, groups))
+    sorted_groups = groups[order]
+    new_group = np.r_[True, sorted_groups[1:] != sorted_groups[:-1]]
+    starts = np.flatnonzero(new_group)
+    group_index = np.cumsum(new_group) - 1
+    rank = np.arange(len(order)) - starts[group_index]
+    selected = rank < limit
+    return order[selected], group_index[selected], rank[selected]
+
+
+class YoloV8PostProcess:
+    """
+    Vectorized YOLOv8 DFL decode and batched class-aware NMS.
+
+    Args:
+        config_path (str): Hailo NMS config JSON (bbox_decoders, classes, regression_length, ...).
+        score_threshold (float, optional): Overrides nms_scores_th from the config.
+        iou_threshold (float, optional): Overrides nms_iou_th from the config.
+        apply_sigmoid (bool): Set when the score outputs are logits rather than probabilities.
+        labels (dict, optional): Class id to label mapping for the returned batches.
+    """
+    def __init__(self, config_path=DEFAULT_CONFIG, score_threshold=None, iou_threshold=None,
+                 apply_sigmoid=False, labels=None):
+        with open(config_path, 'r') as f:
+            config = json.load(f)
+        self.config = config
+        self.num_classes = config['classes']
+        self.regression_length = config['regression_length']
+        self.image_height, self.image_width = config['image_dims']
+        self.score_threshold = config['nms_scores_th'] if score_threshold is None else score_threshold
+        self.iou_threshold = config['nms_iou_th'] if iou_threshold is None else iou_threshold
+        self.max_proposals_per_class = config['max_proposals_per_class']
+        self.apply_sigmoid = apply_sigmoid
+        self._threshold = np.log(self.score_threshold / (1.0 - self.score_threshold)) if apply_sigmoid else self.score_threshold
+        self.decoders = config['bbox_decoders']
+        self.label_table = LabelTable(labels)
+
+        # Anchor centres and strides of all decoders, concatenated in decoder order
+        centres, strides = [], []
+        for decoder in self.decoders:
+            stride = decoder['stride']
+            grid_h, grid_w = self.image_height // stride, self.image_width // stride
+            ys, xs = np.mgrid[0:grid_h, 0:grid_w]
+            centres.append((np.stack([xs.ravel(), ys.ravel()], axis=1) + 0.5) * stride)
+            strides.append(np.full(grid_h * grid_w, stride))
+        self.anchor_centres = np.concatenate(centres).astype(np.float32)
+        self.anchor_strides = np.concatenate(strides).astype(np.float32)
+        self.num_anchors = len(self.anchor_centres)
+        self.dfl_bins = np.arange(self.regression_length, dtype=np.float32)
+
+    def _gather(self, outputs, key, channels):
+        # (B, H, W, C) tensors of every decoder -> (B, anchors, C)
+        tensors = []
+        for index, decoder in enumerate(self.decoders):
+            tensor = outputs[decoder[key]] if isinstance(outputs, dict) else outputs[2 * index + (key == 'cls_layer')]
+            tensor = np.asarray(tensor, dtype=np.float32)
+            if tensor.ndim == 3:
+                tensor = tensor[None]
+            tensors.append(tensor.reshape(tensor.shape[0], -1, channels))
+        return np.concatenate(tensors, axis=1)
+
+    def decode_boxes(self, regression, anchors):
+        """
+        DFL decode of (K, 4 * regression_length) regression rows for the given anchor indices.
+
+        Returns:
+            np.ndarray: (K, 4) xyxy boxes in input image pixels.
+        """
+        logits = regression.reshape(-1, 4, self.regression_length)
+        logits = logits - logits.max(axis=2, keepdims=True)
+        weights = np.exp(logits)
+        distances = (weights @ self.dfl_bins) / weights.sum(axis=2)
+        distances *= self.anchor_strides[anchors, None]
+        centres = self.anchor_centres[anchors]
+        return np.hstack([centres - distances[:, :2], centres + distances[:, 2:]])
+
+    def __call__(self, outputs, pts=None):
+        """
+        Post-processes a batch of raw outputs.
+
+        Args:
+            outputs: Dict of layer name (reg_layer/cls_layer from the config) to (B, H, W, C)
+                arrays, or a list ordered [reg_0, cls_0, reg_1, cls_1, ...].
+            pts (list, optional): Presentation timestamps of the batch images.
+
+        Returns:
+            list: One DetectionBatch per image, boxes normalized to [0, 1].
+        """
+        regression = self._gather(outputs, 'reg_layer', 4 * self.regression_length)
+        scores = self._gather(outputs, 'cls_layer', self.num_classes)
+        batch_size = scores.shape[0]
+
+        # (image, anchor, class) of every score above the threshold. Overlapping boxes of one
+        # object crowd the top ranks, so the pre-NMS cap is a multiple of the final one
+        images, anchors, classes = np.nonzero(scores > self._threshold)
+        confidences = scores[images, anchors, classes]
+        if self.apply_sigmoid:
+            # sigmoid is monotonic: threshold the logits and only activate the candidates
+            confidences = sigmoid(confidences)
+        groups = images * self.num_classes + classes
+        selected, _, _ = rank_within_groups(confidences, groups, PRE_NMS_FACTOR * self.max_proposals_per_class)
+        images, anchors, classes = images[selected], anchors[selected], classes[selected]
+        confidences, groups = confidences[selected], groups[selected]
+
+        # DFL only for the anchors that survived, each decoded once even if several classes fired
+        flat_anchor = images * self.num_anchors + anchors
+        unique_anchors, inverse = np.unique(flat_anchor, return_inverse=True)
+        boxes = self.decode_boxes(
+            regression.reshape(-1, regression.shape[2])[unique_anchors], unique_anchors % self.num_anchors
+        )[inverse.ravel()]
+
+        keep = batched_nms(boxes, confidences, groups, self.iou_threshold, self.max_proposals_per_class)
+
+        results = []
+        scale = np.array([self.image_width, self.image_height] * 2, dtype=np.float32)
+        for image in range(batch_size):
+            selected = keep[images[keep] == image]
+            results.append(DetectionBatch(
+                pts[image] if pts is not None else 0,
+                classes[selected].astype(np.int32),
+                confidences[selected].astype(np.float32),
+                np.clip(boxes[selected] / scale, 0.0, 1.0).astype(np.float32),
+                self.label_table,
+            ))
+        return results
+
+
+def make_synthetic_outputs(post_process, batch_size, objects, rng):
+    """
+    Raw outputs with mostly background scores and a few confident objects, as logits.
+    The background still puts a few dozen candidates per class above the default 0.001 score
+    threshold, which is what a real frame looks like to the NMS.
+    """
+    outputs = {}
+    for decoder in post_process.decoders:
+        stride = decoder['stride']
+        shape = (batch_size, post_process.image_height // stride, post_process.image_width // stride)
+        outputs[decoder['reg_layer']] = rng.normal(0, 1, shape + (4 * post_process.regression_length,)).astype(np.float32)
+        scores = rng.normal(-11, 1.5, shape + (post_process.num_classes,)).astype(np.float32)
+        for image in range(batch_size):
+            ys = rng.integers(0, shape[1], objects)
+            xs = rng.integers(0, shape[2], objects)
+            scores[image, ys, xs, rng.integers(0, post_process.num_classes, objects)] = 4.0
+        outputs[decoder['cls_layer']] = scores
+    return outputs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark YOLOv8 host post-processing on synthetic tensors")
+    parser.add_argument("--config", default=DEFAULT_CONFIG)
+    parser.add_argument("--batch-size", type=int, default=2)
+    parser.add_argument("--objects", type=int, default=20, help="Confident objects per image and stride")
+    parser.add_argument("--score-threshold", type=float, default=None, help="Defaults to nms_scores_th")
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    post_process = YoloV8PostProcess(args.config, score_threshold=args.score_threshold, apply_sigmoid=True)
+    rng = np.random.default_rng(0)
+    outputs = make_synthetic_outputs(post_process, args.batch_size, args.objects, rng)
+    post_process(outputs)
+
+    timings = []
+    for _ in range(args.iterations):
+        start = time.perf_counter()
+        results = post_process(outputs)
+        timings.append(time.perf_counter() - start)
+    timings = np.array(timings) * 1e3
+    per_batch = np.median(timings)
+    print(f"Anchors: {post_process.num_anchors}, classes: {post_process.num_classes}, "
+          f"score threshold: {post_process.score_threshold}, batch size: {args.batch_size}")
+    print(f"Detections per image: {[len(result) for result in results]}")
+    print(f"Post-process: median {per_batch:.2f} ms/batch, p95 {np.percentile(timings, 95):.2f} ms/batch, "
+          f"{1e3 * args.batch_size / per_batch:.0f} frames/s")